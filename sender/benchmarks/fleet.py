@@ -0,0 +1,608 @@
+#!/usr/bin/env python3
+# Fleet load test: how many plates one bridge can drive.
+#
+# A Bridge is run on a recorded forecast (forecast.json) against in-process MQTT broker stand-ins,
+# that deliver every message to the subscribers after a configurable network latency. Each of the
+# N simulated plates subscribes to hasp/<plate>/command/# and applies the commands to the pages of
+# files/pages_section.jsonl (see tools/plate_simulator.py). Between the cycles, plates reboot (they
+# come back with blank pages) or drop off the network (their LWT goes offline), at random, and
+# reconnect after some cycles, getting their state from the bridge when state_snapshot is on.
+#
+# Reported: the end-to-end latency per plate, from the fetch to the last command received, as
+# p50 and p99 over the cycles, the throughput in messages per second, and the memory held by
+# the brokers (retained messages and the peak of queued messages).
+#
+# The stand-ins replace paho-mqtt in this process only: shards, that run in other processes,
+# can not be load tested this way.
+#
+# Usage, from the sender folder:
+#     python3 benchmarks/fleet.py [--plates 50] [--cycles 10] [--latency 5] [--jitter 2] [--brokers 1]
+#         [--reboot-rate 0.02] [--drop-rate 0.02] [--offline-cycles 1] [--state-snapshot] [--json]
+
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Callable, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SENDER_DIR = os.path.dirname(BENCH_DIR)
+PACKAGE_DIR = os.path.join(SENDER_DIR, "meteofrance2openhasp")
+TOOLS_DIR = os.path.join(SENDER_DIR, "tools")
+FORECAST_FILE = os.path.join(BENCH_DIR, "forecast.json")
+
+# the stand-in brokers, per host name in the MQTT configuration
+BROKERS: dict[str, "StandInBroker"] = {}
+
+# maximum time to wait for the brokers to deliver everything, after a cycle
+IDLE_TIMEOUT = 60
+
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    """ True when an MQTT topic matches a subscription, with + and # wildcards """
+    parts = topic.split("/")
+    for i, level in enumerate(pattern.split("/")):
+        if level == "#":
+            return True
+        if i >= len(parts) or (level != "+" and level != parts[i]):
+            return False
+    return len(parts) == len(pattern.split("/"))
+
+
+def percentile(values: list[float], p: float) -> float:
+    """ the p-th percentile of the values, nearest rank """
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+class MessageInfo:
+
+    def __init__(self, due: float, connected: bool = True):
+        self._due = due
+        self._connected = connected
+
+    def is_published(self) -> bool:
+        return self._connected and time.monotonic() >= self._due
+
+    def wait_for_publish(self, timeout: Optional[float] = None):
+        if not self._connected:
+            raise RuntimeError("The client is not currently connected.")
+        wait = self._due - time.monotonic()
+        if wait > 0:
+            time.sleep(wait if timeout is None else min(wait, timeout))
+
+
+class StandInBroker:
+
+    def __init__(self, name: str, latency: float, jitter: float, publish_latency: float, rng: random.Random):
+        """ an in-process MQTT broker stand-in: subscriptions, retained messages, and delivery after a latency
+
+        Args:
+            name (str): the host name, in the MQTT configuration
+            latency (float): seconds from the broker to a subscriber
+            jitter (float): maximum seconds added to or removed from the latency, at random
+            publish_latency (float): seconds from a publisher to the broker, waited for by wait_for_publish()
+            rng (random.Random): random generator, for the jitter
+        """
+        self.name = name
+        self.publish_latency = publish_latency
+        self._latency = latency
+        self._jitter = jitter
+        self._rng = rng
+        self._cond = threading.Condition()
+        # per subscriber: its subscriptions and its callback(topic, payload, retained)
+        self._subscribers: dict[str, tuple[list[str], Callable[[str, str, bool], None]]] = {}
+        self._retained: dict[str, str] = {}
+        # (due, sequence, subscriber, topic, payload, retained), delivered by the delivery thread
+        self._queue: list[tuple[float, int, str, str, str, bool]] = []
+        self._seq = itertools.count()
+        # per subscriber, the due time of its last message: a subscriber gets its messages in order
+        self._last_due: dict[str, float] = {}
+        self._delivering = 0
+        self._closed = False
+        self.published = 0
+        self.delivered = 0
+        # the retained messages delivered on subscription: not published in a cycle
+        self.delivered_retained = 0
+        self.dropped = 0
+        self.bytes = 0
+        self._queued_bytes = 0
+        self.peak_queued = 0
+        self.peak_queued_bytes = 0
+        self._thread = threading.Thread(target=self._deliver, name=f"broker-{name}", daemon=True)
+        self._thread.start()
+
+    def _enqueue(self, subscriber: str, topic: str, payload: str, retained: bool):
+        """ queue a message for a subscriber. Called with the lock held. """
+        delay = max(self._latency + self._rng.uniform(-self._jitter, self._jitter), 0)
+        due = max(time.monotonic() + delay, self._last_due.get(subscriber, 0))
+        self._last_due[subscriber] = due
+        heapq.heappush(self._queue, (due, next(self._seq), subscriber, topic, payload, retained))
+        self._queued_bytes += len(topic) + len(payload)
+        self.peak_queued = max(self.peak_queued, len(self._queue))
+        self.peak_queued_bytes = max(self.peak_queued_bytes, self._queued_bytes)
+        self._cond.notify_all()
+
+    def publish(self, topic: str, payload: str, retain: bool = False):
+        with self._cond:
+            self.published += 1
+            self.bytes += len(topic) + len(payload.encode("utf-8"))
+            if retain:
+                if payload:
+                    self._retained[topic] = payload
+                else:
+                    self._retained.pop(topic, None)
+            subscribers = [name for name, (patterns, _) in self._subscribers.items() if any(topic_matches(p, topic) for p in patterns)]
+            if not subscribers:
+                self.dropped += 1
+            for name in subscribers:
+                self._enqueue(name, topic, payload, False)
+
+    def subscribe(self, subscriber: str, pattern: str, callback: Callable[[str, str, bool], None]):
+        """ subscribe, and get the retained messages that match """
+        with self._cond:
+            patterns, _ = self._subscribers.get(subscriber, ([], callback))
+            self._subscribers[subscriber] = (patterns + [pattern], callback)
+            for topic, payload in self._retained.items():
+                if topic_matches(pattern, topic):
+                    self._enqueue(subscriber, topic, payload, True)
+
+    def unsubscribe(self, subscriber: str):
+        """ remove all subscriptions of a subscriber, and what is queued for it """
+        with self._cond:
+            self._subscribers.pop(subscriber, None)
+            self._last_due.pop(subscriber, None)
+            kept = [item for item in self._queue if item[2] != subscriber]
+            for item in self._queue:
+                if item[2] == subscriber:
+                    self._queued_bytes -= len(item[3]) + len(item[4])
+            self._queue = kept
+            heapq.heapify(self._queue)
+
+    def _deliver(self):
+        while True:
+            with self._cond:
+                while not self._closed and (not self._queue or self._queue[0][0] > time.monotonic()):
+                    self._cond.wait(None if not self._queue else self._queue[0][0] - time.monotonic())
+                if self._closed:
+                    return
+                _, _, subscriber, topic, payload, retained = heapq.heappop(self._queue)
+                self._queued_bytes -= len(topic) + len(payload)
+                entry = self._subscribers.get(subscriber)
+                self._delivering += 1
+            try:
+                if entry is not None:
+                    entry[1](topic, payload, retained)
+                    if retained:
+                        self.delivered_retained += 1
+                    else:
+                        self.delivered += 1
+            finally:
+                with self._cond:
+                    self._delivering -= 1
+                    self._cond.notify_all()
+
+    def wait_idle(self, timeout: float = IDLE_TIMEOUT) -> bool:
+        """ wait until everything queued is delivered
+
+        Returns:
+            bool: True when idle, False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._delivering:
+                if time.monotonic() > deadline:
+                    return False
+                self._cond.wait(min(0.05, max(deadline - time.monotonic(), 0)))
+        return True
+
+    def memory(self) -> dict[str, int]:
+        """ what the broker holds: the retained messages, and the peak of the queued messages """
+        with self._cond:
+            return {
+                "retained_messages": len(self._retained),
+                "retained_bytes": sum(len(t) + len(p) for t, p in self._retained.items()),
+                "peak_queued_messages": self.peak_queued,
+                "peak_queued_bytes": self.peak_queued_bytes,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
+class Message:
+
+    def __init__(self, topic: str, payload: str):
+        self.topic = topic
+        self.payload = payload.encode("utf-8")
+
+
+class StandInClient:
+    """ the part of paho.mqtt.client.Client that the bridge uses, connected to a stand-in broker """
+
+    def __init__(self, callback_api_version=None, client_id: str = "", userdata=None, protocol=None, **kwargs):  # pylint: disable=unused-argument
+        self._client_id = client_id
+        self._userdata = userdata
+        self._broker: Optional[StandInBroker] = None
+        self._connected = False
+        self._callbacks: dict[str, Callable] = {}
+        self.on_connect = None
+        self.on_disconnect = None
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        pass
+
+    def connect_async(self, host: str, port: int = 1883, keepalive: int = 60):  # pylint: disable=unused-argument
+        self._broker = BROKERS[host]
+
+    def connect(self, host: str, port: int = 1883, keepalive: int = 60):
+        self.connect_async(host, port, keepalive)
+        self.loop_start()
+
+    def loop_start(self):
+        self._connected = True
+        if self.on_connect:
+            self.on_connect(self, self._userdata, None, 0, None)
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        self._connected = False
+        if self.on_disconnect:
+            self.on_disconnect(self, self._userdata, None, 0, None)
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def message_callback_add(self, sub: str, callback: Callable):
+        self._callbacks[sub] = callback
+
+    def subscribe(self, topic: str, qos: int = 0):  # pylint: disable=unused-argument
+        if self._broker is None:
+            return
+
+        def on_message(msg_topic: str, payload: str, retained: bool):  # pylint: disable=unused-argument
+            for sub, callback in self._callbacks.items():
+                if topic_matches(sub, msg_topic):
+                    callback(self, self._userdata, Message(msg_topic, payload))
+
+        self._broker.subscribe(self._client_id, topic, on_message)
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False) -> MessageInfo:  # pylint: disable=unused-argument
+        if not self._connected or self._broker is None:
+            return MessageInfo(0, connected=False)
+        self._broker.publish(topic, "" if payload is None else str(payload), retain)
+        return MessageInfo(time.monotonic() + self._broker.publish_latency)
+
+
+class SimulatedPlate:
+
+    def __init__(self, name: str, broker: StandInBroker, apply: bool = True):
+        """ a plate, that applies the commands it receives to its pages
+
+        Args:
+            name (str): the plate name
+            broker (StandInBroker): the broker of the plate
+            apply (bool, optional): False to only count the commands, which loads the machine less. Defaults to True.
+        """
+        import plate_simulator  # pylint: disable=import-outside-toplevel
+
+        self.name = name
+        self._broker = broker
+        self._new_pages = plate_simulator.PlateSimulator if apply else None
+        self.pages = self._new_pages() if self._new_pages else None
+        self.online = False
+        self.offline_cycles = 0
+        # time and number of the commands received since the cycle started
+        self.last_received = 0.0
+        self.received = 0
+        self.latencies: list[float] = []
+        self.reboots = 0
+        self.drops = 0
+        self.repaints = 0
+
+    def connect(self):
+        self.online = True
+        self._broker.subscribe(self.name, f"hasp/{self.name}/command/#", self.on_message)
+        self._broker.publish(f"hasp/{self.name}/LWT", "online", retain=True)
+
+    def go_offline(self, reboot: bool, cycles: int):
+        """ leave the network for some cycles. The broker publishes the LWT. A reboot also clears the pages. """
+        self.online = False
+        self.offline_cycles = cycles
+        self._broker.unsubscribe(self.name)
+        self._broker.publish(f"hasp/{self.name}/LWT", "offline", retain=True)
+        if reboot:
+            self.reboots += 1
+            if self._new_pages:
+                self.pages = self._new_pages()
+        else:
+            self.drops += 1
+
+    def on_message(self, topic: str, payload: str, retained: bool):
+        if topic.endswith("/command/jsonl"):
+            self.repaints += 1
+        elif not retained:
+            self.last_received = time.perf_counter()
+            self.received += 1
+        if self.pages is None:
+            return
+        if topic.endswith("/command/jsonl"):
+            # the state sent when the plate came online: one object per line
+            for line in payload.splitlines():
+                item = json.loads(line)
+                for prop, value in item.items():
+                    if prop not in ("page", "id"):
+                        self.pages.apply(f"hasp/{self.name}/command/p{item['page']}b{item['id']}.{prop}", value if isinstance(value, str) else json.dumps(value))
+        else:
+            self.pages.apply(topic, payload)
+
+
+class Fleet:
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.brokers = [
+            StandInBroker(f"fleet-{k + 1}", args.latency / 1000, args.jitter / 1000, args.publish_latency / 1000, self.rng) for k in range(args.brokers)
+        ]
+        for broker in self.brokers:
+            BROKERS[broker.name] = broker
+        self.plates = [SimulatedPlate(f"plate{i + 1:03}", self.brokers[i % len(self.brokers)], not args.no_apply) for i in range(args.plates)]
+        self.cycle = 0
+        self.fetch_start = 0.0
+        self.cycle_durations: list[float] = []
+        self.rss_peak: Optional[int] = None
+
+    def config(self) -> dict[str, Any]:
+        """ the bridge configuration: one plate per simulated plate, spread over the brokers """
+        return {
+            "mqtt": {
+                "mock": False,
+                "broker": self.brokers[0].name,
+                "port": 1883,
+                "keepalive": 60,
+                "base_topic": "meteofrance2openhasp",
+                "brokers": [{"name": broker.name, "broker": broker.name} for broker in self.brokers[1:]],
+            },
+            "sender": {
+                "scan_interval": 1,
+                "city": "Paris",
+                "publish_threads": self.args.publish_threads,
+                "state_snapshot": self.args.state_snapshot,
+                "plates": [
+                    {
+                        "name": plate.name,
+                        "start_page": 2,
+                        "nr_days_detail": 4,
+                        "extra_tempnow": None,
+                        "extra_iconnow": None,
+                        "broker": None if i % len(self.brokers) == 0 else self.brokers[i % len(self.brokers)].name,
+                    }
+                    for i, plate in enumerate(self.plates)
+                ],
+            },
+        }
+
+    def wait_idle(self):
+        for broker in self.brokers:
+            if not broker.wait_idle():
+                logging.warning(f"Broker {broker.name} did not deliver everything within {IDLE_TIMEOUT} s")
+
+    def start_cycle(self):
+        """ the fetch of a cycle starts """
+        self.cycle += 1
+        for plate in self.plates:
+            plate.received = 0
+        self.fetch_start = time.perf_counter()
+
+    def end_cycle(self):
+        """ the bridge finished a cycle: wait for the deliveries, and keep the latencies """
+        import diagnostics  # pylint: disable=import-outside-toplevel
+
+        self.wait_idle()
+        last = self.fetch_start
+        for plate in self.plates:
+            if plate.received:
+                plate.latencies.append(plate.last_received - self.fetch_start)
+                last = max(last, plate.last_received)
+        self.cycle_durations.append(last - self.fetch_start)
+        rss = diagnostics._rss()  # pylint: disable=protected-access
+        if rss is not None:
+            self.rss_peak = max(self.rss_peak or 0, rss)
+
+    def between_cycles(self):
+        """ reconnect the plates that were away long enough, and send others away at random """
+        for plate in self.plates:
+            if not plate.online:
+                plate.offline_cycles -= 1
+                if plate.offline_cycles <= 0:
+                    plate.connect()
+                continue
+            r = self.rng.random()
+            if r < self.args.reboot_rate:
+                plate.go_offline(True, self.args.offline_cycles)
+            elif r < self.args.reboot_rate + self.args.drop_rate:
+                plate.go_offline(False, self.args.offline_cycles)
+        # the state sent to the reconnected plates is not part of the next cycle
+        self.wait_idle()
+
+    def close(self):
+        for broker in self.brokers:
+            broker.close()
+            BROKERS.pop(broker.name, None)
+
+    def report(self) -> dict[str, Any]:
+        total_time = sum(self.cycle_durations)
+        published = sum(broker.published for broker in self.brokers)
+        delivered = sum(broker.delivered for broker in self.brokers)
+        plates = {
+            plate.name: {
+                "p50_ms": percentile(plate.latencies, 50) * 1000 if plate.latencies else None,
+                "p99_ms": percentile(plate.latencies, 99) * 1000 if plate.latencies else None,
+                "cycles": len(plate.latencies),
+                "reboots": plate.reboots,
+                "drops": plate.drops,
+                "repaints": plate.repaints,
+                "unknown_objects": sum(plate.pages.unknown_objects.values()) if plate.pages else None,
+            }
+            for plate in self.plates
+        }
+        return {
+            "plates": plates,
+            "cycles": self.cycle,
+            "cycle_ms": {
+                "p50": percentile(self.cycle_durations, 50) * 1000 if self.cycle_durations else None,
+                "p99": percentile(self.cycle_durations, 99) * 1000 if self.cycle_durations else None,
+            },
+            "messages_published": published,
+            "messages_delivered": delivered,
+            "messages_delivered_retained": sum(broker.delivered_retained for broker in self.brokers),
+            "messages_dropped": sum(broker.dropped for broker in self.brokers),
+            "bytes_published": sum(broker.bytes for broker in self.brokers),
+            "published_per_s": published / total_time if total_time else None,
+            "delivered_per_s": delivered / total_time if total_time else None,
+            "brokers": {broker.name: broker.memory() for broker in self.brokers},
+            "process_rss_peak": self.rss_peak,
+        }
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    """ run the bridge against the fleet for the number of cycles, and report """
+    if PACKAGE_DIR not in sys.path:
+        sys.path.insert(0, PACKAGE_DIR)
+    if TOOLS_DIR not in sys.path:
+        sys.path.insert(0, TOOLS_DIR)
+    import paho.mqtt.client as mqtt  # pylint: disable=import-outside-toplevel
+
+    import bridge  # pylint: disable=import-outside-toplevel
+    import config_utils  # pylint: disable=import-outside-toplevel
+    import history  # pylint: disable=import-outside-toplevel
+
+    with open(args.forecast, encoding="utf-8") as file:
+        recorded = history.restore_keys(json.load(file))
+    recorded.setdefault("timezone", "Europe/Paris")
+
+    fleet = Fleet(args)
+    config = config_utils.ConfigLoader(os.devnull, os.devnull)
+    config.config = fleet.config()
+
+    class FleetBridge(bridge.Bridge):
+        """ the bridge, with a replayed fetch, and the fleet events instead of the wait between the scans """
+
+        def __init__(self):
+            super().__init__(config)
+            self._sender.get_forecast = self._fetch  # type: ignore
+
+        def _fetch(self, city: str = "") -> dict:  # pylint: disable=unused-argument
+            fleet.start_cycle()
+            return dict(recorded, time=int(time.time()))
+
+        def _await_with_interrupt(self, total_sleep_time: int, check_interval: int):
+            fleet.end_cycle()
+            if fleet.cycle >= args.cycles:
+                self._running = False
+            else:
+                fleet.between_cycles()
+
+    client_class = mqtt.Client
+    mqtt.Client = StandInClient  # type: ignore
+    try:
+        for plate in fleet.plates:
+            plate.connect()
+        fleet.wait_idle()
+        FleetBridge().run()
+        fleet.wait_idle()
+        return fleet.report()
+    finally:
+        mqtt.Client = client_class  # type: ignore
+        fleet.close()
+
+
+def print_report(args: argparse.Namespace, report: dict[str, Any], per_plate: bool):
+    def ms(value: Optional[float]) -> str:
+        return "       -" if value is None else f"{value:8.1f}"
+
+    plates = report["plates"]
+    print(
+        f"{len(plates)} plates on {args.brokers} broker(s), {report['cycles']} cycles, latency {args.latency:g} ms ± {args.jitter:g} ms, "
+        f"reboots {args.reboot_rate:.0%}, LWT drops {args.drop_rate:.0%} per plate per cycle"
+    )
+    p50 = [p["p50_ms"] for p in plates.values() if p["p50_ms"] is not None]
+    p99 = [p["p99_ms"] for p in plates.values() if p["p99_ms"] is not None]
+    if p50:
+        print("End-to-end latency, from the fetch to the last command received, over the plates (ms):")
+        print(f"  p50:  min {min(p50):8.1f}  median {statistics.median(p50):8.1f}  max {max(p50):8.1f}")
+        print(f"  p99:  min {min(p99):8.1f}  median {statistics.median(p99):8.1f}  max {max(p99):8.1f}")
+    names = sorted(plates) if per_plate else sorted(plates, key=lambda n: -(plates[n]["p99_ms"] or 0))[:5]
+    print("Per plate:" if per_plate else "Slowest plates:")
+    for name in names:
+        p = plates[name]
+        print(
+            f"  {name}  p50 {ms(p['p50_ms'])}  p99 {ms(p['p99_ms'])}  cycles {p['cycles']:3}  "
+            f"reboots {p['reboots']}  drops {p['drops']}  repaints {p['repaints']}"
+        )
+    print(f"Cycle, from the fetch to the last delivery: p50 {ms(report['cycle_ms']['p50'])} ms, p99 {ms(report['cycle_ms']['p99'])} ms")
+    if report["published_per_s"] is not None:
+        print(
+            f"Throughput: {report['published_per_s']:.0f} messages/s published, {report['delivered_per_s']:.0f} messages/s delivered "
+            f"({report['messages_published']} published, {report['bytes_published'] // 1024} KB, {report['messages_dropped']} without subscriber)"
+        )
+    for name, memory in report["brokers"].items():
+        print(
+            f"Broker {name}: {memory['retained_messages']} retained messages, {memory['retained_bytes'] // 1024} KB, "
+            f"peak queue {memory['peak_queued_messages']} messages, {memory['peak_queued_bytes'] // 1024} KB"
+        )
+    if report["process_rss_peak"] is not None:
+        print(f"Process memory (RSS) peak: {report['process_rss_peak'] // 1024 // 1024} MB")
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fleet load test of meteofrance2openhasp, with stand-in brokers and simulated plates.")
+    parser.add_argument("--plates", type=int, default=50, help="Number of simulated plates. Default: 50")
+    parser.add_argument("--cycles", type=int, default=10, help="Number of scans. Default: 10")
+    parser.add_argument("--brokers", type=int, default=1, help="Number of brokers, the plates are spread over them. Default: 1")
+    parser.add_argument("--latency", type=float, default=5, help="Milliseconds from the broker to a plate. Default: 5")
+    parser.add_argument("--jitter", type=float, default=2, help="Maximum milliseconds added to or removed from the latency. Default: 2")
+    parser.add_argument("--publish-latency", type=float, default=0, help="Milliseconds from the bridge to the broker, waited for on each publish. Default: 0")
+    parser.add_argument("--reboot-rate", type=float, default=0.02, help="Chance that a plate reboots between two scans. Default: 0.02")
+    parser.add_argument("--drop-rate", type=float, default=0.02, help="Chance that a plate drops off the network (LWT) between two scans. Default: 0.02")
+    parser.add_argument("--offline-cycles", type=int, default=1, help="Number of scans a rebooted or dropped plate misses. Default: 1")
+    parser.add_argument("--publish-threads", type=int, default=1, help="publish_threads of the sender. Default: 1")
+    parser.add_argument("--state-snapshot", action="store_true", help="Enable state_snapshot, so that returning plates repaint from the retained state")
+    parser.add_argument("--no-apply", action="store_true", help="Only count the commands on the plates, do not apply them to the pages")
+    parser.add_argument("--forecast", default=FORECAST_FILE, help="Recorded forecast. Default: benchmarks/forecast.json")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the random reboots, drops and jitter. Default: 1")
+    parser.add_argument("--per-plate", action="store_true", help="Print every plate, not only the slowest")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--log-level", default="WARNING", help="Log level of the bridge. Default: WARNING")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s - %(levelname)s - %(message)s")
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=1))
+    else:
+        print_report(args, report, args.per_plate)
+
+
+if __name__ == "__main__":
+    main()
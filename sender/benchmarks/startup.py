@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Startup benchmark: import time, and time from process start to the first MQTT publish.
+#
+# The first publish is measured on a recorded forecast (forecast.json), with an MQTT client
+# stand-in, so that the result does not depend on the network, the Meteo France API or a broker.
+# Results are appended to startup_history.csv, to be able to follow them over releases.
+#
+# Usage, from the sender folder:
+#     python3 benchmarks/startup.py [--runs 10] [--no-record]
+
+import argparse
+import csv
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.join(os.path.dirname(BENCH_DIR), "meteofrance2openhasp")
+HISTORY_FILE = os.path.join(BENCH_DIR, "startup_history.csv")
+FORECAST_FILE = os.path.join(BENCH_DIR, "forecast.json")
+
+# run in the child process: import what the program imports, then render to one plate and flag the first publish
+CHILD = """
+import sys, time
+t0 = time.perf_counter()
+import bridge
+import config_utils
+import history
+from send_weather import MeteoFrance2OpenHasp
+print(f"IMPORTED {time.perf_counter() - t0}", flush=True)
+
+class MessageInfo:
+    def wait_for_publish(self, timeout=None):
+        pass
+
+class Client:
+    first = True
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if self.first:
+            print("PUBLISHED", flush=True)
+            self.first = False
+        return MessageInfo()
+
+import json
+with open(sys.argv[1], encoding="utf-8") as file:
+    d = history.restore_keys(json.load(file))
+sender = MeteoFrance2OpenHasp(Client())
+sender.load_config({"city": "Paris", "plates": [{"name": "plate01", "start_page": 2, "nr_days_detail": 4}]})
+sender.sendDataToHASP(d, "plate01", 2, 4)
+"""
+
+
+def run_once() -> tuple[float, float]:
+    """ start a fresh interpreter, and measure the import time and the time to the first publish, in seconds """
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-c", CHILD, FORECAST_FILE], cwd=PACKAGE_DIR, stdout=subprocess.PIPE, text=True
+    )
+    import_time = None
+    first_publish = None
+    for line in proc.stdout:  # type: ignore
+        if line.startswith("IMPORTED"):
+            import_time = float(line.split()[1])
+        elif line.startswith("PUBLISHED"):
+            first_publish = time.perf_counter() - start
+    proc.wait()
+    if proc.returncode != 0 or import_time is None or first_publish is None:
+        raise RuntimeError(f"benchmark child failed with exit code {proc.returncode}")
+    return import_time, first_publish
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark of meteofrance2openhasp.")
+    parser.add_argument("--runs", type=int, default=10, help="Number of runs. Default: 10")
+    parser.add_argument("--no-record", action="store_true", help=f"Do not append the result to {os.path.basename(HISTORY_FILE)}")
+    args = parser.parse_args()
+
+    sys.path.insert(0, PACKAGE_DIR)
+    from version import __version__  # pylint: disable=import-outside-toplevel
+
+    results = [run_once() for _ in range(args.runs)]
+    import_ms = statistics.median(r[0] for r in results) * 1000
+    first_publish_ms = statistics.median(r[1] for r in results) * 1000
+    python_version = ".".join(str(v) for v in sys.version_info[:3])
+    print(f"meteofrance2openhasp {__version__}, Python {python_version}, median of {args.runs} runs:")
+    print(f"  import time:            {import_ms:8.1f} ms")
+    print(f"  time to first publish:  {first_publish_ms:8.1f} ms")
+
+    if not args.no_record:
+        is_new = not os.path.exists(HISTORY_FILE)
+        with open(HISTORY_FILE, "a", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            if is_new:
+                writer.writerow(["date", "version", "python", "import_ms", "first_publish_ms"])
+            writer.writerow([datetime.now().isoformat(timespec="seconds"), __version__, python_version, f"{import_ms:.1f}", f"{first_publish_ms:.1f}"])
+
+
+if __name__ == "__main__":
+    main()
@@ -34,6 +34,18 @@ def main():
         default=default_secrets_path,
         help=f"Path to the secret file. Default: {default_secrets_path}",
     )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Do a single weather update and stop as soon as it is delivered to the MQTT broker, whatever the scan_interval.",
+    )
+    parser.add_argument(
+        "--config-snapshot",
+        required=False,
+        default=None,
+        help="Path to a snapshot of the resolved configuration. It is used instead of the configuration and secret files "
+        "when it is still up to date, and written otherwise. It contains the secrets.",
+    )
 
     args = parser.parse_args()
 
@@ -54,13 +66,15 @@ def main():
             "logging.format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
         }
 
-        # Load configuration files
+        # Load configuration files, or the snapshot of a previous run
         config = config_utils.ConfigLoader(args.config, args.secrets)
-        config.load_secrets()
-        config.load_config(env_defaults)
+        if not (args.config_snapshot and config.load_snapshot(args.config_snapshot)):
+            config.load_secrets()
+            config.load_config(env_defaults)
+            if args.config_snapshot:
+                config.save_snapshot(args.config_snapshot)
 
         print("Starting meteofrance2openhasp...")
-        print(config.dumps())
 
         print(f"meteofrance2openhasp version: {__version__}")
         print(f"Running on Python version: {sys.version}")
@@ -113,11 +127,12 @@ def main():
         Logger.info(f"Starting meteofrance2openhasp version {__version__}")
         Logger.info(f"Running on Python version: {sys.version}")
 
-        # Log configuration
-        Logger.info(f"Configuration:\n{config.dumps()}")
+        # Log configuration. When running one-shot, only in debug: it is a noticeable part of the startup time.
+        if not args.once or Logger.isEnabledFor(logging.DEBUG):
+            Logger.info(f"Configuration:\n{config.dumps()}")
 
         # Start the bridge
-        bridge = Bridge(config)
+        bridge = Bridge(config, once=args.once)
         bridge.run()
 
         Logger.info("meteofrance2openhasp stopped.")
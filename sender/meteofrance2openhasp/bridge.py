@@ -1,66 +1,98 @@
 import json
 import logging
+import re
 import signal
 import time
+from typing import Optional
 
-import paho.mqtt.client as mqtt
-
+import brokers
 import config_utils
+import diagnostics
+import shard
+import tracing
 from send_weather import MeteoFrance2OpenHasp
 
+# maximum time to wait for the broker, on connect and for the last acknowledgement before exiting
+MQTT_WAIT_TIMEOUT = 10
+
 
 # ----------------------------------
 class Bridge:
 
     # ----------------------------------
-    def __init__(self, config: config_utils.ConfigLoader):
+    def __init__(self, config: config_utils.ConfigLoader, once: bool = False):
+
+        self._config = config
+        # one-shot: a single cycle, then stop as soon as everything is acknowledged by the broker
+        self._once = once
 
         # Scan interval (in seconds)
         self._scan_interval = int(config.get("sender.scan_interval"))   # type: ignore
 
+        # Configuration reload, on SIGHUP, or on file change when watch_config is set
+        self._watch_config = bool(config.get("sender.watch_config", False))
+        self._config_mtime = config.mtime()
+        self._reload_requested = False
+
         # MQTT configuration
+        self._shard_mqtt_settings = None
+        self._brokers: Optional[brokers.BrokerPool] = None
         if bool(config.get("mqtt.mock", False)):  # type: ignore
             logging.info("MQTT mock mode enabled. Data will not be sent to MQTT, but will be logged at info level.")
             self._mqtt_client = None
         else:
-            self._mqtt_broker = config.get("mqtt.broker")
-            if not isinstance(self._mqtt_broker, str):
-                raise ValueError("MQTT broker address must be a string.")
-            self._mqtt_port = int(config.get("mqtt.port"))  # type: ignore
-            mqtt_username = config.get("mqtt.username")
-            mqtt_password = config.get("mqtt.password")
-            self._mqtt_keepalive = int(config.get("mqtt.keepalive"))  # type: ignore
+            # the broker of the mqtt section, named "default", and the extra brokers of mqtt.brokers
+            broker_settings = brokers.broker_settings(config.get("mqtt"))  # type: ignore
+            self._broker_names = [s["name"] for s in broker_settings]
+            if not brokers.check_plates(config.get("sender.plates"), self._broker_names):  # type: ignore
+                raise ValueError("Invalid plate broker configuration.")
+            mqtt_client_id = config.get("mqtt.client_id") or brokers.default_client_id(config.config_file)
+            mqtt_keepalive = int(config.get("mqtt.keepalive"))  # type: ignore
 
             self._mqtt_base_topic = config.get("mqtt.base_topic")
 
-            # Initialize MQTT client
-            self._mqtt_client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, client_id="meteofrance2openhasp", protocol=mqtt.MQTTv5)  # type: ignore
-            self._mqtt_client.username_pw_set(mqtt_username, mqtt_password)  # type: ignore
+            # Initialize a long-lived MQTT connection per broker. The default one also carries the bridge topics.
+            self._brokers = brokers.BrokerPool(broker_settings, mqtt_client_id, mqtt_keepalive)  # type: ignore
+            self._mqtt_client = self._brokers.client()
+
+            # the shards have their own connections, with the client ID suffixed by the shard number
+            self._shard_mqtt_settings = {
+                "brokers": broker_settings,
+                "keepalive": mqtt_keepalive,
+                "client_id": mqtt_client_id,
+                "timeout": MQTT_WAIT_TIMEOUT,
+            }
 
-            # Set up MQTT callbacks
-            self._mqtt_client.on_connect = self.on_connect
-            self._mqtt_client.on_disconnect = self.on_disconnect
+        # Tracing of the cycles, disabled unless configured
+        self._tracer = tracing.configure(config.get("tracing"))  # type: ignore
+
+        # Memory and resource diagnostics, disabled unless configured. A report is written to the log on SIGUSR1.
+        self._diagnostics = diagnostics.configure(config.get("diagnostics"))  # type: ignore
+        self._report_requested = False
 
         # Initialize MeteoFrance2OpenHasp
         self._sender = MeteoFrance2OpenHasp(self._mqtt_client)
+        if self._brokers is not None:
+            self._sender.set_mqtt_clients(self._brokers.clients)
+            # the plates that come online get their state, see state_snapshot
+            self._brokers.subscribe("hasp/+/LWT", self._sender.plate_online)
         if not self._sender.load_config(config.get("sender")):   # type: ignore
             raise ValueError("Invalid sender configuration.")
 
+        # Worker processes publishing to the plates, started by run(). None when publishing from this process.
+        self._shards: Optional[shard.ShardPool] = None
+
         # Set up signal handler
         signal.signal(signal.SIGINT, self.handle_signal)
         signal.signal(signal.SIGTERM, self.handle_signal)
+        if hasattr(signal, "SIGHUP"):  # not on Windows
+            signal.signal(signal.SIGHUP, self.handle_reload_signal)
+        if hasattr(signal, "SIGUSR1"):  # not on Windows
+            signal.signal(signal.SIGUSR1, self.handle_report_signal)
 
         # Initialize running flag
         self._running = False
 
-    # ----------------------------------
-    def on_connect(self, client, userdata, connect_flags, rc, properties):  # pylint: disable=unused-argument
-        logging.info(f"Connected to MQTT broker with result: {rc}")
-        
-    # ----------------------------------
-    def on_disconnect(self, client, userdata, disconnect_flags, rc, properties):  # pylint: disable=unused-argument
-        logging.info("Disconnected from broker")
-
     # ----------------------------------
     # Graceful shutdown function
     def handle_signal(self, signum, frame):  # pylint: disable=unused-argument
@@ -68,70 +100,212 @@ class Bridge:
         logging.info(f"Signal {signum} received. Shutting down gracefully...")
         self._running = False
 
+    # ----------------------------------
+    def handle_reload_signal(self, signum, frame):  # pylint: disable=unused-argument
+        logging.info(f"Signal {signum} received. Reloading the configuration...")
+        self._reload_requested = True
+
+    # ----------------------------------
+    def handle_report_signal(self, signum, frame):  # pylint: disable=unused-argument
+        # the report is written from the main loop, not from the signal handler
+        self._report_requested = True
+
+    # ----------------------------------
+    def _all_clients(self) -> list:
+        """ the MQTT clients of all brokers. Empty in mock mode. """
+        return list(self._brokers.clients.values()) if self._brokers is not None else []
+
+    # ----------------------------------
+    def _write_report(self):
+        self._report_requested = False
+        logging.info(self._diagnostics.report(self._all_clients()))
+
+    # ----------------------------------
+    def _reload_config(self) -> bool:
+        """ reload the configuration and apply what changed, keeping the MQTT session and the caches.
+
+        Returns:
+            bool: True when a new fetch is needed right away
+        """
+        self._reload_requested = False
+        self._config_mtime = self._config.mtime()
+        # the configuration in use, put back when the new one is not valid
+        old_config = self._config.config
+        try:
+            diff = self._config.reload()
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error(f"Configuration reload failed, keeping the current configuration: {str(e)}")
+            return False
+        if not diff:
+            logging.info("Configuration reloaded, nothing changed.")
+            return False
+        logging.info(f"Configuration reloaded, changed: {', '.join(sorted(diff))}")
+
+        def changed(section: str) -> bool:
+            return any(key == section or key.startswith(section + ".") for key in diff)
+
+        # validate before applying anything, so that an invalid configuration changes nothing.
+        # The sender configuration last, as it is applied when it is valid.
+        error = None
+        try:
+            if changed("tracing"):
+                tracing.settings(self._config.get("tracing"))  # type: ignore
+            if changed("diagnostics"):
+                diagnostics.settings(self._config.get("diagnostics"))  # type: ignore
+            if not changed("sender"):
+                pass
+            elif self._brokers is not None and not brokers.check_plates(self._config.get("sender.plates"), self._broker_names):  # type: ignore
+                error = "Invalid plate broker configuration"
+            elif not self._sender.load_config(self._config.get("sender")):  # type: ignore
+                error = "Invalid sender configuration"
+        except Exception as e:  # pylint: disable=broad-except
+            error = f"Invalid configuration: {str(e)}"
+        if error is not None:
+            logging.error(f"{error}, keeping the current configuration.")
+            self._config.config = old_config
+            return False
+
+        if changed("mqtt"):
+            logging.warning("MQTT configuration changes are only applied after a restart.")
+        if changed("logging"):
+            logging.warning("Logging configuration changes are only applied after a restart.")
+        if changed("tracing"):
+            self._tracer = tracing.configure(self._config.get("tracing"))  # type: ignore
+        if changed("diagnostics"):
+            self._diagnostics = diagnostics.configure(self._config.get("diagnostics"), self._diagnostics)  # type: ignore
+        if not changed("sender"):
+            return False
+
+        self._scan_interval = int(self._config.get("sender.scan_interval"))  # type: ignore
+        self._watch_config = bool(self._config.get("sender.watch_config", False))
+        if changed("sender.shards"):
+            self._setup_shards()
+        elif self._shards is not None:
+            # the shards have a copy of the sender configuration
+            self._shards.reconfigure(self._config.get("sender"))  # type: ignore
+        if changed("sender.city"):
+            # everything needs to be fetched again
+            return True
+
+        # new or changed plates get the cached forecast, removed plates are simply not sent to anymore
+        plates = set()
+        for key, (_, new) in diff.items():
+            m = re.match(r"sender\.plates\[(.+?)\]", key)
+            if m and not (key == m.group(0) and new is None):
+                plates.add(m.group(1))
+        if plates:
+            logging.info(f"Sending the cached weather data to plates: {', '.join(sorted(plates))}")
+            self._sender.publish_cached(sorted(plates))
+        return False
+
+    # ----------------------------------
+    def _setup_shards(self):
+        """ start the shards as configured in sender.shards, stopping the current ones first """
+        if self._shards is not None:
+            self._shards.close()
+            self._shards = None
+        nr_shards = int(self._config.get("sender.shards", 0) or 0)  # type: ignore
+        if nr_shards > 0 and self._mqtt_client is None:
+            logging.info("Shards are not used in MQTT mock mode.")
+        elif nr_shards > 0:
+            self._shards = shard.ShardPool(self._config.get("sender"), nr_shards, self._shard_mqtt_settings)  # type: ignore
+            self._shards.start()
+        self._sender.set_shards(self._shards)
+
     # ----------------------------------
     def run(self):
 
-        # Start the network loop in a separate thread
-        if self._mqtt_client:
-            logging.info("Connecting to MQTT broker...")
-            self._mqtt_client.connect(self._mqtt_broker, self._mqtt_port, self._mqtt_keepalive)  # type: ignore
-            self._mqtt_client.loop_start()
-            logging.info("Connected to MQTT broker.")
+        # Start the shards, if any
+        self._setup_shards()
+
+        # Start the network loops in separate threads
+        if self._brokers is not None:
+            # wait for the connections, so that nothing is published before they are there
+            self._brokers.connect(MQTT_WAIT_TIMEOUT)
 
         # Set running flag
         self._running = True
 
         try:
+            # Show the last stored forecast while the first one is being fetched.
+            # Not for a single cycle: the fresh forecast follows right away.
+            if not self._once and self._scan_interval != 0:
+                self._sender.publish_last_snapshot()
+
             while self._running:
-                # Publish data to MQTT
-                logging.info("Fetching weather data and publishing to MQTT...")
-                self._sender.publish_weather()
-                logging.info("Data published to MQTT.")
-
-                # Publish bridge availability
-                if self._mqtt_client:
-                    self._mqtt_client.publish(
-                        f"{self._mqtt_base_topic}/bridge/availability",
-                        json.dumps({"state": "online"}),
-                        retain=True,
-                        qos=2,
-                    )
+                self._tracer.start_cycle()
+                with tracing.span("cycle"):
+                    # Publish data to MQTT
+                    logging.info("Fetching weather data and publishing to MQTT...")
+                    self._sender.publish_weather()
+                    logging.info("Data published to MQTT.")
 
-                # Wait before next scan
-                logging.info(f"Waiting {self._scan_interval} minutes before next scan...")
+                    # Publish bridge availability, on every broker
+                    if self._brokers is not None:
+                        with tracing.span("publish.availability"):
+                            self._brokers.publish_all(
+                                f"{self._mqtt_base_topic}/bridge/availability",
+                                json.dumps({"state": "online"}),
+                                retain=True,
+                                qos=2,
+                            )
+                        # and the health of the shards
+                        if self._shards is not None:
+                            self._brokers.client().publish(
+                                f"{self._mqtt_base_topic}/bridge/shards",
+                                json.dumps(self._shards.health()),
+                                retain=True,
+                            )
+                self._tracer.end_cycle()
+                self._diagnostics.end_cycle(self._all_clients())
 
-                # Check if the scan interval is 0 and leave the loop.
-                if self._scan_interval == 0:
-                    time.sleep(5)  # flush out the MQTT queue. It seems that wait_for_publish() does not work properly 
+                # Check if the scan interval is 0 or if running one-shot, and leave the loop.
+                # The MQTT queue is flushed on exit, see below.
+                if self._scan_interval == 0 or self._once:
                     break
 
-                self._await_with_interrupt(self._scan_interval * 60, 5)
+                # Wait before next scan
+                interval, reason = self._sender.next_scan_interval()
+                logging.info(f"Waiting {interval:g} minutes before next scan ({reason})...")
+
+                self._await_with_interrupt(int(interval * 60), 5)
         except KeyboardInterrupt:
             print("Keyboard interrupt detected. Shutting down gracefully...")
             logging.info("Keyboard interrupt detected. Shutting down gracefully...")
         finally:
-            # Publish bridge availability
-            if self._mqtt_client:
-                self._mqtt_client.publish(
+            # Publish bridge availability, on every broker
+            if self._brokers is not None:
+                mis = self._brokers.publish_all(
                     f"{self._mqtt_base_topic}/bridge/availability",
                     json.dumps({"state": "offline"}),
                     retain=True,
                     qos=2
                 )
+                # This is the last message, with QoS 2: once a broker has completed it, it also has everything that was sent before.
+                deadline = time.monotonic() + MQTT_WAIT_TIMEOUT
+                for mi in mis:
+                    try:
+                        mi.wait_for_publish(max(deadline - time.monotonic(), 0))
+                    except (RuntimeError, ValueError) as e:
+                        logging.warning(f"Could not flush the MQTT queue: {str(e)}")
 
             self.dispose()
 
     # ----------------------------------
     def dispose(self):
+        # Stop the shards
+        if self._shards is not None:
+            self._shards.close()
+            self._shards = None
+
         # Dispose of MeteoFrance2OpenHasp.
         self._sender.dispose()
+        self._diagnostics.close()
 
-        # Stop the network loop
-        if self._mqtt_client:
-            logging.info("Disconnecting from MQTT broker...")
-            self._mqtt_client.loop_stop()
-            self._mqtt_client.disconnect()
-            logging.info("Disconnected from MQTT broker.")
+        # Stop the network loops
+        if self._brokers is not None:
+            self._brokers.close()
+            logging.info("Disconnected from MQTT brokers.")
 
     # ----------------------------------
     def _await_with_interrupt(self, total_sleep_time: int, check_interval: int):
@@ -142,3 +316,14 @@ class Bridge:
             # Check if an interrupt signal or external event requires breaking
             if not self._running:  # Assuming `running` is a global flag
                 break
+            # Fetch the extra datasets that are due, and send those that changed
+            self._sender.refresh_datasets()
+            # Write the diagnostics report, when requested
+            if self._report_requested:
+                self._write_report()
+            # Check if the configuration must be reloaded
+            if self._watch_config and self._config.mtime() != self._config_mtime:
+                logging.info("Configuration file change detected. Reloading the configuration...")
+                self._reload_requested = True
+            if self._reload_requested and self._reload_config():
+                break
@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import os
+import socket
+import time
+from typing import Any, Callable, Optional
+
+# The MQTT connections: one long-lived connection per broker.
+#
+# The broker of the "mqtt" section is named "default". Extra brokers are listed in mqtt.brokers,
+# each with a name, and a plate is sent to over the broker named in its "broker" setting, or over
+# the default one. Each connection has its own paho client, so its own publish queue and network
+# thread, and reconnects on its own: a broker that is down does not hold up the others.
+#
+# A broker disconnects a client when another one connects with the same client ID. The
+# connection to an extra broker adds the name of that broker to the client ID, and each shard
+# adds its number, so that all connections of an instance have their own ID. Unless set in
+# mqtt.client_id, the client ID has the host name and the configuration file in it, so that
+# instances on several hosts, or with their own configuration on one host, do not collide.
+
+DEFAULT_BROKER = "default"
+CLIENT_ID_PREFIX = "meteofrance2openhasp"
+
+# seconds between reconnection attempts, doubling from the first to the second value
+RECONNECT_DELAY = (1, 60)
+
+
+def default_client_id(config_file: str) -> str:
+    """ a client ID per host and configuration file, the same after a restart
+
+    Args:
+        config_file (str): path to the configuration file
+    """
+    digest = hashlib.sha1(os.path.abspath(config_file).encode("utf-8")).hexdigest()[:8]
+    return f"{CLIENT_ID_PREFIX}-{socket.gethostname()}-{digest}"
+
+
+def _value(value: Any) -> Any:
+    """ a configuration value, with empty strings and "none" or "null" as None, like ConfigLoader.get() """
+    if isinstance(value, str):
+        value = value.strip()
+        if not value or value.lower() in ("none", "null"):
+            return None
+    return value
+
+
+def broker_settings(mqtt_config: dict) -> list[dict[str, Any]]:
+    """ the settings of each broker, from the "mqtt" configuration section
+
+    Args:
+        mqtt_config (dict): the mqtt configuration section
+
+    Raises:
+        ValueError: when a broker is not valid
+
+    Returns:
+        list[dict[str, Any]]: per broker: name, broker, port, username, password. The default broker first.
+    """
+    settings = []
+    for i, config in enumerate([dict(mqtt_config, name=DEFAULT_BROKER)] + list(mqtt_config.get("brokers") or [])):
+        if not isinstance(config, dict):
+            raise ValueError(f"mqtt.brokers[{i - 1}] must be a section with a name and a broker.")
+        name = config.get("name")
+        if not isinstance(name, str) or not name:
+            raise ValueError(f"mqtt.brokers[{i - 1}] must have a name.")
+        if any(s["name"] == name for s in settings):
+            raise ValueError(f"MQTT broker name '{name}' is used more than once.")
+        broker = _value(config.get("broker"))
+        if not isinstance(broker, str):
+            raise ValueError(f"MQTT broker address of '{name}' must be a string.")
+        settings.append({
+            "name": name,
+            "broker": broker,
+            "port": int(_value(config.get("port")) or 1883),
+            # no username at all for anonymous brokers, not an empty one
+            "username": _value(config.get("username")),
+            "password": _value(config.get("password")),
+        })
+    return settings
+
+
+def check_plates(plates: Optional[list[dict]], names: list[str]) -> bool:
+    """ check that the plates only use known brokers
+
+    Args:
+        plates (list[dict]): the plate configurations
+        names (list[str]): the names of the brokers
+
+    Returns:
+        bool: True when OK
+    """
+    ok = True
+    for plate in plates or []:
+        broker = plate.get("broker") or DEFAULT_BROKER
+        if broker not in names:
+            logging.error(f"Plate {plate.get('name')}: unknown MQTT broker '{broker}'.")
+            ok = False
+    return ok
+
+
+class BrokerPool:
+
+    def __init__(self, settings: list[dict[str, Any]], client_id: str, keepalive: int):
+        """ create a client per broker. They are connected by connect().
+
+        Args:
+            settings (list[dict[str, Any]]): per broker: name, broker, port, username, password. See broker_settings().
+            client_id (str): the client ID of the default broker. The other brokers add their name to it.
+            keepalive (int): MQTT keepalive, in seconds
+        """
+        # imported here, as it is not needed in mock mode
+        import paho.mqtt.client as mqtt  # pylint: disable=import-outside-toplevel
+
+        self._settings = {s["name"]: s for s in settings}
+        self._keepalive = keepalive
+        # the topics subscribed to, renewed on every connection
+        self._subscriptions: list[str] = []
+        self.clients: dict[str, Any] = {}
+        for name, s in self._settings.items():
+            cid = client_id if name == DEFAULT_BROKER else f"{client_id}-{name}"
+            client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, client_id=cid, userdata=name, protocol=mqtt.MQTTv5)  # type: ignore
+            client.username_pw_set(s["username"], s["password"])
+            client.reconnect_delay_set(*RECONNECT_DELAY)
+            client.on_connect = self._on_connect
+            client.on_disconnect = self._on_disconnect
+            self.clients[name] = client
+
+    def _on_connect(self, client, userdata, connect_flags, rc, properties):  # pylint: disable=unused-argument
+        logging.info(f"Connected to MQTT broker {userdata} with result: {rc}")
+        for topic in self._subscriptions:
+            client.subscribe(topic)
+
+    def _on_disconnect(self, client, userdata, disconnect_flags, rc, properties):  # pylint: disable=unused-argument
+        logging.info(f"Disconnected from MQTT broker {userdata}")
+
+    def subscribe(self, topic: str, callback: Callable[[str, str], None]):
+        """ subscribe to a topic on all brokers
+
+        Args:
+            topic (str): the topic, may have wildcards
+            callback (Callable[[str, str], None]): called with the topic and the payload of each message, from the network thread of the broker
+        """
+        def on_message(client, userdata, message):  # pylint: disable=unused-argument
+            try:
+                callback(message.topic, message.payload.decode("utf-8", errors="replace"))
+            except Exception as e:  # pylint: disable=broad-except
+                logging.error(f"Exception on a message from MQTT broker {userdata} on {message.topic}: {str(e)}")
+
+        self._subscriptions.append(topic)
+        for client in self.clients.values():
+            client.message_callback_add(topic, on_message)
+            if client.is_connected():
+                client.subscribe(topic)
+
+    def client(self, name: str = DEFAULT_BROKER):
+        return self.clients.get(name)
+
+    def connect(self, timeout: float):
+        """ connect to all brokers, in the background, and wait until they are connected or until the timeout
+
+        Args:
+            timeout (float): maximum seconds to wait, for all brokers together
+        """
+        for name, client in self.clients.items():
+            s = self._settings[name]
+            logging.info(f"Connecting to MQTT broker {name} ({s['broker']}:{s['port']})...")
+            # asynchronous: a broker that is down is retried by the network thread, and does not stop the others
+            client.connect_async(s["broker"], s["port"], self._keepalive)
+            client.loop_start()
+        deadline = time.monotonic() + timeout
+        while not self.is_connected() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        for name, client in self.clients.items():
+            if not client.is_connected():
+                logging.warning(f"MQTT broker {name} is not connected yet, its plates fail until it is.")
+
+    def is_connected(self) -> bool:
+        return all(client.is_connected() for client in self.clients.values())
+
+    def publish_all(self, topic: str, payload: str, retain: bool = False, qos: int = 0) -> list:
+        """ publish the same message to all brokers
+
+        Returns:
+            list: the MessageInfo of each publish
+        """
+        return [client.publish(topic, payload, retain=retain, qos=qos) for client in self.clients.values()]
+
+    def close(self):
+        """ disconnect from all brokers """
+        for name, client in self.clients.items():
+            logging.info(f"Disconnecting from MQTT broker {name}...")
+            client.loop_stop()
+            client.disconnect()
@@ -0,0 +1,181 @@
+from typing import Any, Iterable, NamedTuple, Optional, Sequence
+
+# Geometry of the line and bar graphs on the plates.
+#
+# A Chart maps values to screen y coordinates within a PlotRect: the lowest value goes
+# to y_low, and the highest to y_low - height (screen y grows downwards). The value
+# range comes from the data, widened to at least min_span. Missing values are explicit
+# (None), and are placed at the middle of the plot rectangle.
+#
+# Scaling is done in one pass over all values. NumPy is used when it is installed and
+# there are enough points for it to pay off, otherwise plain Python is used. Both give
+# the same results: rounding is half-to-even in both.
+
+# below this number of values, plain Python is faster than NumPy
+_NUMPY_MIN_VALUES = 64
+
+# NumPy is optional, and only imported when first needed: importing it takes longer than drawing the small graphs.
+_np: Any = False
+
+
+def _numpy():
+    """ the numpy module, or None when it is not installed """
+    global _np  # pylint: disable=global-statement
+    if _np is False:
+        try:
+            import numpy  # pylint: disable=import-outside-toplevel
+            _np = numpy
+        except ImportError:
+            _np = None
+    return _np
+
+
+def to_int(value) -> Optional[int]:
+    """ round a value to an int
+
+    Args:
+        value: anything
+
+    Returns:
+        int: the rounded value, or None when it is not a number
+    """
+    try:
+        return int(round(float(value), 0))
+    except (TypeError, ValueError):
+        return None
+
+
+def points_payload(points: Iterable[Sequence[int]]) -> str:
+    """ serialize points for the openHASP "points" property
+
+    Args:
+        points (Iterable[Sequence[int]]): (x, y) screen coordinates
+
+    Returns:
+        str: for example "[[30, 270], [90, 265]]"
+    """
+    return "[" + ", ".join(f"[{x}, {y}]" for x, y in points) + "]"
+
+
+class PlotRect(NamedTuple):
+    y_low: float  # screen y of the lowest value
+    height: float  # screen height between the lowest and the highest value
+    x_left: int = 0  # screen x of the first point
+    x_step: int = 0  # screen distance between points
+
+
+class Chart:
+
+    def __init__(self, rect: PlotRect, min_span: float):
+        """ create a chart
+
+        Args:
+            rect (PlotRect): the plot rectangle
+            min_span (float): minimum value range. Smaller ranges are widened equally on both sides.
+        """
+        self.y_low = rect.y_low
+        self.height = rect.height
+        self.x_left = rect.x_left
+        self.x_step = rect.x_step
+        self.min_span = min_span
+        self.lo: Optional[float] = None
+        self.hi: Optional[float] = None
+        self._scale: Optional[float] = None
+
+    @property
+    def scaled(self) -> bool:
+        """ True when fit() found a usable value range """
+        return self._scale is not None
+
+    @property
+    def y_high(self) -> float:
+        """ screen y of the highest value """
+        return self.y_low - self.height
+
+    @property
+    def y_mid(self) -> float:
+        """ screen y of the middle of the plot rectangle, where missing values are placed """
+        return self.y_low - (self.height / 2)
+
+    def fit(self, *series: Iterable[Optional[float]]) -> bool:
+        """ determine the value range from one or more series. Missing values are ignored.
+
+        Returns:
+            bool: True when there is a usable value range
+        """
+        lo = None
+        hi = None
+        for values in series:
+            for v in values:
+                if v is None:
+                    continue
+                if lo is None or v < lo:
+                    lo = v
+                if hi is None or v > hi:
+                    hi = v
+        self.lo = lo
+        self.hi = hi
+        self._scale = None
+        if lo is None or hi is None:
+            return False
+        span = hi - lo
+        if span < self.min_span:
+            margin = (self.min_span - span) / 2
+            self.lo = lo - margin
+            self.hi = hi + margin
+            span = self.hi - self.lo
+        if span > 0:
+            self._scale = self.height / span
+        return self.scaled
+
+    def y_values(self, values: Sequence[Optional[float]]) -> list[int]:
+        """ screen y of each value. Missing values, and all values when there is no value range, are at the middle.
+
+        Args:
+            values (Sequence[Optional[float]]): values
+
+        Returns:
+            list[int]: screen y
+        """
+        if self._scale is None:
+            return [int(round(self.y_mid, 0))] * len(values)
+        np = _numpy() if len(values) >= _NUMPY_MIN_VALUES else None
+        if np is not None:
+            arr = np.array([np.nan if v is None else v for v in values], dtype=float)
+            ys = self.y_low - (self._scale * (arr - self.lo))
+            ys = np.where(np.isnan(ys), self.y_mid, ys)
+            return np.rint(ys).astype(int).tolist()
+        y_mid = int(round(self.y_mid, 0))
+        return [y_mid if v is None else int(round(self.y_low - (self._scale * (v - self.lo)), 0)) for v in values]  # type: ignore
+
+    def line_points(self, values: Sequence[Optional[float]]) -> list[list[int]]:
+        """ points of a line graph, one point per value, x_step apart
+
+        Args:
+            values (Sequence[Optional[float]]): values
+
+        Returns:
+            list[list[int]]: [x, y] screen coordinates
+        """
+        return [[self.x_left + (i * self.x_step), y] for i, y in enumerate(self.y_values(values))]
+
+    def bar_points(self, lows: Sequence[Optional[float]], highs: Sequence[Optional[float]], min_height: int = 0) -> list[list[list[int]]]:
+        """ points of vertical bars, one per (low, high) pair, x_step apart.
+        A missing low or high is drawn at the bottom or the top of the value range.
+        Without a value range, all bars span the full height.
+
+        Args:
+            lows (Sequence[Optional[float]]): the low value of each bar
+            highs (Sequence[Optional[float]]): the high value of each bar
+            min_height (int, optional): extra height added at the bottom of each bar, so that it is always visible. Defaults to 0.
+
+        Returns:
+            list[list[list[int]]]: per bar, [[x, y of high], [x, y of low]]
+        """
+        n = len(lows)
+        if self._scale is None:
+            top = int(round(self.y_high, 0))
+            bottom = int(round(self.y_low, 0)) + min_height
+            return [[[self.x_left + (i * self.x_step), top], [self.x_left + (i * self.x_step), bottom]] for i in range(n)]
+        ys = self.y_values([self.lo if v is None else v for v in lows] + [self.hi if v is None else v for v in highs])
+        return [[[self.x_left + (i * self.x_step), ys[n + i]], [self.x_left + (i * self.x_step), ys[i] + min_height]] for i in range(n)]
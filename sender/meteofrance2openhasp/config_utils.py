@@ -1,7 +1,11 @@
+import json
 import os
-from typing import Optional
+from typing import Any, Optional
 
-import yaml
+# yaml is imported where it is used: a configuration snapshot does not need it.
+
+# format version of the configuration snapshots
+SNAPSHOT_VERSION = 1
 
 
 class ConfigLoader:
@@ -10,9 +14,14 @@ class ConfigLoader:
         self.secrets_file = secrets_file
         self.config = {}
         self.secrets = {}
+        self._env_defaults = {}
+        # the environment variables used while resolving, with their value (None if not set)
+        self._env_used: dict[str, Optional[str]] = {}
 
     def load_secrets(self):
         """Load the secrets file."""
+        import yaml  # pylint: disable=import-outside-toplevel
+
         if os.path.exists(self.secrets_file):
             with open(self.secrets_file, "r", encoding="utf-8") as file:
                 self.secrets = yaml.safe_load(file)
@@ -23,6 +32,10 @@ class ConfigLoader:
         """Load the main configuration file and resolve secrets."""
         if env_defaults is None:
             env_defaults = {}
+        self._env_defaults = env_defaults
+        self._env_used = {}
+        import yaml  # pylint: disable=import-outside-toplevel
+
         if os.path.exists(self.config_file):
             with open(self.config_file, "r", encoding="utf-8") as file:
                 self.config = yaml.safe_load(file)
@@ -31,6 +44,70 @@ class ConfigLoader:
         else:
             raise FileNotFoundError(f"Configuration file '{self.config_file}' not found.")
 
+    def reload(self) -> dict[str, tuple[Any, Any]]:
+        """Reload the secrets and configuration files, and return what changed (see config_diff).
+        When loading fails, the current configuration is kept and the exception is raised."""
+        old_config = self.config
+        old_secrets = self.secrets
+        try:
+            self.load_secrets()
+            self.load_config(self._env_defaults)
+        except BaseException:
+            self.config = old_config
+            self.secrets = old_secrets
+            raise
+        return config_diff(old_config, self.config)
+
+    def mtime(self) -> float:
+        """The last modification time of the configuration and secrets files, 0 if they do not exist."""
+        mtime = 0.0
+        for file in (self.config_file, self.secrets_file):
+            try:
+                mtime = max(mtime, os.path.getmtime(file))
+            except OSError:
+                pass
+        return mtime
+
+    def load_snapshot(self, snapshot_file: str) -> bool:
+        """Load the resolved configuration from a snapshot made by save_snapshot(), skipping YAML parsing and resolving.
+        The snapshot is only used when it is newer than the configuration and secrets files, was made from the same files,
+        and the environment variables it used still have the same value."""
+        try:
+            if os.path.getmtime(snapshot_file) < self.mtime():
+                return False
+            with open(snapshot_file, "r", encoding="utf-8") as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if (
+            not isinstance(snapshot, dict)
+            or snapshot.get("version") != SNAPSHOT_VERSION
+            or snapshot.get("config_file") != os.path.abspath(self.config_file)
+            or snapshot.get("secrets_file") != os.path.abspath(self.secrets_file)
+        ):
+            return False
+        env = snapshot.get("env", {})
+        if any(os.getenv(env_var) != value for env_var, value in env.items()):
+            return False
+        self.config = snapshot.get("config", {})
+        self._env_used = env
+        return True
+
+    def save_snapshot(self, snapshot_file: str):
+        """Save the resolved configuration, for load_snapshot(). It contains the secrets, so the file is only readable by its owner."""
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "config_file": os.path.abspath(self.config_file),
+            "secrets_file": os.path.abspath(self.secrets_file),
+            "env": self._env_used,
+            "config": self.config,
+        }
+        tmp_file = f"{snapshot_file}.tmp"
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(snapshot, file)
+        os.replace(tmp_file, snapshot_file)
+
     def _resolve_secrets(self, data):
         """Recursively resolve `!secret` keys in the configuration."""
         if isinstance(data, dict):
@@ -56,6 +133,7 @@ class ConfigLoader:
             end = data.find("}", start)
             while start != -1 and end != -1:
                 env_var = data[start + 2: end]
+                self._env_used[env_var] = os.getenv(env_var)
                 env_value = os.getenv(env_var, env_defaults.get(env_var, None))
                 # "" is a valid value, None means not found
                 if env_value is None:
@@ -103,7 +181,41 @@ class ConfigLoader:
                 return "******"
             return data
 
+        import yaml  # pylint: disable=import-outside-toplevel
+
         # make a copy of the dict to avoid modifying the original config
         sanitized_config = sanitize(self.config)
 
         return yaml.dump(sanitized_config)
+
+
+def _named(items) -> Optional[dict]:
+    """Index a list of dicts on their "name", if they all have a unique one."""
+    if not isinstance(items, list) or not all(isinstance(item, dict) and "name" in item for item in items):
+        return None
+    named = {item["name"]: item for item in items}
+    return named if len(named) == len(items) else None
+
+
+def config_diff(old, new, path: str = "") -> dict[str, tuple[Any, Any]]:
+    """Compare two configurations.
+
+    Returns {dotted path: (old value, new value)} for every value that changed, was added (old value None)
+    or was removed (new value None). Lists of dicts with a unique "name" are compared per name,
+    for example "sender.plates[plate01].start_page", or "sender.plates[plate03]" for an added plate.
+    """
+    if old == new:
+        return {}
+    if isinstance(old, dict) and isinstance(new, dict):
+        diff = {}
+        for key in list(old.keys()) + [k for k in new.keys() if k not in old]:
+            diff.update(config_diff(old.get(key), new.get(key), f"{path}.{key}" if path else str(key)))
+        return diff
+    old_named = _named(old)
+    new_named = _named(new)
+    if old_named is not None and new_named is not None:
+        diff = {}
+        for name in list(old_named.keys()) + [n for n in new_named.keys() if n not in old_named]:
+            diff.update(config_diff(old_named.get(name), new_named.get(name), f"{path}[{name}]"))
+        return diff
+    return {path: (old, new)}
@@ -0,0 +1,189 @@
+import logging
+import time
+from typing import Any, Optional
+
+import tracing
+
+# Extra datasets, next to the forecast: the weather warnings (vigilance) of the department,
+# and the observed wind.
+#
+# Each dataset is fetched on its own cadence, independent of the scan interval, and keeps
+# its last value: a failed fetch keeps the previous value. Values are reduced to what is
+# shown on the plates, so that two values are equal when the plates would show the same.
+# That way a dataset is only sent to the plates between scans when what they show changes.
+#
+# The values are shown in optional widgets on the plates. Each widget is an element on a
+# plate, configured per plate like extra_tempnow.
+
+# the plate settings with the element of each widget
+WIDGETS = ["vigilance_banner", "extra_wind"]
+
+# the vigilance colors, from the meteofrance color id (1 = green ... 4 = red)
+VIGILANCE_COLORS = [None, "verte", "jaune", "orange", "rouge"]
+VIGILANCE_BG_COLORS = [None, "#00A000", "#FFD700", "#FF8C00", "#E00000"]
+
+# the wind directions, per 45 degrees, starting north
+WIND_DIRECTIONS_FR = ["N", "NE", "E", "SE", "S", "SO", "O", "NO"]
+
+
+class Dataset:
+
+    # the name in the configuration, and in the forecast data
+    name = ""
+    # the priority class of its commands, see send_weather.PRIORITY_CLASSES
+    priority_class = "main"
+
+    def __init__(self, interval: int):
+        """ create a dataset, without value
+
+        Args:
+            interval (int): minutes between fetches
+        """
+        self.interval = interval
+        self.value: Optional[dict] = None
+        # the value that was last sent to the plates
+        self.published: Optional[dict] = None
+        self._fetched_at = 0.0
+
+    def due(self) -> bool:
+        """ True when the dataset must be fetched """
+        return self._fetched_at == 0 or time.monotonic() - self._fetched_at >= self.interval * 60
+
+    def refresh(self, client, place: dict) -> bool:
+        """ fetch the dataset, keeping the previous value on error
+
+        Args:
+            client (MeteoFranceClient): the meteofrance client
+            place (dict): latitude, longitude and department of the location
+
+        Returns:
+            bool: True when the value changed
+        """
+        self._fetched_at = time.monotonic()
+        try:
+            with tracing.span(f"dataset.{self.name}"):
+                value = self.fetch(client, place)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error(f"Could not fetch {self.name}: {str(e)}")
+            return False
+        changed = value != self.value
+        self.value = value
+        return changed
+
+    def fetch(self, client, place: dict) -> Optional[dict]:
+        """ get the value, reduced to what is shown. None when there is nothing to show. """
+        raise NotImplementedError
+
+    def render(self, value: Optional[dict], widgets: dict[str, str]) -> list[tuple[str, str, str]]:
+        """ the commands for the widgets of a plate
+
+        Args:
+            value (dict): a value from fetch()
+            widgets (dict[str, str]): the element per widget name, for the widgets configured on the plate
+
+        Returns:
+            list[tuple[str, str, str]]: (element, property, payload)
+        """
+        raise NotImplementedError
+
+
+class Vigilance(Dataset):
+
+    name = "vigilance"
+    priority_class = "now"
+
+    def fetch(self, client, place: dict) -> Optional[dict]:
+        # imported here, as the library is imported when the forecast is fetched
+        from meteofrance_api.helpers import get_phenomenon_name_from_indice, is_valid_warning_department  # pylint: disable=import-outside-toplevel
+
+        department = place.get("department")
+        if not department or not is_valid_warning_department(department):
+            return None
+        phenomenons = client.get_warning_current_phenomenons(department, 0, True).phenomenons_max_colors
+        level = max((p["phenomenon_max_color_id"] for p in phenomenons), default=1)
+        # the phenomenons above green, most severe first
+        active = sorted((p for p in phenomenons if p["phenomenon_max_color_id"] > 1), key=lambda p: (-p["phenomenon_max_color_id"], p["phenomenon_id"]))
+        return {"level": level, "phenomenons": [get_phenomenon_name_from_indice(p["phenomenon_id"]) for p in active]}
+
+    def render(self, value: Optional[dict], widgets: dict[str, str]) -> list[tuple[str, str, str]]:
+        el = widgets.get("vigilance_banner")
+        if not el:
+            return []
+        level = value["level"] if value else 1
+        if level <= 1:
+            return [(el, "hidden", "1")]
+        # the banner content first, then show it
+        return [
+            (el, "text", f"Vigilance {VIGILANCE_COLORS[level]}: {', '.join(str(p) for p in value['phenomenons'])}"),  # type: ignore
+            (el, "bg_color", VIGILANCE_BG_COLORS[level]),  # type: ignore
+            (el, "hidden", "0"),
+        ]
+
+
+class Observation(Dataset):
+
+    name = "observation"
+
+    def fetch(self, client, place: dict) -> Optional[dict]:
+        observation = client.get_observation(place["latitude"], place["longitude"])
+        if observation.wind_speed is None:
+            return None
+        direction = None
+        if observation.wind_direction is not None:
+            direction = WIND_DIRECTIONS_FR[int(((observation.wind_direction % 360) + 22.5) // 45) % 8]
+        return {"wind_speed": int(round(observation.wind_speed, 0)), "wind_direction": direction}
+
+    def render(self, value: Optional[dict], widgets: dict[str, str]) -> list[tuple[str, str, str]]:
+        el = widgets.get("extra_wind")
+        if not el:
+            return []
+        if not value:
+            return [(el, "text", "??")]
+        text = f"{value['wind_speed']} km/h"
+        if value["wind_direction"]:
+            text += f" {value['wind_direction']}"
+        return [(el, "text", text)]
+
+
+# the datasets, per name
+DATASETS = {dataset.name: dataset for dataset in [Vigilance, Observation]}
+
+
+def create(config: Optional[dict], current: Optional[list[Dataset]] = None) -> list[Dataset]:
+    """ create the datasets from the "datasets" configuration section, keeping the values of the current ones
+
+    Args:
+        config (dict): per dataset name, the minutes between fetches. None or 0 disables it. May be None.
+        current (list[Dataset], optional): the datasets in use. Defaults to None.
+
+    Returns:
+        list[Dataset]: the datasets
+    """
+    kept = {dataset.name: dataset for dataset in current or []}
+    result = []
+    for name, interval in (config or {}).items():
+        if not interval:
+            continue
+        dataset = kept.get(name)
+        if dataset is None:
+            dataset = DATASETS[name](interval)
+        dataset.interval = interval
+        result.append(dataset)
+    return result
+
+
+def render(datasets: list[Dataset], values: Optional[dict[str, Any]], widgets: dict[str, str]) -> list[tuple[str, str, str, str]]:
+    """ the commands for the widgets of a plate
+
+    Args:
+        datasets (list[Dataset]): the datasets
+        values (dict[str, Any]): the value per dataset name, as put in the forecast data
+        widgets (dict[str, str]): the element per widget name, for the widgets configured on the plate
+
+    Returns:
+        list[tuple[str, str, str, str]]: (priority class, element, property, payload)
+    """
+    if not widgets:
+        return []
+    values = values or {}
+    return [(dataset.priority_class, el, prop, txt) for dataset in datasets for el, prop, txt in dataset.render(values.get(dataset.name), widgets)]
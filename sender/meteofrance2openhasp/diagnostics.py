@@ -0,0 +1,279 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+# Memory and resource diagnostics, for a bridge that runs for months.
+#
+# When enabled, a sample is taken after every few cycles: the resident memory (RSS), the number of
+# threads, of open files and sockets, and of the messages the MQTT client still holds. With
+# tracemalloc, a snapshot of the allocations is also taken, and compared to the previous one, so
+# that the allocation sites that grow are known.
+#
+# A warning is logged when the memory keeps growing by more than a threshold per cycle, for a
+# number of samples in a row. A report, with the top allocation sites, can be written to the log
+# at any time, on SIGUSR1. Without diagnostics, that report only has the current resources.
+
+# number of samples kept for the report
+HISTORY_SIZE = 100
+
+
+class Sample:
+
+    def __init__(self, cycle: int):
+        self.cycle = cycle
+        self.time = time.time()
+        self.rss: Optional[int] = None
+        self.threads = threading.active_count()
+        self.fds: Optional[int] = None
+        self.sockets: Optional[int] = None
+        self.mqtt_pending: Optional[int] = None
+        self.traced: Optional[int] = None
+
+    def as_text(self) -> str:
+        def kb(value: Optional[int]) -> str:
+            return "?" if value is None else f"{value // 1024} KB"
+
+        def nr(value: Optional[int]) -> str:
+            return "?" if value is None else str(value)
+
+        return (
+            f"RSS {kb(self.rss)}, traced {kb(self.traced)}, threads {self.threads}, open files {nr(self.fds)}, "
+            f"sockets {nr(self.sockets)}, MQTT messages pending {nr(self.mqtt_pending)}"
+        )
+
+
+def _rss() -> Optional[int]:
+    """ the resident memory of this process, in bytes. None when it can not be known. """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+
+        # not the current, but the peak value: good enough to see growth
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+    except (ImportError, OSError, AttributeError):
+        return None
+
+
+def _open_files() -> tuple[Optional[int], Optional[int]]:
+    """ the number of open file descriptors, and how many of them are sockets. None when it can not be known. """
+    try:
+        fds = os.listdir("/proc/self/fd")
+    except OSError:
+        return None, None
+    sockets = 0
+    for fd in fds:
+        try:
+            if os.readlink(f"/proc/self/fd/{fd}").startswith("socket:"):
+                sockets += 1
+        except OSError:
+            pass
+    return len(fds), sockets
+
+
+def _mqtt_pending(clients: Iterable) -> Optional[int]:
+    """ the number of messages paho MQTT clients still hold, together: queued or waiting for acknowledgement.
+    None when it is not known for any of them. """
+    pending = None
+    for client in clients:
+        # these are internals of paho-mqtt, that may change
+        try:
+            n = len(client._out_messages) + len(client._in_messages) + len(client._out_packet)  # pylint: disable=protected-access
+        except (AttributeError, TypeError):
+            continue
+        pending = (pending or 0) + n
+    return pending
+
+
+class Diagnostics:
+
+    def __init__(self, enabled: bool = False, interval: int = 1, tracemalloc_frames: int = 1, top: int = 10,
+                 growth_warning_kb: int = 512, warning_cycles: int = 6):
+        """ create the diagnostics
+
+        Args:
+            enabled (bool, optional): True to take samples. Defaults to False.
+            interval (int, optional): number of cycles between samples. Defaults to 1.
+            tracemalloc_frames (int, optional): number of frames stored per allocation by tracemalloc. 0 disables tracemalloc. Defaults to 1.
+            top (int, optional): number of allocation sites in the reports. Defaults to 10.
+            growth_warning_kb (int, optional): memory growth per cycle above which the growth is suspect, in KB. Defaults to 512.
+            warning_cycles (int, optional): number of samples in a row with suspect growth before a warning. Defaults to 6.
+        """
+        self._enabled = enabled
+        self._interval = max(interval, 1)
+        self._frames = tracemalloc_frames if enabled else 0
+        self._top = top
+        self._growth_warning = growth_warning_kb * 1024
+        self._warning_cycles = max(warning_cycles, 1)
+        self._cycle = 0
+        self._samples: list[Sample] = []
+        self._snapshot: Any = None
+        self._growing: list[Any] = []
+        self._suspect = 0
+        self._started_tracemalloc = False
+        self._tracing = False
+        if self._frames > 0:
+            # imported here, as it is not needed without diagnostics
+            import tracemalloc  # pylint: disable=import-outside-toplevel
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self._frames)
+                self._started_tracemalloc = True
+            self._tracing = True
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def close(self):
+        """ stop tracemalloc, if started here """
+        if self._started_tracemalloc:
+            import tracemalloc  # pylint: disable=import-outside-toplevel
+
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        self._tracing = False
+
+    def _take_sample(self, mqtt_clients: Iterable) -> Sample:
+        sample = Sample(self._cycle)
+        sample.rss = _rss()
+        sample.fds, sample.sockets = _open_files()
+        sample.mqtt_pending = _mqtt_pending(mqtt_clients)
+        if self._tracing:
+            import tracemalloc  # pylint: disable=import-outside-toplevel
+
+            sample.traced = tracemalloc.get_traced_memory()[0]
+        return sample
+
+    def _take_snapshot(self):
+        """ take an allocation snapshot, and keep the sites that grew since the previous one """
+        import tracemalloc  # pylint: disable=import-outside-toplevel
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        if self._snapshot is not None:
+            self._growing = [stat for stat in snapshot.compare_to(self._snapshot, "lineno") if stat.size_diff > 0][:self._top]
+        self._snapshot = snapshot
+
+    def end_cycle(self, mqtt_clients: Iterable = ()):
+        """ take a sample, when due, and warn when the memory keeps growing
+
+        Args:
+            mqtt_clients (Iterable[mqtt.Client], optional): the MQTT clients, one per broker, for their pending messages. Defaults to none.
+        """
+        self._cycle += 1
+        if not self._enabled or self._cycle % self._interval:
+            return
+        sample = self._take_sample(mqtt_clients)
+        if self._tracing:
+            self._take_snapshot()
+        previous = self._samples[-1] if self._samples else None
+        self._samples = self._samples[-(HISTORY_SIZE - 1):] + [sample]
+
+        growth = None
+        if previous is not None and sample.rss is not None and previous.rss is not None:
+            growth = (sample.rss - previous.rss) // max(sample.cycle - previous.cycle, 1)
+        logging.info(f"Diagnostics, cycle {sample.cycle}: {sample.as_text()}" + ("" if growth is None else f", growth {growth // 1024} KB per cycle"))
+        for stat in self._growing[:3]:
+            logging.debug(f"Diagnostics, growing: {stat}")
+
+        if growth is not None and growth > self._growth_warning:
+            self._suspect += 1
+        else:
+            self._suspect = 0
+        if self._suspect >= self._warning_cycles:
+            first = self._samples[-self._warning_cycles - 1] if len(self._samples) > self._warning_cycles else self._samples[0]
+            logging.warning(
+                f"Memory grew by more than {self._growth_warning // 1024} KB per cycle for {self._suspect} samples in a row, "
+                f"from {(first.rss or 0) // 1024} KB to {(sample.rss or 0) // 1024} KB."
+                + ("".join(f"\n  {stat}" for stat in self._growing) if self._growing else "")
+            )
+            self._suspect = 0
+
+    def report(self, mqtt_clients: Iterable = ()) -> str:
+        """ the diagnostics report: the resources now, their evolution, and the top allocation sites
+
+        Args:
+            mqtt_clients (Iterable[mqtt.Client], optional): the MQTT clients, one per broker, for their pending messages. Defaults to none.
+
+        Returns:
+            str: the report, on several lines
+        """
+        now = self._take_sample(mqtt_clients)
+        lines = [f"Diagnostics report after {self._cycle} cycles: {now.as_text()}"]
+        lines.append("Threads: " + ", ".join(sorted(t.name for t in threading.enumerate())))
+        if not self._enabled:
+            lines.append("Diagnostics are not enabled: set diagnostics.enabled to follow the evolution and the allocations.")
+            return "\n".join(lines)
+        if self._samples:
+            first = self._samples[0]
+            lines.append(f"First kept sample, cycle {first.cycle}, {time.time() - first.time:.0f} s ago: {first.as_text()}")
+            if first.rss is not None and now.rss is not None and self._cycle > first.cycle:
+                lines.append(f"Average growth: {(now.rss - first.rss) // 1024 // (self._cycle - first.cycle)} KB per cycle")
+        if self._tracing:
+            import tracemalloc  # pylint: disable=import-outside-toplevel
+
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+            lines.append(f"Top {self._top} allocation sites:")
+            lines.extend(f"  {stat}" for stat in snapshot.statistics("lineno")[:self._top])
+            if self._growing:
+                lines.append("Growing in the last sampled cycles:")
+                lines.extend(f"  {stat}" for stat in self._growing)
+        return "\n".join(lines)
+
+
+# the integer settings of the "diagnostics" section, with their default
+INT_SETTINGS = {"interval": 1, "tracemalloc_frames": 1, "top": 10, "growth_warning_kb": 512, "warning_cycles": 6}
+
+
+def settings(config: Optional[dict]) -> Optional[dict[str, Any]]:
+    """ read the "diagnostics" configuration section
+
+    Args:
+        config (dict): the diagnostics configuration section, may be None
+
+    Raises:
+        ValueError: when a value is not valid
+
+    Returns:
+        dict[str, Any]: the arguments of Diagnostics, or None when the diagnostics are disabled
+    """
+    if not config or not config.get("enabled"):
+        return None
+    values: dict[str, Any] = {"enabled": True}
+    for key, default in INT_SETTINGS.items():
+        try:
+            values[key] = int(config.get(key, default))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid diagnostics configuration: '{key}' must be an integer.") from e
+        if values[key] < 0:
+            raise ValueError(f"Invalid diagnostics configuration: '{key}' must not be negative.")
+    return values
+
+
+def configure(config: Optional[dict], current: Optional[Diagnostics] = None) -> Diagnostics:
+    """ set up the diagnostics from the "diagnostics" configuration section
+
+    Args:
+        config (dict): the diagnostics configuration section, may be None
+        current (Diagnostics, optional): the diagnostics in use, closed once the new section is read. Defaults to None.
+
+    Raises:
+        ValueError: when a value is not valid. The current diagnostics are then left running.
+
+    Returns:
+        Diagnostics: the diagnostics
+    """
+    values = settings(config)
+    if current is not None:
+        current.close()
+    if values is None:
+        return Diagnostics()
+    diagnostics = Diagnostics(**values)
+    logging.info(f"Diagnostics enabled, every {diagnostics._interval} cycles, tracemalloc {'on' if diagnostics._frames else 'off'}")
+    return diagnostics
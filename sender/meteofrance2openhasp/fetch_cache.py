@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Optional
+
+# Fetch cache, shared by all the processes on a host.
+#
+# Several instances of this program on the same host, each with its own configuration,
+# often show the same cities. With a shared cache file, the Meteo France API responses
+# are stored per (location, dataset) in a SQLite database in WAL mode, and reused by all
+# processes until they are older than the time to live of the dataset. That way the API
+# traffic follows the number of different locations on the host, not the number of processes.
+#
+# Fetches are single-flight: the first process that needs an entry takes a lease on it,
+# and fetches. The others wait for the entry, instead of fetching at the same time. A lease
+# expires, so that a process that stopped while fetching does not block the others.
+#
+# The cache never stops a fetch: when the database can not be used, the data is fetched directly.
+
+# the datasets, and the default minutes they are reused
+DEFAULT_TTL = {
+    "places": 1440,       # search_places(): the city does not move
+    "forecast": 4,        # get_forecast_for_place()
+    "rain": 4,            # v3/rain
+    "forecast_v2": 4,     # v2/forecast
+}
+
+# maximum time a fetch may take, before another process takes over
+LEASE_SECONDS = 30
+
+# time between checks, while waiting for another process to fetch
+POLL_SECONDS = 0.1
+
+# entries not fetched for this long are deleted
+PURGE_SECONDS = 7 * 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entry (
+    location TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    fetched REAL NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (location, dataset)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS lease (
+    location TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (location, dataset)
+) WITHOUT ROWID;
+"""
+
+# outcome of _claim()
+_HIT = 0
+_FETCH = 1
+_WAIT = 2
+
+
+class FetchCache:
+
+    def __init__(self, file: str, ttl: Optional[dict[str, float]] = None):
+        """ open (or create) a shared fetch cache
+
+        Args:
+            file (str): path to the SQLite database, the same for all processes that share it
+            ttl (dict[str, float], optional): minutes an entry is reused, per dataset. Defaults to None: DEFAULT_TTL.
+        """
+        self._file = file
+        self._ttl = dict(DEFAULT_TTL, **(ttl or {}))
+        self._owner = f"{os.getpid()}-{id(self)}"
+        self._lock = threading.Lock()
+        # autocommit, the transactions are explicit
+        self._db = sqlite3.connect(file, timeout=LEASE_SECONDS, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._db.execute("DELETE FROM entry WHERE fetched < ?", (time.time() - PURGE_SECONDS,))
+        self.hits = 0
+        self.fetches = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _claim(self, location: str, dataset: str, now: float) -> tuple[int, Optional[str]]:
+        """ in a single write transaction: return the entry when it is fresh, else take the lease unless another process has it
+
+        Returns:
+            tuple[int, Optional[str]]: _HIT and the data, _FETCH when the lease is taken, or _WAIT
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT fetched, data FROM entry WHERE location = ? AND dataset = ?", (location, dataset)).fetchone()
+                if row and now - row[0] < self._ttl[dataset] * 60:
+                    return _HIT, row[1]
+                row = self._db.execute("SELECT owner, expires FROM lease WHERE location = ? AND dataset = ?", (location, dataset)).fetchone()
+                if row and row[0] != self._owner and row[1] > now:
+                    return _WAIT, None
+                self._db.execute(
+                    "INSERT OR REPLACE INTO lease (location, dataset, owner, expires) VALUES (?, ?, ?, ?)", (location, dataset, self._owner, now + LEASE_SECONDS)
+                )
+                return _FETCH, None
+            finally:
+                self._db.execute("COMMIT")
+
+    def _store(self, location: str, dataset: str, data: Optional[str]):
+        """ store a fetched entry, when there is one, and release the lease """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if data is not None:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO entry (location, dataset, fetched, data) VALUES (?, ?, ?, ?)", (location, dataset, time.time(), data)
+                    )
+                self._db.execute("DELETE FROM lease WHERE location = ? AND dataset = ? AND owner = ?", (location, dataset, self._owner))
+            finally:
+                self._db.execute("COMMIT")
+
+    def get(self, location: str, dataset: str, fetch: Callable[[], Any]) -> Any:
+        """ get an entry from the cache, or fetch it when it is missing or too old
+
+        Args:
+            location (str): the location, like a city name, or "latitude,longitude"
+            dataset (str): the dataset, one of DEFAULT_TTL
+            fetch (Callable[[], Any]): fetches the data. Must return something that can be written in JSON.
+
+        Returns:
+            Any: the data, as read back from JSON
+        """
+        try:
+            deadline = time.time() + LEASE_SECONDS
+            while True:
+                outcome, data = self._claim(location, dataset, time.time())
+                if outcome == _HIT:
+                    self.hits += 1
+                    return json.loads(data)  # type: ignore
+                if outcome == _FETCH:
+                    break
+                if time.time() >= deadline:
+                    logging.warning(f"Fetch cache: gave up waiting for {dataset} of {location}, fetching it.")
+                    break
+                time.sleep(POLL_SECONDS)
+        except sqlite3.Error as e:
+            logging.error(f"Fetch cache {self._file} can not be used, fetching {dataset} of {location} directly: {str(e)}")
+            return fetch()
+
+        self.fetches += 1
+        data = None
+        try:
+            # the same as what is returned on a hit
+            data = json.dumps(fetch(), separators=(",", ":"))
+        finally:
+            try:
+                self._store(location, dataset, data)
+            except sqlite3.Error as e:
+                logging.error(f"Fetch cache {self._file}: could not store {dataset} of {location}: {str(e)}")
+        return json.loads(data)
+
+
+def open_fetch_cache(config: Optional[dict]) -> Optional[FetchCache]:
+    """ open the shared fetch cache from the "fetch_cache" section of the sender configuration
+
+    Args:
+        config (dict): the fetch_cache configuration section, may be None
+
+    Returns:
+        FetchCache: the cache, or None when not configured
+    """
+    if not config or not config.get("file"):
+        return None
+    ttl = {}
+    if config.get("ttl") is not None:
+        ttl = {dataset: float(config["ttl"]) for dataset in DEFAULT_TTL if dataset != "places"}
+    if config.get("places_ttl") is not None:
+        ttl["places"] = float(config["places_ttl"])
+    try:
+        return FetchCache(str(config.get("file")), ttl)
+    except sqlite3.Error as e:
+        logging.error(f"Fetch cache {config.get('file')} can not be opened, fetching without it: {str(e)}")
+        return None
@@ -0,0 +1,267 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Iterator, Optional
+
+# Append-only store of the fetched forecasts.
+#
+# Every get_forecast() result is stored per location in a SQLite database, in a compact
+# "long" table: one row per forecasted value, with integer timestamps, temperatures and
+# rain in tenths (scaled ints), and the icon names dictionary encoded.
+# The table is clustered on (location, kind, target time, fetch time), so that the
+# queries below are range scans that never need to load more than what they return.
+#
+# The last snapshot per location is also kept as-is, so that a restart can show data
+# immediately, before anything is fetched.
+
+# the kind of forecasted value in a row
+KIND_NOW = 0
+KIND_HOURLY = 1
+KIND_DAILY = 2
+KIND_RAIN = 3
+KIND_PARTIAL = 4
+
+# the scale of the stored temperatures and rain values
+SCALE = 10
+
+# rain slots in the snapshot are 10 minutes apart
+RAIN_SLOT_SECONDS = 600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS location (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS icon (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS sample (
+    loc INTEGER NOT NULL,
+    kind INTEGER NOT NULL,
+    target INTEGER NOT NULL,
+    fetched INTEGER NOT NULL,
+    v1 INTEGER,
+    v2 INTEGER,
+    icon INTEGER,
+    PRIMARY KEY (loc, kind, target, fetched)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sample_fetched ON sample (fetched);
+CREATE TABLE IF NOT EXISTS last_snapshot (loc INTEGER PRIMARY KEY, fetched INTEGER NOT NULL, data TEXT NOT NULL);
+"""
+
+
+def _scaled(value) -> Optional[int]:
+    """ scale a float to a stored int. None when not a number. """
+    try:
+        return int(round(float(value) * SCALE))
+    except (TypeError, ValueError):
+        return None
+
+
+def _unscaled(value: Optional[int]) -> Optional[float]:
+    return None if value is None else value / SCALE
+
+
+def restore_keys(snapshot: dict) -> dict:
+    """ JSON turns the integer keys of the "hourly" and "partials" sections into strings. Turn them back.
+
+    Args:
+        snapshot (dict): snapshot, as read from JSON
+
+    Returns:
+        dict: snapshot, as returned by get_forecast()
+    """
+    def int_keys(d: dict) -> dict:
+        return {(int(k) if isinstance(k, str) and k.lstrip("-").isdigit() else k): v for k, v in d.items()}
+
+    if isinstance(snapshot.get("hourly"), dict):
+        snapshot["hourly"] = int_keys(snapshot["hourly"])
+    if isinstance(snapshot.get("partials"), dict):
+        snapshot["partials"] = {k: int_keys(v) for k, v in int_keys(snapshot["partials"]).items()}
+    return snapshot
+
+
+class ForecastHistory:
+
+    def __init__(self, file: str, retention_days: int = 30, compact_after_days: int = 2):
+        """ open (or create) a forecast store
+
+        Args:
+            file (str): path to the SQLite database
+            retention_days (int, optional): samples fetched longer ago are deleted. Defaults to 30.
+            compact_after_days (int, optional): samples fetched longer ago are thinned to one fetch per hour. Defaults to 2.
+        """
+        self._file = file
+        self._retention = retention_days * 86400
+        self._compact_after = compact_after_days * 86400
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._ids: dict[tuple[str, str], int] = {}
+        self._last_maintenance = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _id(self, table: str, name: str) -> int:
+        """ get the id of a location or icon name, adding it when needed """
+        key = (table, name)
+        if key not in self._ids:
+            self._db.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+            self._ids[key] = self._db.execute(f"SELECT id FROM {table} WHERE name = ?", (name,)).fetchone()[0]
+        return self._ids[key]
+
+    def _loc(self, location: str) -> Optional[int]:
+        """ get the id of a location, without adding it """
+        if ("location", location) in self._ids:
+            return self._ids[("location", location)]
+        row = self._db.execute("SELECT id FROM location WHERE name = ?", (location,)).fetchone()
+        return row[0] if row else None
+
+    def append(self, location: str, snapshot: dict):
+        """ store a forecast snapshot
+
+        Args:
+            location (str): location name
+            snapshot (dict): output from get_forecast(). Must be OK and have a "time".
+        """
+        if not snapshot.get("ok") or "time" not in snapshot:
+            return
+        fetched = int(snapshot["time"])
+        with self._lock:
+            loc = self._id("location", location)
+
+            def icon(name) -> Optional[int]:
+                return self._id("icon", name) if isinstance(name, str) else None
+
+            rows = []
+            now = snapshot.get("now", {})
+            rows.append((loc, KIND_NOW, fetched, fetched, _scaled(now.get("temp")), None, icon(now.get("icon"))))
+            for wf in snapshot.get("hourly", {}).values():
+                if "dt" in wf:
+                    rows.append((loc, KIND_HOURLY, wf["dt"], fetched, _scaled(wf.get("temp")), None, icon(wf.get("icon"))))
+            for wf in snapshot.get("days", []):
+                if "dt" in wf:
+                    rows.append((loc, KIND_DAILY, wf["dt"], fetched, _scaled(wf.get("temp_min")), _scaled(wf.get("temp_max")), icon(wf.get("icon"))))
+            for i, mm in enumerate(snapshot.get("rain", [])):
+                rows.append((loc, KIND_RAIN, fetched + i * RAIN_SLOT_SECONDS, fetched, _scaled(mm), None, None))
+            for day in snapshot.get("partials", {}).values():
+                for part, wp in day.items():
+                    if isinstance(part, int) and "dt" in wp:
+                        rows.append((loc, KIND_PARTIAL, wp["dt"], fetched, _scaled(wp.get("temp")), part, icon(wp.get("icon"))))
+
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO sample VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO last_snapshot VALUES (?, ?, ?)", (loc, fetched, json.dumps(snapshot, separators=(",", ":")))
+                )
+            if fetched - self._last_maintenance > 3600:
+                self._last_maintenance = fetched
+                self._maintain(fetched)
+
+    def _maintain(self, now: int):
+        """ apply retention and compaction. Must be called with the lock held. """
+        with self._db:
+            deleted = self._db.execute("DELETE FROM sample WHERE fetched < ?", (now - self._retention,)).rowcount
+            # keep only the last fetch per location and hour for the older samples
+            cutoff = now - self._compact_after
+            compacted = self._db.execute(
+                "DELETE FROM sample WHERE fetched < ? AND (loc, fetched) NOT IN "
+                "(SELECT loc, MAX(fetched) FROM sample WHERE fetched < ? GROUP BY loc, fetched / 3600)",
+                (cutoff, cutoff),
+            ).rowcount
+        if deleted or compacted:
+            logging.info(f"Forecast history: {deleted} expired and {compacted} compacted samples removed")
+
+    def last_snapshot(self, location: str, max_age: Optional[int] = None) -> Optional[dict]:
+        """ get the last stored snapshot for a location
+
+        Args:
+            location (str): location name
+            max_age (int, optional): maximum age in seconds. Defaults to None: no maximum.
+
+        Returns:
+            dict: the snapshot, as returned by get_forecast(), or None
+        """
+        with self._lock:
+            loc = self._loc(location)
+            if loc is None:
+                return None
+            row = self._db.execute("SELECT fetched, data FROM last_snapshot WHERE loc = ?", (loc,)).fetchone()
+        if row is None:
+            return None
+        if max_age is not None and row[0] < time.time() - max_age:
+            return None
+        return restore_keys(json.loads(row[1]))
+
+    def _query(self, sql: str, params: tuple) -> Iterator[tuple]:
+        """ run a query and yield the rows, without fetching them all at once """
+        with self._lock:
+            cursor = self._db.execute(sql, params)
+            rows = cursor.fetchmany(256)
+        while rows:
+            yield from rows
+            with self._lock:
+                rows = cursor.fetchmany(256)
+
+    def temperature_history(self, location: str, hours: float) -> Iterator[tuple[int, Optional[float]]]:
+        """ the observed ("now") temperature over the last hours
+
+        Args:
+            location (str): location name
+            hours (float): number of hours to look back
+
+        Yields:
+            tuple[int, float]: (timestamp, temperature), oldest first
+        """
+        loc = self._loc(location)
+        if loc is None:
+            return
+        since = int(time.time() - hours * 3600)
+        for target, v1 in self._query(
+            "SELECT target, v1 FROM sample WHERE loc = ? AND kind = ? AND target >= ? ORDER BY target", (loc, KIND_NOW, since)
+        ):
+            yield target, _unscaled(v1)
+
+    def forecast_evolution(self, location: str, kind: int, target: int) -> Iterator[tuple[int, Optional[float], Optional[float]]]:
+        """ how the forecast for one moment evolved over the successive fetches.
+        For example: forecast_evolution("Paris", KIND_DAILY, <timestamp of tomorrow>)
+
+        Args:
+            location (str): location name
+            kind (int): KIND_HOURLY, KIND_DAILY, KIND_RAIN or KIND_PARTIAL
+            target (int): the timestamp of the forecasted moment, as provided by the API
+
+        Yields:
+            tuple[int, float, float]: (fetch timestamp, value, second value), oldest first.
+                value is the temperature (temp_min for KIND_DAILY), or the rain for KIND_RAIN.
+                second value is temp_max for KIND_DAILY, else None.
+        """
+        loc = self._loc(location)
+        if loc is None:
+            return
+        for fetched, v1, v2 in self._query(
+            "SELECT fetched, v1, v2 FROM sample WHERE loc = ? AND kind = ? AND target = ? ORDER BY fetched", (loc, kind, target)
+        ):
+            yield fetched, _unscaled(v1), (_unscaled(v2) if kind == KIND_DAILY else None)
+
+
+def open_history(config: Optional[dict]) -> Optional[ForecastHistory]:
+    """ open the forecast store from the "history" section of the sender configuration
+
+    Args:
+        config (dict): the history configuration section, may be None
+
+    Returns:
+        ForecastHistory: the store, or None when not configured
+    """
+    if not config or not config.get("file"):
+        return None
+    try:
+        return ForecastHistory(
+            str(config.get("file")),
+            retention_days=int(config.get("retention_days", 30)),
+            compact_after_days=int(config.get("compact_after_days", 2)),
+        )
+    except sqlite3.Error as e:
+        logging.error(f"Forecast history {config.get('file')} can not be opened, running without it: {str(e)}")
+        return None
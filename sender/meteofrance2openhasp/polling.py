@@ -0,0 +1,72 @@
+from typing import Optional
+
+# Adaptive polling: the time until the next scan, from the content of the last forecast.
+#
+# When it rains, or rain is coming within the hour, the rain bars of the next hour change
+# every few minutes, so the scans are done every min_interval minutes. The same when the
+# temperature changes fast. When the weather is stable, scans are done every max_interval
+# minutes. In between, when precipitation is forecast in the coming hours but not yet in
+# the rain forecast of the next hour, the scan interval is used.
+
+# a change of this many degrees between two hours (or now and the next hour) is fast
+FAST_TEMPERATURE_CHANGE = 2.0
+
+# precipitation forecast within this many hours is "coming"
+PRECIPITATION_HOURS = 3
+
+
+def load_config(config: Optional[dict], scan_interval: float) -> Optional[tuple[float, float]]:
+    """ read the "adaptive_polling" section of the sender configuration
+
+    Args:
+        config (dict): the adaptive_polling configuration section, may be None
+        scan_interval (float): the minutes between scans, from the configuration
+
+    Raises:
+        ValueError: when the bounds are not valid
+
+    Returns:
+        tuple[float, float]: the minimum and maximum minutes between scans, or None when not configured
+    """
+    if not config or scan_interval <= 0:
+        return None
+    min_interval = float(config.get("min_interval") or scan_interval)
+    max_interval = float(config.get("max_interval") or scan_interval)
+    if min_interval <= 0 or not min_interval <= scan_interval <= max_interval:
+        raise ValueError("min_interval must be above 0 and at most scan_interval, max_interval at least scan_interval")
+    return min_interval, max_interval
+
+
+def next_interval(r: Optional[dict], scan_interval: float, bounds: Optional[tuple[float, float]]) -> tuple[float, str]:
+    """ choose the minutes until the next scan
+
+    Args:
+        r (dict): output from get_forecast(), None when there is none
+        scan_interval (float): the minutes between scans, from the configuration
+        bounds (tuple[float, float]): the minimum and maximum minutes between scans, from load_config(). None disables adaptive polling.
+
+    Returns:
+        tuple[float, str]: the minutes, and why
+    """
+    if bounds is None:
+        return scan_interval, "fixed scan interval"
+    min_interval, max_interval = bounds
+    if not r or not r.get("ok"):
+        return scan_interval, "no forecast"
+
+    rain = r.get("rain") or []
+    if rain and rain[0]:
+        return min_interval, "raining now"
+    if any(v for v in rain):
+        return min_interval, "rain within the hour"
+
+    hourly = [r["hourly"][k] for k in sorted(r.get("hourly") or {})]
+    temps = [r.get("now", {}).get("temp")] + [h.get("temp") for h in hourly]
+    temps = [t for t in temps if isinstance(t, (int, float))]
+    change = max((abs(b - a) for a, b in zip(temps, temps[1:])), default=0)
+    if change >= FAST_TEMPERATURE_CHANGE:
+        return min_interval, f"temperature changes {change:.1f}° in an hour"
+
+    if any(h.get("precipitation") for h in hourly[:PRECIPITATION_HOURS]):
+        return scan_interval, f"precipitation within {PRECIPITATION_HOURS} hours"
+    return max_interval, "stable weather"
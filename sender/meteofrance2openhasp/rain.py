@@ -0,0 +1,98 @@
+from bisect import bisect_right
+from typing import Optional, Sequence
+
+# Resampling of the rain nowcast into fixed-width time buckets.
+#
+# The nowcast is a list of (timestamp, value) entries at irregular intervals (5 minutes,
+# then 10 minutes). Each entry is valid from its timestamp until the next entry, the last
+# one for default_duration seconds. A bucket gets the average of the entries over it,
+# weighted by the time each entry overlaps the bucket. A bucket without any overlapping
+# entry is None.
+
+
+def intensity_to_mm(rain_intensity: int, max_rain: float) -> float:
+    """ convert the meteofrance rain intensity (1 = no rain ... 4 = heavy rain) to a value for the rain graph
+
+    Args:
+        rain_intensity (int): rain intensity, 1 ... 4
+        max_rain (float): the value at the top of the rain graph
+
+    Returns:
+        float: 0 ... max_rain
+    """
+    if rain_intensity <= 1:
+        return 0
+    if rain_intensity >= 4:
+        return max_rain
+    return (max_rain / 3.0) * (rain_intensity - 1)
+
+
+def bucket_edges(start: int, nr_buckets: int, bucket_seconds: int) -> list[int]:
+    """ the boundaries of the buckets: bucket i spans [edges[i], edges[i + 1])
+
+    Args:
+        start (int): timestamp of the start of the first bucket
+        nr_buckets (int): number of buckets
+        bucket_seconds (int): width of a bucket
+
+    Returns:
+        list[int]: nr_buckets + 1 timestamps
+    """
+    return [start + i * bucket_seconds for i in range(nr_buckets + 1)]
+
+
+def _resample_on(edges: list[int], entries: Sequence[tuple[int, float]], default_duration: int) -> list[Optional[float]]:
+    """ resample sorted entries on precomputed bucket edges """
+    nr_buckets = len(edges) - 1
+    weighted = [0.0] * nr_buckets
+    covered = [0] * nr_buckets
+    for i, (t0, value) in enumerate(entries):
+        t1 = entries[i + 1][0] if i < len(entries) - 1 else t0 + default_duration
+        if t1 <= edges[0] or t0 >= edges[-1]:
+            continue
+        # first bucket that overlaps the entry
+        b = max(bisect_right(edges, t0) - 1, 0)
+        while b < nr_buckets and edges[b] < t1:
+            overlap = min(t1, edges[b + 1]) - max(t0, edges[b])
+            if overlap > 0:
+                weighted[b] += value * overlap
+                covered[b] += overlap
+            b += 1
+    return [(weighted[b] / covered[b]) if covered[b] else None for b in range(nr_buckets)]
+
+
+def resample(
+    entries: Sequence[tuple[int, float]], start: int, nr_buckets: int, bucket_seconds: int = 600, default_duration: int = 600
+) -> list[Optional[float]]:
+    """ resample nowcast entries into buckets
+
+    Args:
+        entries (Sequence[tuple[int, float]]): (timestamp, value), sorted on timestamp
+        start (int): timestamp of the start of the first bucket, usually now
+        nr_buckets (int): number of buckets
+        bucket_seconds (int, optional): width of a bucket. Defaults to 600.
+        default_duration (int, optional): duration of the last entry. Defaults to 600.
+
+    Returns:
+        list[Optional[float]]: time weighted average per bucket, None when no entry overlaps the bucket
+    """
+    return _resample_on(bucket_edges(start, nr_buckets, bucket_seconds), entries, default_duration)
+
+
+def resample_many(
+    locations: Sequence[Sequence[tuple[int, float]]], start: int, nr_buckets: int, bucket_seconds: int = 600, default_duration: int = 600
+) -> list[list[Optional[float]]]:
+    """ resample the nowcasts of several locations on the same buckets. The bucket edges are computed once, each location is resampled as by resample().
+
+    Args:
+        locations (Sequence[Sequence[tuple[int, float]]]): per location, the entries as for resample()
+        start (int): timestamp of the start of the first bucket, usually now
+        nr_buckets (int): number of buckets
+        bucket_seconds (int, optional): width of a bucket. Defaults to 600.
+        default_duration (int, optional): duration of the last entry. Defaults to 600.
+
+    Returns:
+        list[list[Optional[float]]]: per location, as for resample()
+    """
+    edges = bucket_edges(start, nr_buckets, bucket_seconds)
+    return [_resample_on(edges, entries, default_duration) for entries in locations]
@@ -1,21 +1,69 @@
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 
-from meteofrance_api import MeteoFranceClient
+from collections import deque
 from datetime import datetime, timezone, UTC
 import json
-import paho.mqtt.client as mqtt
 import sys
 import logging
-from typing import Any
+import time
+from typing import Any, Callable
+import re
+
+import brokers
+import chart
+import datasets
+import fetch_cache
+import history
+import polling
+import rain
+import timeconv
+import tracing
+import trend
+
+if TYPE_CHECKING:
+    from concurrent.futures import ThreadPoolExecutor
+    import paho.mqtt.client as mqtt
+    import shard
 
 # max value in mm rain that is the top in the rain graph
 MAX_RAIN = 8.0
 
 # changing the following variables will require a thorough screen redesign
 NR_RAINSECTIONS = 6
+RAIN_SECTION_MINUTES = 10
 NR_HOURS_ON_MAIN_PAGE = 8
 NR_DAYS_IN_OVERVIEW = 8
 
+# the temperature graph on the main page, and the icons placed on it
+HOURLY_GRAPH = chart.PlotRect(y_low=280, height=15, x_left=30, x_step=60)
+HOURLY_ICON_Y_OFFSET = -25
+MIN_TEMPSCALE_HOURLY = 2
+# the hourly columns: the widths of the hour and temperature labels, and of the icon, centered on the point of their hour
+HOURLY_LABEL_WIDTH = 54
+HOURLY_ICON_WIDTH = 50
+
+# the temperature bars on the week overview page. Bars get WEEK_BAR_MIN_HEIGHT extra at the bottom, to always be visible.
+WEEK_BAR_MIN_HEIGHT = 1
+WEEK_GRAPH = chart.PlotRect(y_low=284 - WEEK_BAR_MIN_HEIGHT, height=284 - 222 - WEEK_BAR_MIN_HEIGHT, x_left=29, x_step=60)
+MIN_TEMPSCALE_WEEK = 1
+
+# minimum horizontal distance in pixels between the points of the past-plus-future temperature graph
+TREND_PX_PER_POINT = 4
+
+# priority classes of the commands to a plate. The classes are sent in this order, across all plates.
+PRIO_NOW = 0       # the current conditions, including their copies on other pages (extra_tempnow, extra_iconnow)
+PRIO_MAIN = 1      # the rest of the main page
+PRIO_OVERVIEW = 2  # the week overview page
+PRIO_DETAIL = 3    # the day detail pages
+PRIORITY_CLASSES = ["now", "main", "overview", "detail"]
+
+# the topic of a command to an object property, as sent by sendProp, sendTxt and sendImg
+COMMAND_TOPIC_RE = re.compile(r"^hasp/[^/]+/command/p(\d+)b(\d+)\.(\w+)$")
+# the last will topic of a plate, "online" once it is connected
+LWT_TOPIC_RE = re.compile(r"^hasp/([^/]+)/LWT$")
+# an element of a plate, like p11b7
+ELEMENT_RE = re.compile(r"^p(\d+)b\d+$")
+
 # this is tested and compatible with the following versions:
 
 # Python 3.11 ... 3.14
@@ -32,8 +80,8 @@ NR_DAYS_IN_OVERVIEW = 8
 
 # The pages must be consecutive, and in that order. The start page = configurable via start_page.
 
-# This code requires one to have set the time zone of the machine to the time zone of the to-be-displayed data.
-# (It won't be difficult to change that --see timestamp_to_locale_time--, it's just not done --yet)
+# Times are shown in the time zone of the location. A plate can override that for the hours on its main page
+# (see "timezone" in the plate configuration). The day parts on the detail pages always follow the location.
 
 # The code could be a bit more robust against network and meteofrance API problems (that happens),
 # but since the data is replaced fully every X minutes, doing that is lower priority.
@@ -63,6 +111,30 @@ def weekday_name_fr(nr: int, short: bool) -> str:
         return longnames[nr]
 
 
+def jsonl_value(prop: str, txt: str) -> Any:
+    """ convert a command payload to its value in openHASP jsonl
+
+    Args:
+        prop (str): the property
+        txt (str): the payload, as sent in a command
+
+    Returns:
+        Any: the value, for example a list for "points", a bool for "hidden"
+    """
+    if prop == "points":
+        try:
+            return json.loads(txt)
+        except ValueError:
+            return txt
+    if prop == "text":
+        return txt
+    if txt in ("True", "False"):
+        return txt == "True"
+    if txt.lstrip("-").isdigit():
+        return int(txt)
+    return txt
+
+
 def datediff_fr(nr: int) -> str:
     """ get the french name for the difference in days
 
@@ -86,33 +158,116 @@ def datediff_fr(nr: int) -> str:
         return f"Dans {nr} jours"
 
 
+class RenderedPlate:
+
+    def __init__(self, name: str):
+        """ the commands for a plate, per priority class, and the send statistics
+
+        Args:
+            name (str): the plate name
+        """
+        self.name = name
+        self.commands: list[list[tuple[str, str]]] = [[] for _ in PRIORITY_CLASSES]
+        # False when computing or sending the commands failed
+        self.ok = True
+        self.start_time = time.perf_counter()
+        self.nr_messages = 0
+        self.nr_bytes = 0
+        self.nr_deferred = 0
+
+
+class SendResult:
+
+    def __init__(self, ok: bool, plates: Optional[dict[str, bool]] = None):
+        """ the outcome of sending to the plates. True when everything went well.
+
+        Args:
+            ok (bool): True when OK
+            plates (dict[str, bool], optional): the outcome per plate name. Defaults to None: no plate was sent to.
+        """
+        self.ok = ok
+        self.plates = plates or {}
+
+    def __bool__(self) -> bool:
+        return self.ok
+
+    @property
+    def failed(self) -> list[str]:
+        """ the names of the plates that failed """
+        return [name for name, ok in self.plates.items() if not ok]
+
+
 class MeteoFrance2OpenHasp:
 
-    def __init__(self, mqtt_client: Optional[mqtt.Client]):
+    def __init__(self, mqtt_client: Optional["mqtt.Client"]):
         self._plates = []
         self._city = "" 
         self._max_nr_days_detail = 0
-        self._mqtt_client = mqtt_client
+        # the MQTT client per broker name, the constructor one is the default broker. Empty in mock mode.
+        self._mqtt_clients: dict[str, "mqtt.Client"] = {brokers.DEFAULT_BROKER: mqtt_client} if mqtt_client else {}
+        # per plate name, the name of its broker
+        self._plate_brokers: dict[str, str] = {}
+        # the threads that send to several brokers at once. Created when the plates use more than one broker.
+        self._broker_executor: Optional["ThreadPoolExecutor"] = None
+        # ring buffer with the most recent publishes, dumped in the log on error. None when disabled.
+        self._publish_trace: Optional[deque] = None
+        # local store of the fetched forecasts. None when disabled.
+        self._history: Optional[history.ForecastHistory] = None
+        self._history_config: Optional[dict] = None
+        # the fetch cache shared with the other processes on this host. None when not configured.
+        self._fetch_cache: Optional[fetch_cache.FetchCache] = None
+        self._fetch_cache_config: Optional[dict] = None
+        self._restore_max_age = 0
+        # observed temperatures, for the past-plus-future graph. None when no plate uses it.
+        self._trend: Optional[trend.TemperatureRing] = None
+        # the last fetched forecast, to be able to render to new plates without fetching
+        self._last_forecast: Optional[dict] = None
+        # the extra datasets, fetched on their own cadence, and the location they are fetched for
+        self._datasets: list[datasets.Dataset] = []
+        self._place: Optional[dict] = None
+        # per plate, page and object: the properties last sent, for the retained state snapshots. None when disabled.
+        self._plate_state: Optional[dict[str, dict[int, dict[int, dict[str, Any]]]]] = None
+        # per state topic, the payload last sent
+        self._state_sent: dict[str, str] = {}
+        # the worker processes that publish to the plates. None when publishing from this process.
+        self._shards: Optional["shard.ShardPool"] = None
+        # the threads that send to several plates at once. None when sending to one plate after the other.
+        self._executor: Optional["ThreadPoolExecutor"] = None
+        self._publish_threads = 1
+        # seconds after which the lower priority classes are deferred to the next cycle. 0 when there is no deadline.
+        self._publish_deadline = 0.0
+        # the priority classes deferred in the last cycle
+        self._deferred: set[int] = set()
+        # the minutes between scans, and the bounds of adaptive polling. None when the scan interval is fixed.
+        self._scan_interval = 0.0
+        self._polling_bounds: Optional[tuple[float, float]] = None
 
     def load_config(self, config: dict[str, Any]) -> bool:
-        """ validate the configuration and load the main variables from the configuration into the class variables """        
-        self._max_nr_days_detail = 0     
-        self._plates = config.get("plates")   
-        if not isinstance(self._plates, list):
+        """ validate the configuration and load the main variables from the configuration into the class variables.
+        Can be called again to reload the configuration: nothing changes when the new configuration is invalid. """        
+        max_nr_days_detail = 0     
+        max_trend_hours = 0
+        plates = config.get("plates")   
+        if not isinstance(plates, list):
             logging.error("Plates configuration must be a list.")
             return False
-        for plate in self._plates:
+        names = set()
+        for plate in plates:
             if not isinstance(plate.get("name"), str):
                 logging.error("Each plate must have a name of type string.")
                 return False
+            if plate.get("name") in names:
+                logging.error(f"Plate name '{plate.get('name')}' is used more than once.")
+                return False
+            names.add(plate.get("name"))
             if not isinstance(plate.get("start_page"), int):
                 logging.error(f"Plate '{plate.get('name')}' must have an integer 'start_page'.")
                 return False
             if not isinstance(plate.get("nr_days_detail"), int):
                 logging.error(f"Plate '{plate.get('name')}' must have an integer 'nr_days_detail'.")
                 return False
-            if plate.get("nr_days_detail") > self._max_nr_days_detail:
-                self._max_nr_days_detail = plate.get("nr_days_detail")
+            if plate.get("nr_days_detail") > max_nr_days_detail:
+                max_nr_days_detail = plate.get("nr_days_detail")
 
             if not isinstance(plate.get("extra_tempnow"), (str, type(None))):
                 logging.error(f"Plate '{plate.get('name')}' has invalid 'extra_tempnow' (must be string or null).")
@@ -120,13 +275,203 @@ class MeteoFrance2OpenHasp:
             if not isinstance(plate.get("extra_iconnow"), (str, type(None))):
                 logging.error(f"Plate '{plate.get('name')}' has invalid 'extra_iconnow' (must be string or null).")
                 return False
+            if plate.get("timezone") is not None and not timeconv.is_valid_zone(plate.get("timezone")):
+                logging.error(f"Plate '{plate.get('name')}' has invalid 'timezone' (must be a time zone name like 'Europe/Paris', or null).")
+                return False
+            if not isinstance(plate.get("trend_hours", 0), (int, type(None))) or (plate.get("trend_hours") or 0) < 0:
+                logging.error(f"Plate '{plate.get('name')}' has invalid 'trend_hours' (must be a positive integer or null).")
+                return False
+            if (plate.get("trend_hours") or 0) > max_trend_hours:
+                max_trend_hours = plate.get("trend_hours")
+            for widget in datasets.WIDGETS:
+                if not isinstance(plate.get(widget), (str, type(None))):
+                    logging.error(f"Plate '{plate.get('name')}' has invalid '{widget}' (must be string or null).")
+                    return False
+            if not isinstance(plate.get("broker"), (str, type(None))):
+                logging.error(f"Plate '{plate.get('name')}' has invalid 'broker' (must be the name of a broker in mqtt.brokers, or null).")
+                return False
             
-        self._city = config.get("city")            
-        if not isinstance(self._city, str):
+        city = config.get("city")            
+        if not isinstance(city, str):
             logging.error("City must be a string.")
             return False
+
+        publish_trace = config.get("publish_trace", 0)
+        if publish_trace is None:
+            publish_trace = 0
+        if not isinstance(publish_trace, int) or publish_trace < 0:
+            logging.error("'publish_trace' must be a positive integer.")
+            return False
+
+        publish_threads = config.get("publish_threads", 1)
+        if publish_threads is None:
+            publish_threads = 1
+        if not isinstance(publish_threads, int) or publish_threads < 1:
+            logging.error("'publish_threads' must be a positive integer.")
+            return False
+
+        publish_deadline = config.get("publish_deadline", 0)
+        if publish_deadline is None:
+            publish_deadline = 0
+        if not isinstance(publish_deadline, (int, float)) or publish_deadline < 0:
+            logging.error("'publish_deadline' must be a positive number of seconds.")
+            return False
+
+        shards = config.get("shards", 0)
+        if not isinstance(shards, (int, type(None))) or (shards or 0) < 0:
+            logging.error("'shards' must be a positive integer.")
+            return False
+
+        try:
+            scan_interval = float(config.get("scan_interval") or 0)
+            polling_bounds = polling.load_config(config.get("adaptive_polling"), scan_interval)
+        except (TypeError, ValueError, AttributeError) as e:
+            logging.error(f"Invalid 'adaptive_polling': {str(e)}.")
+            return False
+
+        state_snapshot = config.get("state_snapshot", False)
+        if not isinstance(state_snapshot, (bool, type(None))):
+            logging.error("'state_snapshot' must be true or false.")
+            return False
+
+        fetch_cache_config = config.get("fetch_cache")
+        if not isinstance(fetch_cache_config, (dict, type(None))):
+            logging.error("'fetch_cache' must be a section with at least a 'file'.")
+            return False
+        for key in ("ttl", "places_ttl"):
+            value = (fetch_cache_config or {}).get(key)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0):
+                logging.error(f"'fetch_cache.{key}' must be a positive number of minutes.")
+                return False
+
+        datasets_config = config.get("datasets")
+        if not isinstance(datasets_config, (dict, type(None))):
+            logging.error("'datasets' must be a section with the minutes between fetches per dataset.")
+            return False
+        for name, interval in (datasets_config or {}).items():
+            if name not in datasets.DATASETS:
+                logging.error(f"Unknown dataset '{name}', must be one of: {', '.join(datasets.DATASETS)}.")
+                return False
+            if not isinstance(interval, (int, type(None))) or (interval or 0) < 0:
+                logging.error(f"Dataset '{name}' must have a positive integer number of minutes, or null.")
+                return False
+
+        history_config = config.get("history")
+        if not isinstance(history_config, (dict, type(None))):
+            logging.error("'history' must be a section with at least a 'file'.")
+            return False
+        for key in ("retention_days", "compact_after_days", "restore_max_age"):
+            value = (history_config or {}).get(key, 0)
+            if not isinstance(value, int) or value < 0:
+                logging.error(f"'history.{key}' must be a positive integer.")
+                return False
+
+        # open the stores before applying anything, so that nothing changes when opening fails
+        new_history = self._history
+        if self._history is None or history_config != self._history_config:
+            new_history = history.open_history(history_config)
+        new_fetch_cache = self._fetch_cache
+        if self._fetch_cache is None or fetch_cache_config != self._fetch_cache_config:
+            try:
+                new_fetch_cache = fetch_cache.open_fetch_cache(fetch_cache_config)
+            except BaseException:
+                if new_history is not self._history and new_history is not None:
+                    new_history.close()
+                raise
+
+        # the configuration is valid: apply it
+        if self._plate_state is not None:
+            # the retained state of plates that are no longer sent to would stay on the broker forever
+            names = {plate["name"] for plate in plates}
+            self._clear_state([plate for plate in self._plates if not state_snapshot or plate["name"] not in names])
+        self._plates = plates
+        self._plate_brokers = {plate["name"]: plate.get("broker") or brokers.DEFAULT_BROKER for plate in plates}
+        self._city = city
+        self._max_nr_days_detail = max_nr_days_detail
+
+        if self._publish_trace is None or self._publish_trace.maxlen != publish_trace:
+            self._publish_trace = deque(maxlen=publish_trace) if publish_trace > 0 else None
+
+        self._publish_deadline = float(publish_deadline)
+        self._scan_interval = scan_interval
+        self._polling_bounds = polling_bounds
+        self._datasets = datasets.create(datasets_config, self._datasets)
+        if not state_snapshot:
+            self._plate_state = None
+            self._state_sent = {}
+        elif self._plate_state is None:
+            self._plate_state = {}
+
+        if publish_threads != self._publish_threads:
+            if self._executor:
+                self._executor.shutdown()
+                self._executor = None
+            if publish_threads > 1:
+                # imported here, as it is not needed when sending to one plate after the other
+                from concurrent.futures import ThreadPoolExecutor  # pylint: disable=import-outside-toplevel
+
+                self._executor = ThreadPoolExecutor(max_workers=publish_threads, thread_name_prefix="publish")
+            self._publish_threads = publish_threads
+
+        if new_history is not self._history:
+            if self._history:
+                self._history.close()
+            self._history = new_history
+        self._history_config = history_config
+        if new_fetch_cache is not self._fetch_cache:
+            if self._fetch_cache:
+                self._fetch_cache.close()
+            self._fetch_cache = new_fetch_cache
+        self._fetch_cache_config = fetch_cache_config
+        self._restore_max_age = int(history_config.get("restore_max_age", 60)) * 60 if history_config else 0
+
+        # size the ring buffer to hold the longest trend at one sample per scan
+        old_trend = self._trend
+        self._trend = None
+        if max_trend_hours > 0:
+            # with adaptive polling, the scans can be closer together
+            shortest_interval = min(scan_interval, polling_bounds[0]) if polling_bounds else scan_interval
+            self._trend = trend.TemperatureRing(int(max_trend_hours * 60 / (shortest_interval or 1)) + 2)
+            if old_trend is not None:
+                # reloaded: keep what was recorded
+                for ts, t in old_trend.since(0):
+                    self._trend.append(ts, t)
+            elif self._history:
+                for ts, t in self._history.temperature_history(self._city, max_trend_hours):
+                    self._trend.append(ts, t)
         return True
 
+    def next_scan_interval(self) -> tuple[float, str]:
+        """ the minutes until the next scan, adapted to the last forecast when adaptive polling is configured
+
+        Returns:
+            tuple[float, str]: the minutes, and why
+        """
+        return polling.next_interval(self._last_forecast, self._scan_interval, self._polling_bounds)
+
+    def _dump_publish_trace(self):
+        """ log the most recent publishes, if enabled. Used on errors. """
+        if not self._publish_trace:
+            return
+        entries = list(self._publish_trace)
+        self._publish_trace.clear()
+        logging.error("Last %d publishes before the error:\n%s", len(entries), "\n".join(f"{ts:.3f} {topic}: \"{txt}\"" for ts, topic, txt in entries))
+
+    def _cached(self, location: str, dataset: str, fetch: Callable[[], Any]) -> Any:
+        """ fetch through the fetch cache shared with the other processes on this host, when there is one
+
+        Args:
+            location (str): the key of the location
+            dataset (str): the dataset, see fetch_cache.DEFAULT_TTL
+            fetch (Callable[[], Any]): fetches the data, as JSON
+
+        Returns:
+            Any: the data
+        """
+        if self._fetch_cache is None:
+            return fetch()
+        return self._fetch_cache.get(location, dataset, fetch)
+
     def get_forecast(self, city: str = "Paris") -> dict:
         """ Get a simplified weather forecast.
         As the meteofrance-api library is aging a bit, this 
@@ -139,16 +484,28 @@ class MeteoFrance2OpenHasp:
             dict: weather forecast
         """
         try:
-            # Init client
+            # Init client. Imported here, as it is slow to import: that way the stored forecast is sent before that.
+            from meteofrance_api import MeteoFranceClient  # pylint: disable=import-outside-toplevel
+            from meteofrance_api.model import Forecast, Place  # pylint: disable=import-outside-toplevel
+
             client = MeteoFranceClient()
             now = int(datetime.now(timezone.utc).timestamp())
 
             # Search a location from name.
-            list_places = client.search_places(city)
+            with tracing.span("forecast.place_search", city=city):
+                list_places = [Place(p) for p in self._cached(city, "places", lambda: [p.raw_data for p in client.search_places(city)])]
             my_place = list_places[0]
+            self._place = {"latitude": my_place.latitude, "longitude": my_place.longitude, "department": my_place.admin2}
+            # the key of the location in the fetch cache
+            location = f"{my_place.latitude},{my_place.longitude}"
 
             # Fetch weather forecast for the location
-            my_place_weather_forecast = client.get_forecast_for_place(my_place)
+            with tracing.span("forecast.forecast"):
+                my_place_weather_forecast = Forecast(self._cached(location, "forecast", lambda: client.get_forecast_for_place(my_place).raw_data))
+
+            # the local days of the forecast window, in the time zone of the location
+            tz_name = my_place_weather_forecast.position["timezone"]
+            days = timeconv.LocalDays(tz_name, now, max(self._max_nr_days_detail, 1), timeconv.DAY_START_HOUR)
             # logging.info("************ Forecast (global)")
             # logging.info(json.dumps(my_place_weather_forecast.__dict__, indent=2))
             # logging.info("************ Forecast (by hour)")
@@ -181,6 +538,7 @@ class MeteoFrance2OpenHasp:
                     # avoid setlocale, just force french names
                     wf["wd"] = weekday_name_fr(int(ts.strftime("%w")), True)
                     wf["day"] = ts.strftime("%d")
+                    wf["dt"] = tf["dt"]
                     wf["temp_min"] = tf["T"]["min"]
                     wf["temp_max"] = tf["T"]["max"]
                     wf["desc"] = tf["weather12H"]["desc"]
@@ -202,6 +560,7 @@ class MeteoFrance2OpenHasp:
             obj["now"] = wf
 
             rainlist: list[Optional[float]] = [None] * NR_RAINSECTIONS
+            rain_entries: list[tuple[int, float]] = []
             # If rain in the hour forecast is available, get it.
             if my_place_weather_forecast.position["rain_product_available"] == 1:
                 RAIN_API_V3 = True
@@ -210,17 +569,19 @@ class MeteoFrance2OpenHasp:
                     rain_intensity_name = "rain_intensity"                
 
                     # v3 rain API, is better than the stock version. This is a very rough implementation.
-                    resp = client.session.request(
-                        "get", "v3/rain", params={"lat": my_place.latitude, "lon": my_place.longitude, "lang": "fr", "formatDate": "timestamp"}
-                    )
+                    with tracing.span("forecast.rain"):
+                        rain_data = self._cached(location, "rain", lambda: client.session.request(
+                            "get", "v3/rain", params={"lat": my_place.latitude, "lon": my_place.longitude, "lang": "fr", "formatDate": "timestamp"}
+                        ).json())
                     # yeah, I could also redefine Rain, but this is enough
                     # sort rf.forecast on timestamp
-                    rflist = sorted(resp.json()["properties"]["forecast"], key=lambda d: d[dtname])                
+                    rflist = sorted(rain_data["properties"]["forecast"], key=lambda d: d[dtname])                
                 else:
                     dtname = "dt"
                     rain_intensity_name = "rain"                 
 
-                    rf = client.get_rain(my_place.latitude, my_place.longitude)
+                    with tracing.span("forecast.rain"):
+                        rf = client.get_rain(my_place.latitude, my_place.longitude)
                     # sort rf.forecast on timestamp
                     rflist = sorted(rf.forecast, key=lambda d: d[dtname])
 
@@ -235,48 +596,14 @@ class MeteoFrance2OpenHasp:
                 # logging.info("************ Rain forecast ")
                 # logging.info(json.dumps(rflist, indent=2))
 
-                for i in range(0, len(rflist)):
-                    rfdet = rflist[i]
-                    dt = rfdet[dtname]
-                    rain_intensity: int = rfdet[rain_intensity_name]
-                    if i < len(rflist) - 1:
-                        duration = int((rflist[i + 1][dtname] - dt) / 60)
-                    else:
-                        duration = 10
-                    difft = int(round((dt - now) / 60))
-                    # logging.info(f"+{difft} minutes, for ({duration}): {rain_intensity}")
-                    if difft <= -10:
-                        continue
-                    if difft < 0:
-                        difft = 0
-                    offset = int(difft / 10)
-                    remainder = int(difft % 10)
-                    if offset < len(rainlist):
-                        mm: float = 0
-                        if rain_intensity <= 1:
-                            mm = 0
-                        elif rain_intensity >= 4:
-                            mm = MAX_RAIN
-                        else:
-                            mm = (MAX_RAIN / 3.0) * (rain_intensity - 1) 
-                        # record in the slot
-                        if rainlist[offset] is not None:
-                            v = (mm + rainlist[offset]) / 2  # type: ignore
-                        else:
-                            v = mm
-                        rainlist[offset] = v
-                        # and add the remainder to the next slot
-                        if (remainder + duration >= 15) and offset < (len(rainlist) - 1):
-                            offset += 1
-                            if rainlist[offset] is not None:
-                                v = (mm + rainlist[offset]) / 2  # type: ignore
-                            else:
-                                v = mm
-                            rainlist[offset] = v                        
-                        # logging.info(f"{offset} -> {v}")
+                with tracing.span("forecast.rain_bucketing"):
+                    rain_entries = [(rfdet[dtname], rain.intensity_to_mm(rfdet[rain_intensity_name], MAX_RAIN)) for rfdet in rflist]
+                    rainlist = rain.resample(rain_entries, now, NR_RAINSECTIONS, RAIN_SECTION_MINUTES * 60)
 
             # logging.info(rainlist)
             obj["rain"] = rainlist
+            # the raw nowcast, for plates that want another resolution: see rain.resample()
+            obj["rain_entries"] = rain_entries
 
             # hourly
             wf = {}
@@ -293,8 +620,8 @@ class MeteoFrance2OpenHasp:
                 # logging.info(f"now = {now}, dt = {dt}")
                 if dt > now:
                     wfh = {}
-                    lt = my_place_weather_forecast.timestamp_to_locale_time(dt)
-                    wfh["h"] = lt.strftime('%-HH')
+                    wfh["h"] = f"{days.hour(dt)}H"
+                    wfh["dt"] = dt
                     wfh["temp"] = hf["T"]["value"]
                     wfh["desc"] = hf["weather"]["desc"]
                     wfh["icon"] = hf["weather"]["icon"]
@@ -320,29 +647,25 @@ class MeteoFrance2OpenHasp:
             # detailed day forecast
             # v2 API, is better than the stock version. This is a very rough implementation.
             wf = {}
-            resp = client.session.request(
-                "get",
-                "v2/forecast",
-                params={
-                    "lat": my_place.latitude,
-                    "lon": my_place.longitude,
-                    "lang": "fr",
-                    "formatDate": "timestamp",
-                    "instants": "morning,afternoon,evening,night",
-                },
-            )
-            dfs = resp.json()["properties"]["forecast"]
+            with tracing.span("forecast.v2_forecast"):
+                v2_data = self._cached(location, "forecast_v2", lambda: client.session.request(
+                    "get",
+                    "v2/forecast",
+                    params={
+                        "lat": my_place.latitude,
+                        "lon": my_place.longitude,
+                        "lang": "fr",
+                        "formatDate": "timestamp",
+                        "instants": "morning,afternoon,evening,night",
+                    },
+                ).json())
+            dfs = v2_data["properties"]["forecast"]
             dfs = sorted(dfs, key=lambda d: d["time"])
-            now_date = my_place_weather_forecast.timestamp_to_locale_time(now).date()
+            now_date = days.today
             for df in dfs:
-                # get the day
+                # get the day. meteofrance counts the night as belonging to the previous day
                 dt = df["time"]
-                f_day = my_place_weather_forecast.timestamp_to_locale_time(dt)
-                f_date = f_day.date()
-                diffdate = (f_date - now_date).days
-                # meteofrance counts the night as belonging to the previous day
-                if f_day.hour < 6:
-                    diffdate -= 1     
+                diffdate = days.day_offset(dt)
 
                 if diffdate > self._max_nr_days_detail:
                     continue
@@ -374,11 +697,14 @@ class MeteoFrance2OpenHasp:
                 wp["desc"] = df["weather_description"] 
                 # and for diagnostics:
                 wp["part"] = moment_day
-                wp["time"] = my_place_weather_forecast.timestamp_to_locale_time(dt).strftime("%d-%m %H:%M")
+                wp["time"] = days.local(dt).strftime("%d-%m %H:%M")
+                wp["dt"] = dt
                 wf[diffdate][md] = wp
 
             obj["partials"] = wf
 
+            obj["time"] = now
+            obj["timezone"] = tz_name
             obj["ok"] = True
             return obj
         except Exception as e:
@@ -394,6 +720,9 @@ class MeteoFrance2OpenHasp:
         nr_detail_pages: int = 4,
         extra_tempnow: Optional[str] = None,
         extra_iconnow: Optional[str] = None,
+        trend_hours: int = 0,
+        display_tz: Optional[str] = None,
+        widgets: Optional[dict[str, str]] = None,
     ) -> bool:
         """ send the data to a plate
 
@@ -404,10 +733,29 @@ class MeteoFrance2OpenHasp:
             nr_detail_pages (int, optional): the number of detail pages. Defaults to 4.
             extra_tempnow (str, optional): the element to which to replicate temp now. Defaults to None
             extra_iconnow (str, optional): the element to which to replicate weather icon now. Defaults to None
+            trend_hours (int, optional): the number of past hours to add to the temperature graph. Defaults to 0
+            display_tz (str, optional): the time zone for the hours on the main page. Defaults to None: the time zone of the location
+            widgets (dict[str, str], optional): the element per extra dataset widget, see datasets.WIDGETS. Defaults to None
 
         Returns:
             bool: True when OK
         """
+        plate = self._render(d, plate_name, start_page, nr_detail_pages, extra_tempnow, extra_iconnow, trend_hours, display_tz, widgets)
+        return self._publish_rendered([plate])[plate_name]
+
+    def _render(
+        self,
+        d: dict,
+        plate_name: str,
+        start_page: int,
+        nr_detail_pages: int,
+        extra_tempnow: Optional[str],
+        extra_iconnow: Optional[str],
+        trend_hours: int,
+        display_tz: Optional[str],
+        widgets: Optional[dict[str, str]] = None,
+    ) -> "RenderedPlate":
+        """ compute the commands for a plate, without sending them. Arguments as for sendDataToHASP(). """
 
         def formatT(temp) -> str:
             """format temperature
@@ -425,6 +773,19 @@ class MeteoFrance2OpenHasp:
             except:
                 return "??"
 
+        plate = RenderedPlate(plate_name)
+        # the priority class of the commands, set per section below
+        prio = PRIO_NOW
+
+        def publish(topic: str, txt: str):
+            """ queue a command, in the current priority class
+
+            Args:
+                topic (str): MQTT topic
+                txt (str): payload
+            """
+            plate.commands[prio].append((topic, txt))
+
         def sendProp(plate_name: str, el: str, prop: str, txt: str):
             """Send a property
 
@@ -436,13 +797,7 @@ class MeteoFrance2OpenHasp:
             """
             if txt is None:
                 txt = "[]"
-            topic = f"hasp/{plate_name}/command/{el}.{prop}"
-            if self._mqtt_client:
-                logging.debug(f"{topic}: \"{txt}\"")
-                mi = self._mqtt_client.publish(topic, txt)
-                mi.wait_for_publish()  # this does not seem to block until all is gone!
-            else:
-                logging.info(f"{topic}: \"{txt}\"")
+            publish(f"hasp/{plate_name}/command/{el}.{prop}", txt)
 
         def sendTxt(plate_name: str, el: str, txt: str):
             """ send text to a label
@@ -454,13 +809,7 @@ class MeteoFrance2OpenHasp:
             """
             if txt is None:
                 txt = "??"
-            topic = f"hasp/{plate_name}/command/{el}.text"
-            if self._mqtt_client:
-                logging.debug(f"{topic}: \"{txt}\"")
-                mi = self._mqtt_client.publish(topic, txt)
-                mi.wait_for_publish()  # this does not seem to block until all is gone!
-            else:
-                logging.info(f"{topic}: \"{txt}\"")
+            publish(f"hasp/{plate_name}/command/{el}.text", txt)
 
         def sendImg(plate_name: str, el: str, txt: str):
             """ send an image
@@ -472,18 +821,12 @@ class MeteoFrance2OpenHasp:
             """
             if txt is None:
                 txt = "p3j"
-            topic = f"hasp/{plate_name}/command/{el}.src"
-            txt = f"L:/{txt}.bin"
-            if self._mqtt_client:
-                logging.debug(f"{topic}: \"{txt}\"")                
-                mi = self._mqtt_client.publish(topic, txt)
-                mi.wait_for_publish()  # this does not seem to block until all is gone!
-            else:
-                logging.info(f"{topic}: \"{txt}\"")
+            publish(f"hasp/{plate_name}/command/{el}.src", f"L:/{txt}.bin")
 
         try:
             # ##### main page ######
             # now
+            prio = PRIO_NOW
             try:
                 wf = d["now"]
             except:
@@ -500,7 +843,12 @@ class MeteoFrance2OpenHasp:
             sendTxt(plate_name, f"p{start_page}b8", wf["desc"])
             # sendTxt(plate_name, f"p{start_page}b31", wf["rain"])
 
+            # weather warnings and other extra datasets, in their own priority class
+            for prio_name, el, prop, txt in datasets.render(self._datasets, d.get("datasets"), widgets or {}):
+                plate.commands[PRIORITY_CLASSES.index(prio_name)].append((f"hasp/{plate_name}/command/{el}.{prop}", txt))
+
             # today
+            prio = PRIO_MAIN
             for t in [0, 1]:  # today, tomorrow
                 try:
                     wf = d["days"][t]
@@ -543,9 +891,11 @@ class MeteoFrance2OpenHasp:
             sendProp(plate_name, f"p{start_page}b42", "hidden", str(hadRain))
 
             # hourly
-            # draw icons + text and get min/max
-            tMin = None
-            tMax = None
+            # the hours are in the time zone of the location, unless the plate wants another one
+            plate_days = None
+            if display_tz and display_tz != d.get("timezone") and "time" in d:
+                plate_days = timeconv.LocalDays(display_tz, d["time"], 1)
+            # draw icons + text
             tArr = []
             for i in range(0, NR_HOURS_ON_MAIN_PAGE):
                 try:
@@ -553,7 +903,10 @@ class MeteoFrance2OpenHasp:
                 except:
                     wf = {"h": "??H", "temp": None, "desc": None, "icon": None, "precipitation": False}
                 base = 60 + (i * 3)
-                sendTxt(plate_name, f"p{start_page}b{base}", wf["h"])
+                if plate_days is not None and "dt" in wf:
+                    sendTxt(plate_name, f"p{start_page}b{base}", f"{plate_days.hour(wf['dt'])}H")
+                else:
+                    sendTxt(plate_name, f"p{start_page}b{base}", wf["h"])
                 sendImg(plate_name, f"p{start_page}b{base + 1}", wf["icon"])
                 sendTxt(plate_name, f"p{start_page}b{base + 2}", formatT(wf["temp"]))
                 sendProp(plate_name, f"p{start_page}b{base + 2}", "bg_color", "white")
@@ -562,66 +915,60 @@ class MeteoFrance2OpenHasp:
                 sendProp(plate_name, f"p{start_page}b{base + 2}", "bg_main_stop", "100")
                 raining = wf["precipitation"]
                 sendProp(plate_name, f"p{start_page}b{base + 2}", "bg_opa", "80" if raining else "0")
+                tArr.append(chart.to_int(wf["temp"]))
 
-                try:
-                    t = float(wf["temp"])
-                    ti = int(round(t, 0))
-                    # ti = t
-                    if tMin is None:
-                        tMin = ti
-                    if tMax is None: 
-                        tMax = ti
-                    if ti < tMin:
-                        tMin = ti
-                    if ti > tMax:
-                        tMax = ti
-                    tArr.append(ti)
-                except:
-                    tArr.append(None)
+            # past temperatures, for the past-plus-future graph
+            past = []
+            if trend_hours > 0 and self._trend is not None and "time" in d:
+                past = list(self._trend.since(d["time"] - trend_hours * 3600))
 
             # temp graph
-            # lowest temp to be shown at screenTL, and highest at screenTL - screenTRange
-            screenTL = 280
-            screenTRange = 15
-            screenImageTLOffset = -25
-            screenXLeft = 30
-            screenXStep = 60
-            scaleFactor = None
-            if not (tMin is None or tMax is None):
-                tempRange = tMax - tMin
-                # make it minimum MIN_TEMPSCALE degrees scale
-                MIN_TEMPSCALE = 2
-                if tempRange < MIN_TEMPSCALE:
-                    addMargin = (MIN_TEMPSCALE - tempRange) / 2
-                    tMin -= addMargin
-                    tMax += addMargin
-                    tempRange = tMax - tMin
-                if tempRange > 0:
-                    scaleFactor = screenTRange / tempRange
-                else:
-                    scaleFactor = None
+            hourly_chart = chart.Chart(HOURLY_GRAPH, MIN_TEMPSCALE_HOURLY)
+            hourly_chart.fit(tArr, [chart.to_int(t) for _, t in past])
 
             # temp graph: place the icons at the right height, and determine the line graph points
-            x = screenXLeft
-            i = 0
-            points = []
-            for t in tArr:
-                if t is None or scaleFactor is None:
-                    v = screenTL - (screenTRange / 2)
-                else:
-                    v = screenTL - (scaleFactor * (t - tMin))
-                y = int(round(v, 0))
-                points.append([x, y])
+            points = hourly_chart.line_points(tArr)
+            for i, (_, y) in enumerate(points):
                 base = 60 + (i * 3)
-                sendProp(plate_name, f"p{start_page}b{base + 1}", "y", str(y + screenImageTLOffset))
-                x += screenXStep
-                i += 1
+                sendProp(plate_name, f"p{start_page}b{base + 1}", "y", str(y + HOURLY_ICON_Y_OFFSET))
+            # the center of each hourly column, None when there is no hour to show
+            columns = [x for x, _ in points]
+            if past:
+                # past plus future: the line spans the same width, but on a time scale, up to the last hour shown
+                hours = [d["hourly"].get(i + 1, {}) for i in range(NR_HOURS_ON_MAIN_PAGE)]
+                future = [(wf["dt"], t) for wf, t in zip(hours, tArr) if "dt" in wf and t is not None]
+                t_start = d["time"] - trend_hours * 3600
+                t_end = future[-1][0] if future else d["time"] + NR_HOURS_ON_MAIN_PAGE * 3600
+                xWidth = (NR_HOURS_ON_MAIN_PAGE - 1) * HOURLY_GRAPH.x_step
+
+                def time_x(ts: int) -> int:
+                    return int(round(HOURLY_GRAPH.x_left + xWidth * (ts - t_start) / (t_end - t_start), 0))
+
+                series = past + future
+                ys = hourly_chart.y_values([t for _, t in series])
+                points = trend.downsample(list(zip([time_x(ts) for ts, _ in series], ys)), TREND_PX_PER_POINT)
+                # the hourly columns move with their hour, so that the icons stay on the line
+                columns = [time_x(wf["dt"]) if "dt" in wf and wf["dt"] <= t_end else None for wf in hours]
+            if trend_hours > 0:
+                # the columns are on the time scale or back on the hourly grid, and are hidden where they would overlap the one before
+                shown = None
+                for i, x in enumerate(columns):
+                    base = 60 + (i * 3)
+                    hidden = x is None or (shown is not None and x - shown < HOURLY_LABEL_WIDTH)
+                    if not hidden:
+                        shown = x
+                        sendProp(plate_name, f"p{start_page}b{base}", "x", str(x - HOURLY_LABEL_WIDTH // 2))
+                        sendProp(plate_name, f"p{start_page}b{base + 1}", "x", str(x - HOURLY_ICON_WIDTH // 2))
+                        sendProp(plate_name, f"p{start_page}b{base + 2}", "x", str(x - HOURLY_LABEL_WIDTH // 2))
+                    for el in range(base, base + 3):
+                        sendProp(plate_name, f"p{start_page}b{el}", "hidden", str(hidden))
             # the temp line graph
-            sendProp(plate_name, f"p{start_page}b41", "points", str(points))
+            sendProp(plate_name, f"p{start_page}b41", "points", chart.points_payload(points))
 
             # ##### week overview page ######
-            tMin = None
-            tMax = None
+            prio = PRIO_OVERVIEW
+            lows = []
+            highs = []
             # the icons and the texts
             for i in range(0, NR_DAYS_IN_OVERVIEW):
                 try:
@@ -634,86 +981,19 @@ class MeteoFrance2OpenHasp:
                 sendImg(plate_name, f"p{start_page + 1}b{base + 2}", wf["icon"])
                 sendTxt(plate_name, f"p{start_page + 1}b{base + 5}", formatT(wf["temp_min"]))
                 sendTxt(plate_name, f"p{start_page + 1}b{base + 3}", formatT(wf["temp_max"]))
-                try:
-                    t = float(wf["temp_min"])
-                    ti = int(round(t, 0))
-                    # ti = t
-                    if tMin is None:
-                        tMin = ti
-                    if tMax is None: 
-                        tMax = ti
-                    if ti < tMin:
-                        tMin = ti
-                    if ti > tMax:
-                        tMax = ti
-                except:
-                    pass
-                try:
-                    t = float(wf["temp_max"])
-                    ti = int(round(t, 0))
-                    # ti = t
-                    if tMin is None:
-                        tMin = ti
-                    if tMax is None: 
-                        tMax = ti
-                    if ti < tMin:
-                        tMin = ti
-                    if ti > tMax:
-                        tMax = ti
-                except:
-                    pass
-                    # now print temp graph
-
-            # determine the bar graphs. highest temp to be shown at screenTL, and lowest at screenTL + screenTRange
-            min_height = 1
-            screenTL = 222
-            screenTRange = 284 - 222 - min_height
-            screenXLeft = 29
-            screenXStep = 60
-            scaleFactor = None
-            if not (tMin is None or tMax is None):
-                tempRange = tMax - tMin
-                # make it minimum MIN_TEMPSCALE degrees scale
-                MIN_TEMPSCALE = 1
-                if tempRange < MIN_TEMPSCALE:
-                    addMargin = (MIN_TEMPSCALE - tempRange) / 2
-                    tMin -= addMargin
-                    tMax += addMargin
-                    tempRange = tMax - tMin
-                if tempRange > 0:
-                    scaleFactor = screenTRange / tempRange
-                else:
-                    scaleFactor = None
+                lows.append(chart.to_int(wf["temp_min"]))
+                highs.append(chart.to_int(wf["temp_max"]))
 
-            # the bar graphs
+            # the bar graphs. highest temp to be shown at the top, and lowest at the bottom
+            week_chart = chart.Chart(WEEK_GRAPH, MIN_TEMPSCALE_WEEK)
+            week_chart.fit(lows, highs)
+            bars = week_chart.bar_points(lows, highs, WEEK_BAR_MIN_HEIGHT)
             for i in range(0, NR_DAYS_IN_OVERVIEW):            
-                temp_min = None
-                temp_max = None
-                if scaleFactor is not None:
-                    try:
-                        wf = d["days"][i]
-                        temp_min = int(round(wf["temp_min"]))
-                        temp_max = int(round(wf["temp_max"]))
-                    except:
-                        pass
-                    if temp_min is None:
-                        temp_min = tMin
-                    if temp_max is None:
-                        temp_max = tMax
-
-                    y_max = int(round(screenTL + (scaleFactor * (tMax - temp_max)), 0))  # type: ignore
-                    y_min = int(round(screenTL + (scaleFactor * (tMax - temp_min)), 0)) + min_height  # type: ignore
-                else:
-                    y_max = screenTL
-                    y_min = screenTL + screenTRange + min_height
                 base = 20 + (i * 10)
-                x = screenXLeft + (i * screenXStep)
-                arr = []
-                arr.append([x, y_max])
-                arr.append([x, y_min])
-                sendProp(plate_name, f"p{start_page + 1}b{base + 6}", "points", str(arr))
+                sendProp(plate_name, f"p{start_page + 1}b{base + 6}", "points", chart.points_payload(bars[i]))
 
             # ###### day detail pages ######
+            prio = PRIO_DETAIL
             # day partials
             if 0 not in d["partials"]:
                 offset = 1 
@@ -742,37 +1022,428 @@ class MeteoFrance2OpenHasp:
                         sendTxt(plate_name, f"p{p}b{base + 3}", wf[part]["desc"])
 
         except Exception as e:
+            # what was computed before the error is still sent
             exc_type, exc_obj, exc_tb = sys.exc_info()
             logging.error(f"Exception on sending: {str(e)} at line {exc_tb.tb_lineno}")  # type: ignore
-            return False
+            plate.ok = False
+
+        return plate
+
+    def _publish_commands(self, plate: "RenderedPlate", prio: int) -> bool:
+        """ publish the commands of one priority class to a plate, in order
+
+        Args:
+            plate (RenderedPlate): the plate
+            prio (int): the priority class
 
+        Returns:
+            bool: True when OK
+        """
+        log_debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        try:
+            client = self._client(plate.name)
+            for topic, txt in plate.commands[prio]:
+                plate.nr_messages += 1
+                plate.nr_bytes += len(txt.encode("utf-8"))
+                if self._publish_trace is not None:
+                    self._publish_trace.append((time.time(), topic, txt))
+                if client:
+                    if log_debug:
+                        logging.debug('%s: "%s"', topic, txt)
+                    mi = client.publish(topic, txt)
+                    with tracing.span("publish.wait", topic=topic):
+                        mi.wait_for_publish()  # this does not seem to block until all is gone!
+                else:
+                    logging.info('%s: "%s"', topic, txt)
+                if self._plate_state is not None:
+                    m = COMMAND_TOPIC_RE.match(topic)
+                    if m:
+                        pages = self._plate_state.setdefault(plate.name, {})
+                        pages.setdefault(int(m.group(1)), {}).setdefault(int(m.group(2)), {})[m.group(3)] = jsonl_value(m.group(3), txt)
+        except Exception as e:
+            logging.error(f"Exception on sending to plate {plate.name}: {str(e)}")
+            return False
         return True
 
-    def publish_weather(self) -> bool:
+    def _publish_state(self, plate_names: list[str]):
+        """ publish, retained, the state of the plates: per page, and as a whole, in jsonl, on state topics of the plate.
+        Only what changed since the last time is published. The plate does not read these: the whole state is sent to it
+        as a jsonl command when it comes online, see plate_online().
+
+        Args:
+            plate_names (list[str]): the names of the plates
+        """
+        # with shards, the pages are rendered and their state is kept by the shards
+        if self._plate_state is None or self._shards is not None:
+            return
+        for name in plate_names:
+            pages = self._plate_state.get(name)
+            if not pages:
+                continue
+            payloads = []
+            for page in sorted(pages):
+                objects = pages[page]
+                payload = "\n".join(
+                    json.dumps({"page": page, "id": obj_id, **objects[obj_id]}, ensure_ascii=False, separators=(",", ":")) for obj_id in sorted(objects)
+                )
+                payloads.append(payload)
+                self._publish_retained(name, f"hasp/{name}/state/p{page}", payload)
+            self._publish_retained(name, f"hasp/{name}/state/jsonl", "\n".join(payloads))
+
+    def plate_online(self, topic: str, payload: str):
+        """ send its state to a plate that (re)connected, so that it repaints without waiting for the next scan.
+        Called for the messages on hasp/+/LWT, from the network thread of the MQTT client.
+
+        Args:
+            topic (str): the topic, hasp/<plate>/LWT
+            payload (str): the payload, "online" when the plate connected
+        """
+        m = LWT_TOPIC_RE.match(topic)
+        if self._plate_state is None or self._shards is not None or not m or payload != "online":
+            return
+        name = m.group(1)
+        state = self._state_sent.get(f"hasp/{name}/state/jsonl")
+        if not state or name not in self._plate_brokers:
+            return
+        logging.info(f"Plate {name} is online, sending its state")
+        try:
+            client = self._client(name)
+            if client:
+                client.publish(f"hasp/{name}/command/jsonl", state)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error(f"Exception on sending the state to plate {name}: {str(e)}")
+
+    def _clear_state(self, plates: list[dict]):
+        """ remove the retained state of plates from the broker
+
+        Args:
+            plates (list[dict]): the plate configurations
+        """
+        for plate in plates:
+            name = plate["name"]
+            # the pages of the plate, and of its extra elements
+            pages = set(range(plate["start_page"], plate["start_page"] + plate["nr_days_detail"] + 1))
+            for key in ["extra_tempnow", "extra_iconnow"] + list(datasets.WIDGETS):
+                m = ELEMENT_RE.match(plate.get(key) or "")
+                if m:
+                    pages.add(int(m.group(1)))
+            pages.update((self._plate_state or {}).pop(name, {}))
+            for topic in [f"hasp/{name}/state/jsonl"] + [f"hasp/{name}/state/p{page}" for page in sorted(pages)]:
+                self._state_sent.pop(topic, None)
+                try:
+                    client = self._client(name)
+                    if client:
+                        client.publish(topic, "", retain=True)
+                    else:
+                        logging.info('%s (retained): ""', topic)
+                except Exception as e:  # pylint: disable=broad-except
+                    logging.error(f"Exception on clearing the state {topic}: {str(e)}")
+
+    def _publish_retained(self, plate_name: str, topic: str, payload: str):
+        """ publish a retained message to the broker of a plate, unless the same was already sent """
+        if self._state_sent.get(topic) == payload:
+            return
+        try:
+            client = self._client(plate_name)
+            if client:
+                client.publish(topic, payload, retain=True)
+            else:
+                logging.info('%s (retained): "%s"', topic, payload)
+            self._state_sent[topic] = payload
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error(f"Exception on sending the state {topic}: {str(e)}")
+
+    def set_mqtt_clients(self, clients: dict[str, "mqtt.Client"]):
+        """ publish over these MQTT clients, per broker name. The plates without a broker use the default one. """
+        self._mqtt_clients = dict(clients)
+
+    def _client(self, plate_name: str) -> Optional["mqtt.Client"]:
+        """ the MQTT client of the broker of a plate. None in mock mode.
+
+        Raises:
+            ValueError: when there is no connection to the broker of the plate
+        """
+        if not self._mqtt_clients:
+            return None
+        broker = self._plate_brokers.get(plate_name, brokers.DEFAULT_BROKER)
+        client = self._mqtt_clients.get(broker)
+        if client is None:
+            raise ValueError(f"no connection to MQTT broker '{broker}'")
+        return client
+
+    def _publish_per_broker(self, todo: list["RenderedPlate"], prio: int) -> list[bool]:
+        """ publish the commands of one priority class to plates on several brokers, a thread per broker
+
+        Args:
+            todo (list[RenderedPlate]): the plates
+            prio (int): the priority class
+
+        Returns:
+            list[bool]: per plate, True when OK
+        """
+        if self._broker_executor is None:
+            # imported here, as it is not needed with a single broker
+            from concurrent.futures import ThreadPoolExecutor  # pylint: disable=import-outside-toplevel
+
+            self._broker_executor = ThreadPoolExecutor(max_workers=len(self._mqtt_clients), thread_name_prefix="broker")
+        groups: dict[str, list[RenderedPlate]] = {}
+        for plate in todo:
+            groups.setdefault(self._plate_brokers.get(plate.name, brokers.DEFAULT_BROKER), []).append(plate)
+        futures = [
+            self._broker_executor.submit(lambda group: [self._publish_commands(plate, prio) for plate in group], group)
+            for group in groups.values()
+        ]
+        oks = {}
+        for group, future in zip(groups.values(), futures):
+            oks.update((plate.name, ok) for plate, ok in zip(group, future.result()))
+        return [oks[plate.name] for plate in todo]
+
+    def _publish_rendered(self, plates: list["RenderedPlate"], scan: bool = False) -> dict[str, bool]:
+        """ publish the commands of the plates, one priority class after the other across all plates.
+        Once the publish deadline has passed, the classes after PRIO_NOW that are left are not sent in this cycle.
+        A class is deferred at most one cycle in a row, so that it is never starved.
+
+        Args:
+            plates (list[RenderedPlate]): the plates
+            scan (bool, optional): True for the send of a scan, that records the deferred classes for the next scan.
+                Defaults to False: a send outside of the scans, that leaves that record alone.
+
+        Returns:
+            dict[str, bool]: per plate name, True when OK
+        """
+        start = time.monotonic()
+        deferred = set()
+        failed = set()
+        for prio, prio_name in enumerate(PRIORITY_CLASSES):
+            todo = [plate for plate in plates if plate.commands[prio] and plate.name not in failed]
+            if not todo:
+                continue
+            if prio > PRIO_NOW and self._publish_deadline and time.monotonic() - start > self._publish_deadline and prio not in self._deferred:
+                deferred.add(prio)
+                for plate in todo:
+                    plate.nr_deferred += len(plate.commands[prio])
+                continue
+            with tracing.span("publish.class", priority=prio_name, plates=len(todo)):
+                if self._executor is not None and len(todo) > 1:
+                    # a plate is sent to by a single thread, so that its commands stay in order
+                    oks = list(self._executor.map(lambda plate: self._publish_commands(plate, prio), todo))  # pylint: disable=cell-var-from-loop
+                elif len(self._mqtt_clients) > 1 and len({self._plate_brokers.get(plate.name) for plate in todo}) > 1:
+                    # the brokers are sent to at the same time, the plates of a broker one after the other
+                    oks = self._publish_per_broker(todo, prio)
+                else:
+                    oks = [self._publish_commands(plate, prio) for plate in todo]
+            failed.update(plate.name for plate, ok in zip(todo, oks) if not ok)
+        if scan:
+            self._deferred = deferred
+
+        if failed or not all(plate.ok for plate in plates):
+            self._dump_publish_trace()
+        for plate in plates:
+            if plate.name in failed:
+                plate.ok = False
+            if plate.nr_deferred:
+                logging.warning(
+                    "Plate %s: %d messages, %d bytes, in %.3f s, %d deferred to the next cycle",
+                    plate.name, plate.nr_messages, plate.nr_bytes, time.perf_counter() - plate.start_time, plate.nr_deferred
+                )
+            else:
+                logging.info("Plate %s: %d messages, %d bytes, in %.3f s", plate.name, plate.nr_messages, plate.nr_bytes, time.perf_counter() - plate.start_time)
+        self._publish_state([plate.name for plate in plates])
+        return {plate.name: plate.ok for plate in plates}
+
+    def publish_weather(self) -> "SendResult":
         if not self._city:
             logging.error("City not configured")
-            return False
+            return SendResult(False)
         logging.info(f"Fetching weather data for city: {self._city}")
-        r = self.get_forecast(self._city)
-        if not self._mqtt_client:
+        with tracing.span("forecast", city=self._city):
+            r = self.get_forecast(self._city)
+        if self._history and r["ok"]:
+            with tracing.span("history.append"):
+                self._history.append(self._city, r)
+        if self._trend is not None and r["ok"]:
+            self._trend.append(r["time"], r["now"]["temp"])
+        if r["ok"]:
+            # datasets that were never fetched are fetched now, the others between the scans
+            self._refresh_datasets([dataset for dataset in self._datasets if dataset.value is None and dataset.due()])
+            r["datasets"] = {dataset.name: dataset.value for dataset in self._datasets}
+            self._last_forecast = r
+        result = self._send_to_plates(r, scan=True)
+        if r["ok"]:
+            for dataset in self._datasets:
+                dataset.published = dataset.value
+        return result
+
+    def _refresh_datasets(self, due: list[datasets.Dataset]):
+        """ fetch datasets, for the location of the last forecast """
+        if not due or self._place is None:
+            return
+        # imported here, as it is slow to import. See get_forecast().
+        from meteofrance_api import MeteoFranceClient  # pylint: disable=import-outside-toplevel
+
+        client = MeteoFranceClient()
+        for dataset in due:
+            dataset.refresh(client, self._place)
+
+    def refresh_datasets(self) -> bool:
+        """ fetch the datasets that are due, and send those that changed to the plates. To be called regularly between the scans.
+
+        Returns:
+            bool: True when something was sent
+        """
+        self._refresh_datasets([dataset for dataset in self._datasets if dataset.due()])
+        changed = [dataset for dataset in self._datasets if dataset.value != dataset.published]
+        if not changed:
+            return False
+        values = {dataset.name: dataset.value for dataset in changed}
+        if self._last_forecast is not None:
+            # so that plates sent to from the cache get the current values too
+            self._last_forecast.setdefault("datasets", {}).update(values)
+        logging.info(f"Sending the changed datasets to the plates: {', '.join(values)}")
+        plates = []
+        for plate_config in self._plates:
+            plate = RenderedPlate(plate_config["name"])
+            for prio_name, el, prop, txt in datasets.render(changed, values, self._widgets(plate_config)):
+                plate.commands[PRIORITY_CLASSES.index(prio_name)].append((f"hasp/{plate.name}/command/{el}.{prop}", txt))
+            plates.append(plate)
+        for prio in range(len(PRIORITY_CLASSES)):
+            for plate in plates:
+                plate.ok = self._publish_commands(plate, prio) and plate.ok
+        self._publish_state([plate.name for plate in plates])
+        for dataset in changed:
+            dataset.published = dataset.value
+        return True
+
+    @staticmethod
+    def _widgets(plate: dict) -> dict[str, str]:
+        """ the element per extra dataset widget configured on a plate """
+        return {widget: plate[widget] for widget in datasets.WIDGETS if plate.get(widget)}
+
+    def publish_cached(self, plate_names: list[str]) -> "SendResult":
+        """ send the last fetched forecast to some plates, without fetching. Used when plates are added by a configuration reload.
+
+        Args:
+            plate_names (list[str]): the names of the plates to send to
+
+        Returns:
+            SendResult: True when OK. False when there is no forecast yet, or when sending failed.
+        """
+        if self._last_forecast is None:
+            return SendResult(False)
+        plates = [plate for plate in self._plates if plate["name"] in plate_names]
+        if not plates:
+            return SendResult(True)
+        return self._send_to_plates(self._last_forecast, plates)
+
+    def publish_forecast(
+        self, r: dict, plate_names: Optional[list[str]] = None, trend_samples: Optional[list] = None, scan: bool = True
+    ) -> "SendResult":
+        """ send a forecast fetched elsewhere to the plates. Used by the shards.
+
+        Args:
+            r (dict): output from get_forecast()
+            plate_names (list[str], optional): the names of the plates to send to. Defaults to None: all plates.
+            trend_samples (list, optional): the observed temperatures, (timestamp, temperature). Defaults to None.
+            scan (bool, optional): False for a send outside of the scans, see _publish_rendered(). Defaults to True.
+
+        Returns:
+            SendResult: True when OK
+        """
+        if self._trend is not None and trend_samples:
+            # samples that are already there are ignored
+            for ts, t in trend_samples:
+                self._trend.append(ts, t)
+        self._last_forecast = r
+        plates = None if plate_names is None else [plate for plate in self._plates if plate["name"] in plate_names]
+        return self._send_to_plates(r, plates, scan)
+
+    def set_shards(self, shards: Optional["shard.ShardPool"]):
+        """ publish to the plates through worker processes, or from this process when None """
+        self._shards = shards
+
+    def publish_last_snapshot(self) -> "SendResult":
+        """ send the last stored forecast to the plates, if recent enough. Used at startup, before the first fetch.
+
+        Returns:
+            SendResult: True when a stored forecast was sent
+        """
+        if not self._history or not self._city or self._restore_max_age <= 0:
+            return SendResult(False)
+        r = self._history.last_snapshot(self._city, self._restore_max_age)
+        if r is None:
+            return SendResult(False)
+        # the rain nowcast is for the next hour from when it was fetched: show what is left of it, or nothing
+        now = int(time.time())
+        if now - r["time"] >= NR_RAINSECTIONS * RAIN_SECTION_MINUTES * 60:
+            r["rain"] = [None] * NR_RAINSECTIONS
+            r["rain_entries"] = []
+        elif r.get("rain_entries"):
+            r["rain"] = rain.resample([tuple(e) for e in r["rain_entries"]], now, NR_RAINSECTIONS, RAIN_SECTION_MINUTES * 60)
+        logging.info(f"Sending the stored weather data for city {self._city}, from {datetime.fromtimestamp(r['time'])}")
+        self._last_forecast = r
+        return self._send_to_plates(r)
+
+    def _render_plate(self, r: dict, plate: dict) -> "RenderedPlate":
+        """ compute the commands for one plate, with the settings of the plate """
+        logging.info(f"Sending weather data to plate {plate['name']}")
+        with tracing.span("render", plate=plate["name"]):
+            return self._render(
+                r,
+                plate["name"],
+                plate["start_page"],
+                plate["nr_days_detail"],
+                plate["extra_tempnow"],
+                plate["extra_iconnow"],
+                plate.get("trend_hours") or 0,
+                plate.get("timezone"),
+                self._widgets(plate),
+            )
+
+    def _send_to_plates(self, r: dict, plates: Optional[list[dict]] = None, scan: bool = False) -> "SendResult":
+        """ send a forecast to the plates
+
+        Args:
+            r (dict): output from get_forecast()
+            plates (list[dict], optional): the plate configurations to send to. Defaults to None: all plates.
+            scan (bool, optional): True for the send of a scan, see _publish_rendered(). Defaults to False.
+
+        Returns:
+            SendResult: True when OK, with the outcome per plate
+        """
+        if not self._mqtt_clients:
             logging.info("************ outcome")
             logging.info(json.dumps(r, indent=1))
-            return True
+            return SendResult(True)
+        if not r["ok"]:
+            logging.error("Error sending data")
+            return SendResult(False)
+        if plates is None:
+            plates = self._plates
+        if not plates:
+            logging.error("No plates configured")
+            return SendResult(False)
+        if self._shards is not None:
+            trend_samples = list(self._trend.since(0)) if self._trend is not None else []
+            with tracing.span("render.shards", plates=len(plates)):
+                results = self._shards.publish(r, trend_samples, None if plates is self._plates else [plate["name"] for plate in plates], scan)
         else:
-            retv = False
-            if r["ok"]:
-                retv = True
-                if not self._plates:
-                    logging.error("No plates configured")
-                    return False
-                for plate in self._plates:
-                    logging.info(f"Sending weather data to plate {plate['name']}")
-                    if not self.sendDataToHASP(r, plate["name"], plate["start_page"], plate["nr_days_detail"], plate["extra_tempnow"], plate["extra_iconnow"]):
-                        retv = False
-            if not retv:
-                logging.error("Error sending data")
-                return False
-        return True
-    
+            results = self._publish_rendered([self._render_plate(r, plate) for plate in plates], scan)
+        result = SendResult(all(results.values()), results)
+        if not result:
+            logging.error(f"Error sending data to plates: {', '.join(result.failed)}")
+        return result
+
     def dispose(self):
-        pass
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+            self._publish_threads = 1
+        if self._broker_executor:
+            self._broker_executor.shutdown()
+            self._broker_executor = None
+        if self._history:
+            self._history.close()
+            self._history = None
+        if self._fetch_cache:
+            self._fetch_cache.close()
+            self._fetch_cache = None
@@ -0,0 +1,324 @@
+import json
+import logging
+import queue
+import signal
+import time
+from typing import Any, Optional
+
+# Publishing to the plates from several worker processes ("shards").
+#
+# The coordinator (the bridge) fetches the forecast once per cycle. Each shard is a process
+# that owns a fixed subset of the plates, with its own MQTT connection, and renders and
+# publishes to those plates. The forecast is serialized once per cycle into a compact JSON
+# buffer, and that same buffer is handed to every shard: it is never serialized per plate.
+#
+# Each shard reports a result per cycle. The coordinator aggregates them, keeps the health
+# of each shard, and restarts shards that died.
+#
+# On a configuration reload, the shards that keep the same plates on the same brokers get the new
+# sender configuration through their task queue, and keep their connection and their state. Only
+# the shards whose plates changed are restarted.
+
+# maximum time to wait for the results of all shards in a cycle
+SHARD_CYCLE_TIMEOUT = 120
+
+# maximum time to wait for a shard to stop
+SHARD_STOP_TIMEOUT = 10
+
+
+def partition(plates: list[dict], nr_shards: int) -> list[list[dict]]:
+    """ distribute the plates over the shards, round robin in configuration order
+
+    Args:
+        plates (list[dict]): the plate configurations
+        nr_shards (int): number of shards
+
+    Returns:
+        list[list[dict]]: per shard, its plates. Shards without plates are left out.
+    """
+    shards: list[list[dict]] = [[] for _ in range(max(nr_shards, 1))]
+    for i, plate in enumerate(plates):
+        shards[i % len(shards)].append(plate)
+    return [s for s in shards if s]
+
+
+def _worker(shard: int, sender_config: dict, mqtt_settings: Optional[dict], log_settings: dict, tasks, results):
+    """ the main function of a shard process
+
+    Args:
+        shard (int): shard number
+        sender_config (dict): the sender configuration, with only the plates of this shard
+        mqtt_settings (dict): brokers, keepalive, client_id, timeout. None in mock mode.
+        log_settings (dict): level, format and file of the logging of the coordinator
+        tasks (Queue): (cycle, buffer, plate names or None, scan) to publish, ("config", sender configuration) to reload it, None to stop
+        results (Queue): (shard, cycle, ok per plate name, duration, connected) per publish task
+    """
+    # the coordinator handles the signals, and stops the shards
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, "SIGHUP"):  # not on Windows
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    if not logging.getLogger().handlers:
+        logging.basicConfig(filename=log_settings["file"], level=log_settings["level"], format=log_settings["format"])
+
+    # imported here, in the shard process only
+    import brokers  # pylint: disable=import-outside-toplevel
+    import history  # pylint: disable=import-outside-toplevel
+    from send_weather import MeteoFrance2OpenHasp  # pylint: disable=import-outside-toplevel
+
+    pool = None
+    if mqtt_settings is not None:
+        # only the brokers of the plates of this shard
+        used = {plate.get("broker") or brokers.DEFAULT_BROKER for plate in sender_config.get("plates") or []}
+        pool = brokers.BrokerPool([s for s in mqtt_settings["brokers"] if s["name"] in used], mqtt_settings["client_id"], mqtt_settings["keepalive"])
+        pool.connect(mqtt_settings["timeout"])
+
+    sender = MeteoFrance2OpenHasp(None)
+    if pool is not None:
+        sender.set_mqtt_clients(pool.clients)
+        pool.subscribe("hasp/+/LWT", sender.plate_online)
+    if not sender.load_config(sender_config):
+        logging.error(f"Shard {shard}: invalid sender configuration.")
+        return
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            if task[0] == "config":
+                # the same plates on the same brokers, see ShardPool.reconfigure()
+                if not sender.load_config(task[1]):
+                    logging.error(f"Shard {shard}: invalid sender configuration, keeping the current one.")
+                continue
+            cycle, buffer, plate_names, scan = task
+            start = time.perf_counter()
+            snapshot = json.loads(buffer)
+            result = sender.publish_forecast(history.restore_keys(snapshot["forecast"]), plate_names, snapshot["trend"], scan)
+            connected = pool.is_connected() if pool else True
+            results.put((shard, cycle, result.plates, time.perf_counter() - start, connected))
+    finally:
+        sender.dispose()
+        if pool:
+            pool.close()
+
+
+class ShardHealth:
+
+    def __init__(self, shard: int, plates: list[str]):
+        self.shard = shard
+        self.plates = plates
+        self.alive = False
+        self.connected = False
+        self.restarts = 0
+        # the last cycle with a result, its outcome and duration
+        self.last_cycle = 0
+        self.last_ok = False
+        self.last_duration = 0.0
+        # number of cycles in a row without a good result
+        self.failures = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return dict(self.__dict__)
+
+
+class ShardPool:
+
+    def __init__(self, sender_config: dict, nr_shards: int, mqtt_settings: Optional[dict]):
+        """ create the shards. They are started by start().
+
+        Args:
+            sender_config (dict): the sender configuration
+            nr_shards (int): number of shards. There are never more shards than plates.
+            mqtt_settings (dict): brokers, keepalive, client_id, timeout. None in mock mode. See brokers.broker_settings().
+                Each shard connects with client_id plus its shard number.
+        """
+        # imported here, as it is not needed without shards
+        import multiprocessing  # pylint: disable=import-outside-toplevel
+
+        # spawn, not fork: the coordinator has threads (MQTT loop), that do not survive a fork
+        self._ctx = multiprocessing.get_context("spawn")
+        self._sender_config = sender_config
+        self._mqtt_settings = mqtt_settings
+        self._nr_shards = nr_shards
+        self._results = self._ctx.Queue()
+        self._cycle = 0
+        self._set_plates(partition(list(sender_config.get("plates") or []), nr_shards))
+
+    def _set_plates(self, plates: list[list[dict]]):
+        """ set the plates per shard, for shards that are not started yet """
+        self._plates = plates
+        self._tasks: list[Any] = [None] * len(self._plates)
+        self._processes: list[Any] = [None] * len(self._plates)
+        self._health = [ShardHealth(i + 1, [p["name"] for p in plates]) for i, plates in enumerate(self._plates)]
+
+    def __len__(self) -> int:
+        return len(self._plates)
+
+    def _log_settings(self) -> dict:
+        """ the logging settings of the coordinator, for the shards """
+        root = logging.getLogger()
+        settings: dict[str, Any] = {"level": root.level, "format": None, "file": None}
+        for handler in root.handlers:
+            if handler.formatter and settings["format"] is None:
+                settings["format"] = handler.formatter._fmt  # pylint: disable=protected-access
+            if isinstance(handler, logging.FileHandler):
+                settings["file"] = handler.baseFilename
+        return settings
+
+    def _start_shard(self, i: int):
+        """ start, or restart, a shard """
+        mqtt_settings = None
+        if self._mqtt_settings is not None:
+            mqtt_settings = dict(self._mqtt_settings, client_id=f"{self._mqtt_settings['client_id']}-shard{i + 1}")
+        self._tasks[i] = self._ctx.Queue()
+        self._processes[i] = self._ctx.Process(
+            target=_worker,
+            name=f"shard{i + 1}",
+            args=(i + 1, self._shard_config(i), mqtt_settings, self._log_settings(), self._tasks[i], self._results),
+            daemon=True,
+        )
+        self._processes[i].start()
+        self._health[i].alive = True
+
+    def _shard_config(self, i: int) -> dict:
+        """ the sender configuration of a shard: only its plates, and no stores, that are used by the coordinator """
+        return dict(self._sender_config, plates=self._plates[i], history=None, fetch_cache=None)
+
+    def _stop_shard(self, i: int):
+        """ stop a shard, waiting for it to finish its current task """
+        if self._processes[i] is not None and self._processes[i].is_alive():
+            self._tasks[i].put(None)
+        self._join_shard(i)
+
+    def _join_shard(self, i: int):
+        """ wait for a shard that was asked to stop, and terminate it when it does not """
+        process = self._processes[i]
+        if process is None:
+            return
+        process.join(SHARD_STOP_TIMEOUT)
+        if process.is_alive():
+            logging.warning(f"Shard {i + 1} did not stop, terminating it.")
+            process.terminate()
+            process.join()
+        self._processes[i] = None
+        self._health[i].alive = False
+
+    def start(self):
+        """ start all shards """
+        for i in range(len(self._plates)):
+            self._start_shard(i)
+        logging.info(f"Started {len(self._plates)} shards: " + ", ".join(f"{h.shard}: {len(h.plates)} plates" for h in self._health))
+
+    def reconfigure(self, sender_config: dict):
+        """ apply a new sender configuration, with the same number of shards
+
+        The shards that keep the same plates, on the same brokers, get the new configuration through
+        their task queue. The others are restarted, and all of them when the number of shards with
+        plates changes.
+
+        Args:
+            sender_config (dict): the new sender configuration, already validated
+        """
+        def layout(plates: list[dict]) -> list[tuple[str, Optional[str]]]:
+            return [(p["name"], p.get("broker")) for p in plates]
+
+        plates = partition(list(sender_config.get("plates") or []), self._nr_shards)
+        self._sender_config = sender_config
+        if len(plates) != len(self._plates):
+            logging.info(f"Restarting the shards, now {len(plates)}.")
+            self.close()
+            self._set_plates(plates)
+            self.start()
+            return
+        for i, shard_plates in enumerate(plates):
+            same = layout(shard_plates) == layout(self._plates[i])
+            self._plates[i] = shard_plates
+            if same and self._processes[i] is not None and self._processes[i].is_alive():
+                self._tasks[i].put(("config", self._shard_config(i)))
+                continue
+            logging.info(f"Restarting shard {i + 1}, its plates changed.")
+            self._stop_shard(i)
+            self._health[i].plates = [p["name"] for p in shard_plates]
+            self._start_shard(i)
+
+    def publish(self, r: dict, trend_samples: list, plate_names: Optional[list[str]] = None, scan: bool = True) -> dict[str, bool]:
+        """ publish a forecast through the shards, and wait for their results
+
+        Args:
+            r (dict): output from get_forecast()
+            trend_samples (list): the observed temperatures, (timestamp, temperature)
+            plate_names (list[str], optional): the plates to send to. Defaults to None: all plates.
+            scan (bool, optional): False for a send outside of the scans, that does not change which priority classes
+                were deferred in the last scan. Defaults to True.
+
+        Returns:
+            dict[str, bool]: per plate name, True when it was sent successfully. The plates of a shard that did not report in time are False.
+        """
+        start = time.perf_counter()
+        self._cycle += 1
+        # serialized once, the same buffer goes to every shard
+        buffer = json.dumps({"forecast": r, "trend": trend_samples}, separators=(",", ":")).encode("utf-8")
+
+        pending = set()
+        for i, plates in enumerate(self._plates):
+            if plate_names is not None and not any(p["name"] in plate_names for p in plates):
+                continue
+            if not self._processes[i].is_alive():
+                logging.warning(f"Shard {i + 1} stopped with exit code {self._processes[i].exitcode}, restarting it.")
+                self._health[i].restarts += 1
+                self._start_shard(i)
+            self._tasks[i].put((self._cycle, buffer, plate_names, scan))
+            pending.add(i + 1)
+
+        nr_shards = len(pending)
+        deadline = time.monotonic() + SHARD_CYCLE_TIMEOUT
+        outcome: dict[str, bool] = {}
+        while pending:
+            try:
+                shard, cycle, plates, duration, connected = self._results.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                break
+            if cycle != self._cycle:
+                # a late result of an earlier cycle
+                continue
+            pending.discard(shard)
+            outcome.update(plates)
+            shard_ok = all(plates.values())
+            health = self._health[shard - 1]
+            health.last_cycle = cycle
+            health.last_ok = shard_ok
+            health.last_duration = duration
+            health.connected = connected
+            health.failures = 0 if shard_ok else health.failures + 1
+            logging.info(f"Shard {shard}: {len(plates)} plates, {'OK' if shard_ok else 'failed'}, in {duration:.3f} s")
+
+        for shard in sorted(pending):
+            health = self._health[shard - 1]
+            health.alive = self._processes[shard - 1].is_alive()
+            health.failures += 1
+            logging.error(f"Shard {shard} did not report in time (alive: {health.alive}, failures in a row: {health.failures}).")
+            for plate in self._plates[shard - 1]:
+                if plate_names is None or plate["name"] in plate_names:
+                    outcome[plate["name"]] = False
+
+        logging.info(f"Shards: {nr_shards - len(pending)}/{nr_shards} reported, {len(buffer)} bytes of forecast, in {time.perf_counter() - start:.3f} s")
+        return outcome
+
+    def health(self) -> list[dict[str, Any]]:
+        """ the health of each shard
+
+        Returns:
+            list[dict[str, Any]]: per shard: shard, plates, alive, connected, restarts, last_cycle, last_ok, last_duration, failures
+        """
+        for i, process in enumerate(self._processes):
+            self._health[i].alive = process is not None and process.is_alive()
+        return [h.as_dict() for h in self._health]
+
+    def close(self):
+        """ stop all shards """
+        # all asked to stop first, so that they stop together
+        for i, process in enumerate(self._processes):
+            if process is not None and process.is_alive():
+                self._tasks[i].put(None)
+        for i in range(len(self._processes)):
+            self._join_shard(i)
@@ -0,0 +1,120 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Conversion of the API timestamps to local time, in an explicit time zone.
+#
+# ZoneInfo objects are cached per time zone name. For a forecast window, LocalDays
+# computes the local day boundaries once, after which the day offset of a timestamp
+# is a bisect on integers, and its local hour is integer arithmetic on the days
+# without a DST change. Only entries on a DST change day still construct a datetime.
+
+# meteofrance counts the night (before this hour) as belonging to the previous day
+DAY_START_HOUR = 6
+
+
+@lru_cache(maxsize=None)
+def zone(name: str) -> ZoneInfo:
+    """ get a time zone, cached
+
+    Args:
+        name (str): IANA time zone name, for example "Europe/Paris"
+
+    Raises:
+        ZoneInfoNotFoundError: unknown time zone
+
+    Returns:
+        ZoneInfo: the time zone
+    """
+    return ZoneInfo(name)
+
+
+def is_valid_zone(name) -> bool:
+    """ True when name is a known time zone name """
+    if not isinstance(name, str) or not name:
+        return False
+    try:
+        zone(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+
+class LocalDays:
+
+    def __init__(self, tz_name: str, now: int, nr_days: int, day_start_hour: int = 0):
+        """ precompute the local day boundaries of a forecast window
+
+        Args:
+            tz_name (str): IANA time zone name
+            now (int): UTC timestamp of now. Its local calendar date is day 0.
+            nr_days (int): number of days after today to cover. Days outside the window are still handled, just slower.
+            day_start_hour (int, optional): local hour at which a day starts: earlier timestamps belong to the previous day. Defaults to 0 (midnight).
+        """
+        self.tz = zone(tz_name)
+        self.now = now
+        self._today = datetime.fromtimestamp(now, self.tz).date()
+        self._day_start_hour = day_start_hour
+        # boundaries[i] is the start of day (i - 1): one day before today, up to nr_days + 1 after
+        self._boundaries: list[int] = []
+        self._offsets: list[Optional[int]] = []
+        for k in range(-1, nr_days + 3):
+            d = self._today + timedelta(days=k)
+            start = datetime(d.year, d.month, d.day, day_start_hour, tzinfo=self.tz)
+            self._boundaries.append(int(start.timestamp()))
+        # the UTC offset of each day, None when it changes within the day (DST change)
+        for i in range(len(self._boundaries) - 1):
+            off_start = datetime.fromtimestamp(self._boundaries[i], self.tz).utcoffset()
+            off_end = datetime.fromtimestamp(self._boundaries[i + 1] - 1, self.tz).utcoffset()
+            self._offsets.append(int(off_start.total_seconds()) if off_start == off_end else None)  # type: ignore
+
+    @property
+    def today(self):
+        """ the local date of day 0 """
+        return self._today
+
+    def day_offset(self, ts: int) -> int:
+        """ the number of local days between now and a timestamp
+
+        Args:
+            ts (int): UTC timestamp
+
+        Returns:
+            int: 0 = today, 1 = tomorrow, -1 = yesterday, ...
+        """
+        idx = bisect_right(self._boundaries, ts) - 1
+        if 0 <= idx < len(self._boundaries) - 1:
+            return idx - 1
+        # outside of the precomputed window
+        local = datetime.fromtimestamp(ts, self.tz)
+        diff = (local.date() - self._today).days
+        if local.hour < self._day_start_hour:
+            diff -= 1
+        return diff
+
+    def hour(self, ts: int) -> int:
+        """ the local hour of a timestamp
+
+        Args:
+            ts (int): UTC timestamp
+
+        Returns:
+            int: 0 ... 23
+        """
+        idx = bisect_right(self._boundaries, ts) - 1
+        if 0 <= idx < len(self._offsets) and self._offsets[idx] is not None:
+            return ((ts + self._offsets[idx]) // 3600) % 24  # type: ignore
+        return datetime.fromtimestamp(ts, self.tz).hour
+
+    def local(self, ts: int) -> datetime:
+        """ the local time of a timestamp, as a datetime
+
+        Args:
+            ts (int): UTC timestamp
+
+        Returns:
+            datetime: local time
+        """
+        return datetime.fromtimestamp(ts, self.tz)
@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Optional
+
+# Lightweight span tracing of the fetch/render/publish cycle.
+#
+# Spans are written in the Chrome trace-event format ("JSON Array Format"), one
+# complete ("X") event per line. That format explicitly allows the closing "]" to be
+# missing, so the file can be appended to while running, and opened at any time in
+# chrome://tracing, https://ui.perfetto.dev or any other trace viewer.
+#
+# Tracing is cycle based: start_cycle() decides (via sample_rate) whether the cycle is
+# recorded, spans are buffered in memory, and end_cycle() appends them to the file.
+# When a cycle is not sampled, span() costs a flag check.
+
+
+class Tracer:
+
+    def __init__(self, file: Optional[str] = None, sample_rate: float = 1.0, max_bytes: int = 1048576, backup_count: int = 3):
+        """ create a tracer
+
+        Args:
+            file (str, optional): path to the trace file. None disables tracing. Defaults to None.
+            sample_rate (float, optional): fraction of the cycles to trace, 0.0 ... 1.0. Defaults to 1.0.
+            max_bytes (int, optional): size at which the trace file is rotated. Defaults to 1048576.
+            backup_count (int, optional): number of rotated files to keep. Defaults to 3.
+        """
+        self._file = file
+        self._sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._lock = threading.Lock()
+        self._events: list[dict] = []
+        self._sampled = False
+        self._pid = os.getpid()
+
+    @property
+    def enabled(self) -> bool:
+        return self._file is not None and self._sample_rate > 0
+
+    @property
+    def sampled(self) -> bool:
+        """ True when the current cycle is being recorded """
+        return self._sampled
+
+    def start_cycle(self) -> bool:
+        """ start a new cycle, and decide if it will be recorded
+
+        Returns:
+            bool: True when the cycle is sampled
+        """
+        with self._lock:
+            self._events = []
+            self._sampled = self.enabled and random.random() < self._sample_rate
+        return self._sampled
+
+    def end_cycle(self):
+        """ write the spans of the current cycle to the trace file """
+        with self._lock:
+            events = self._events
+            self._events = []
+            sampled = self._sampled
+            self._sampled = False
+        if not sampled or not events:
+            return
+        try:
+            self._rotate_if_needed()
+            is_new = not os.path.exists(self._file)  # type: ignore
+            with open(self._file, "a", encoding="utf-8") as file:  # type: ignore
+                if is_new:
+                    file.write("[\n")
+                for event in events:
+                    file.write(json.dumps(event, separators=(",", ":")))
+                    file.write(",\n")
+        except OSError as e:
+            logging.error(f"Could not write trace file '{self._file}': {str(e)}")
+
+    @contextmanager
+    def span(self, name: str, **args: Any):
+        """ record the duration of the enclosed block as a span
+
+        Args:
+            name (str): span name, for example "forecast.rain"
+            args: extra arguments shown in the trace viewer, for example the plate name
+        """
+        if not self._sampled:
+            yield
+            return
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            event = {
+                "name": name,
+                "cat": name.split(".", 1)[0],
+                "ph": "X",
+                "ts": start // 1000,
+                "dur": (end - start) // 1000,
+                "pid": self._pid,
+                "tid": threading.get_ident(),
+            }
+            if args:
+                event["args"] = args
+            with self._lock:
+                if self._sampled:
+                    self._events.append(event)
+
+    def _rotate_if_needed(self):
+        """ rotate the trace file like logging.handlers.RotatingFileHandler does """
+        try:
+            if os.path.getsize(self._file) < self._max_bytes:  # type: ignore
+                return
+        except OSError:
+            return
+        if self._backup_count <= 0:
+            os.remove(self._file)  # type: ignore
+            return
+        for i in range(self._backup_count - 1, 0, -1):
+            src = f"{self._file}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self._file}.{i + 1}")
+        os.replace(self._file, f"{self._file}.1")  # type: ignore
+
+
+# the tracer in use. Disabled until configure() is called.
+_tracer = Tracer()
+
+
+def settings(config: Optional[dict]) -> Optional[dict[str, Any]]:
+    """ read the "tracing" configuration section
+
+    Args:
+        config (dict): the tracing configuration section, may be None
+
+    Raises:
+        ValueError: when a value is not valid
+
+    Returns:
+        dict[str, Any]: the arguments of Tracer, or None when tracing is disabled
+    """
+    if not config or not config.get("file"):
+        return None
+    try:
+        values = {
+            "file": str(config.get("file")),
+            "sample_rate": float(config.get("sample_rate", 1.0)),
+            "max_bytes": int(config.get("max_bytes", 1048576)),
+            "backup_count": int(config.get("backup_count", 3)),
+        }
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid tracing configuration: {str(e)}") from e
+    if values["max_bytes"] <= 0 or values["backup_count"] < 0:
+        raise ValueError("Invalid tracing configuration: 'max_bytes' must be positive, and 'backup_count' not negative.")
+    return values
+
+
+def configure(config: Optional[dict]) -> Tracer:
+    """ set up the tracer from the "tracing" configuration section
+
+    Args:
+        config (dict): the tracing configuration section, may be None
+
+    Raises:
+        ValueError: when a value is not valid. The tracer in use is kept.
+
+    Returns:
+        Tracer: the tracer in use
+    """
+    global _tracer  # pylint: disable=global-statement
+    values = settings(config)
+    if values is None:
+        _tracer = Tracer()
+        return _tracer
+    _tracer = Tracer(**values)
+    logging.info(f"Tracing enabled to '{_tracer._file}', sample rate {_tracer._sample_rate}")
+    return _tracer
+
+
+def tracer() -> Tracer:
+    return _tracer
+
+
+def span(name: str, **args: Any):
+    """ shortcut for tracer().span() """
+    return _tracer.span(name, **args)
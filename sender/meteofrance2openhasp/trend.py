@@ -0,0 +1,96 @@
+import math
+from array import array
+from typing import Iterator, Optional
+
+# Rolling record of the observed ("now") temperature, for the past-plus-future graph on the main page.
+#
+# The ring buffer is backed by two fixed-size arrays, so its memory use does not change
+# over months of uptime, whatever the scan interval.
+
+
+class TemperatureRing:
+
+    def __init__(self, capacity: int):
+        """ create an empty ring buffer
+
+        Args:
+            capacity (int): maximum number of samples kept
+        """
+        self._capacity = max(int(capacity), 1)
+        self._times = array("q", [0] * self._capacity)
+        self._temps = array("d", [math.nan] * self._capacity)
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def append(self, timestamp: int, temp) -> None:
+        """ add a sample. Samples must be added in chronological order, older ones are ignored.
+
+        Args:
+            timestamp (int): UTC timestamp of the sample
+            temp: temperature. Anything that is not a number is recorded as missing.
+        """
+        if self._size and timestamp <= self._times[(self._start + self._size - 1) % self._capacity]:
+            return
+        try:
+            value = float(temp)
+        except (TypeError, ValueError):
+            value = math.nan
+        if self._size < self._capacity:
+            idx = (self._start + self._size) % self._capacity
+            self._size += 1
+        else:
+            idx = self._start
+            self._start = (self._start + 1) % self._capacity
+        self._times[idx] = int(timestamp)
+        self._temps[idx] = value
+
+    def since(self, timestamp: int) -> Iterator[tuple[int, float]]:
+        """ the samples at or after a moment, oldest first. Missing temperatures are skipped.
+
+        Args:
+            timestamp (int): UTC timestamp
+
+        Yields:
+            tuple[int, float]: (timestamp, temperature)
+        """
+        for i in range(self._size):
+            idx = (self._start + i) % self._capacity
+            if self._times[idx] >= timestamp and not math.isnan(self._temps[idx]):
+                yield self._times[idx], self._temps[idx]
+
+
+def downsample(points: list[tuple[int, int]], px_per_point: int) -> list[list[int]]:
+    """ reduce a line graph to at most one point per px_per_point pixels, by averaging the y values in each pixel column group
+
+    Args:
+        points (list[tuple[int, int]]): (x, y) screen coordinates, sorted on x
+        px_per_point (int): minimum horizontal distance between the resulting points
+
+    Returns:
+        list[list[int]]: [x, y] screen coordinates, sorted on x
+    """
+    step = max(int(px_per_point), 1)
+    result = []
+    group: Optional[int] = None
+    xs = 0
+    ys = 0
+    n = 0
+    for x, y in points:
+        g = x // step
+        if g != group and n:
+            result.append([int(round(xs / n)), int(round(ys / n))])
+            xs = ys = n = 0
+        group = g
+        xs += x
+        ys += y
+        n += 1
+    if n:
+        result.append([int(round(xs / n)), int(round(ys / n))])
+    return result
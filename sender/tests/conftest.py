@@ -0,0 +1,153 @@
+# Shared fixtures of the tests: the recorded API responses, a frozen clock, and an MQTT client stand-in.
+#
+# The Meteo France API is replayed from tests/fixtures, and the clock is frozen at the time of the
+# recording, so that get_forecast() gives the same result on every run.
+#
+# tests/fixtures holds a hand-made set of responses, in the format of the API, that the golden files
+# are based on: see "source" in its meta.json. The responses recorded from the API by
+# record_fixtures.py are in tests/fixtures/recorded, one folder per recording.
+
+import json
+import os
+import signal
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SENDER_DIR = os.path.dirname(TESTS_DIR)
+FIXTURES_DIR = os.path.join(TESTS_DIR, "fixtures")
+RECORDED_DIR = os.path.join(FIXTURES_DIR, "recorded")
+GOLDEN_DIR = os.path.join(TESTS_DIR, "golden")
+
+sys.path.insert(0, os.path.join(SENDER_DIR, "meteofrance2openhasp"))
+sys.path.insert(0, os.path.join(SENDER_DIR, "tools"))
+
+# the fixture file per API path
+API_FIXTURES = {
+    "places": "places.json",
+    "forecast": "forecast.json",
+    "v3/rain": "rain.json",
+    "v2/forecast": "forecast_v2.json",
+}
+
+
+def pytest_addoption(parser):
+    parser.addoption("--update-golden", action="store_true", help="Write the golden files from the current output, instead of comparing.")
+    parser.addoption("--timing", action="store_true", help="Also check the render time budgets, which depend on the machine.")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "timing: checks a wall-clock time budget, only run with --timing")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--timing"):
+        return
+    skip = pytest.mark.skip(reason="time budget, run with --timing")
+    for item in items:
+        if "timing" in item.keywords:
+            item.add_marker(skip)
+
+
+def load_fixture(name: str, fixtures_dir: str = FIXTURES_DIR):
+    with open(os.path.join(fixtures_dir, name), encoding="utf-8") as file:
+        return json.load(file)
+
+
+RECORDED_AT = load_fixture("meta.json")["recorded_at"]
+CITY = load_fixture("meta.json")["city"]
+
+
+def recordings() -> list[str]:
+    """ the folders of the responses recorded from the API, by record_fixtures.py """
+    if not os.path.isdir(RECORDED_DIR):
+        return []
+    return sorted(name for name in os.listdir(RECORDED_DIR) if os.path.isfile(os.path.join(RECORDED_DIR, name, "meta.json")))
+
+
+def frozen_datetime(timestamp: int) -> type:
+    """ datetime, with now() at a fixed time """
+
+    class FrozenDatetime(datetime):
+
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.fromtimestamp(timestamp, tz)
+
+        @classmethod
+        def utcnow(cls):
+            return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
+    return FrozenDatetime
+
+
+class Response:
+
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+def replay(monkeypatch, fixtures_dir: str = FIXTURES_DIR) -> list[str]:
+    """ replay the API responses of a fixtures folder, at the time of their recording
+
+    Returns:
+        list[str]: the requested paths, filled as they are requested
+    """
+    import send_weather
+    from meteofrance_api import session
+    from meteofrance_api.model import forecast
+
+    requests = []
+    frozen = frozen_datetime(load_fixture("meta.json", fixtures_dir)["recorded_at"])
+
+    def request(self, method, path, *args, **kwargs):
+        requests.append(path)
+        return Response(load_fixture(API_FIXTURES[path], fixtures_dir))
+
+    monkeypatch.setattr(session.MeteoFranceSession, "request", request)
+    monkeypatch.setattr(send_weather, "datetime", frozen)
+    monkeypatch.setattr(forecast, "datetime", frozen)
+    return requests
+
+
+@pytest.fixture
+def recorded_api(monkeypatch):
+    """ replay the API responses of tests/fixtures, at the time of the recording. Yields the requested paths. """
+    yield replay(monkeypatch)
+
+
+class MessageInfo:
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+
+class RecordingClient:
+    """ MQTT client stand-in, that keeps what is published """
+
+    def __init__(self):
+        self.published: list[tuple[str, str]] = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((topic, payload))
+        return MessageInfo()
+
+
+@pytest.fixture
+def restore_signals():
+    """ put back the signal handlers, that a bridge replaces with its own """
+    signals = [getattr(signal, name) for name in ("SIGINT", "SIGTERM", "SIGHUP", "SIGUSR1") if hasattr(signal, name)]
+    handlers = {sig: signal.getsignal(sig) for sig in signals}
+    yield
+    for sig, handler in handlers.items():
+        signal.signal(sig, handler)
+
+
+@pytest.fixture
+def update_golden(request) -> bool:
+    return request.config.getoption("--update-golden")
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# Record the Meteo France API responses used by the tests into tests/fixtures/recorded.
+#
+# Each recording goes in its own folder, named after the city and the time of the recording. The
+# tests replay every recording, with the clock frozen at the time of the recording, and check that
+# it renders to every plate layout within the budgets (see test_recorded.py):
+#     python3 tests/record_fixtures.py [--city Paris]
+#
+# Needs network access to the Meteo France API.
+
+import argparse
+import json
+import os
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+RECORDED_DIR = os.path.join(TESTS_DIR, "fixtures", "recorded")
+
+
+def save(folder: str, name: str, data):
+    with open(os.path.join(folder, name), "w", encoding="utf-8", newline="\n") as file:
+        json.dump(data, file, ensure_ascii=False, indent=1)
+        file.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record the Meteo France API responses for the tests.")
+    parser.add_argument("--city", default="Paris", help="City to record. Default: Paris")
+    args = parser.parse_args()
+
+    from meteofrance_api import MeteoFranceClient  # pylint: disable=import-outside-toplevel
+
+    client = MeteoFranceClient()
+    recorded_at = int(time.time())
+    folder = os.path.join(RECORDED_DIR, f"{args.city.lower().replace(' ', '-')}-{time.strftime('%Y%m%d-%H%M', time.gmtime(recorded_at))}")
+    os.makedirs(folder, exist_ok=True)
+    places = client.session.request("get", "places", params={"q": args.city}).json()
+    place = places[0]
+    position = {"lat": place["lat"], "lon": place["lon"]}
+    save(folder, "places.json", places[:1])
+    save(folder, "forecast.json", client.session.request("get", "forecast", params=dict(position, lang="fr")).json())
+    save(folder, "rain.json", client.session.request("get", "v3/rain", params=dict(position, lang="fr", formatDate="timestamp")).json())
+    save(
+        folder,
+        "forecast_v2.json",
+        client.session.request(
+            "get", "v2/forecast", params=dict(position, lang="fr", formatDate="timestamp", instants="morning,afternoon,evening,night")
+        ).json(),
+    )
+    save(folder, "meta.json", {"recorded_at": recorded_at, "city": args.city, "source": "recorded"})
+    print(f"Recorded {args.city} at {recorded_at} in {folder}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# Sending to plates on several MQTT brokers: each plate only gets its commands over the connection of its broker.
+
+import pytest
+
+from conftest import CITY, RecordingClient
+from test_command_stream import LAYOUTS, forecast  # noqa: F401, the fixture
+
+
+def test_broker_settings():
+    import brokers
+
+    settings = brokers.broker_settings({"broker": "localhost", "port": "1883", "brokers": [{"name": "garage", "broker": "10.0.0.2"}]})
+    assert [(s["name"], s["broker"], s["port"]) for s in settings] == [("default", "localhost", 1883), ("garage", "10.0.0.2", 1883)]
+    with pytest.raises(ValueError):
+        brokers.broker_settings({"broker": "localhost", "brokers": [{"name": "default", "broker": "10.0.0.2"}]})
+    with pytest.raises(ValueError):
+        brokers.broker_settings({"broker": "localhost", "brokers": [{"broker": "10.0.0.2"}]})
+    # blank credentials, as from unset environment variables, mean no username at all
+    settings = brokers.broker_settings({"broker": " localhost ", "port": "", "username": "", "password": "none"})
+    assert (settings[0]["broker"], settings[0]["port"], settings[0]["username"], settings[0]["password"]) == ("localhost", 1883, None, None)
+    assert brokers.default_client_id("config/a.yaml") == brokers.default_client_id("config/a.yaml")
+    assert brokers.default_client_id("config/a.yaml") != brokers.default_client_id("config/b.yaml")
+    assert brokers.check_plates([{"name": "plate01"}, {"name": "plate02", "broker": "garage"}], ["default", "garage"])
+    assert not brokers.check_plates([{"name": "plate01", "broker": "attic"}], ["default", "garage"])
+
+
+def test_plates_on_their_broker(forecast):
+    from send_weather import MeteoFrance2OpenHasp
+
+    clients = {"default": RecordingClient(), "garage": RecordingClient()}
+    sender = MeteoFrance2OpenHasp(None)
+    sender.set_mqtt_clients(clients)
+    plates = [
+        {"name": f"plate0{i}", "extra_tempnow": None, "extra_iconnow": None, **LAYOUTS["default"], "broker": broker}
+        for i, broker in enumerate([None, "garage", "garage", "default"], 1)
+    ]
+    assert sender.load_config({"city": CITY, "plates": plates, "state_snapshot": True})
+    result = sender.publish_forecast(forecast)
+    sender.dispose()
+    assert result, "publishing failed"
+
+    def plates_of(client):
+        return {topic.split("/")[1] for topic, _ in client.published}
+
+    assert plates_of(clients["default"]) == {"plate01", "plate04"}
+    assert plates_of(clients["garage"]) == {"plate02", "plate03"}
+    # the same commands as over a single broker
+    single = RecordingClient()
+    sender = MeteoFrance2OpenHasp(single)  # type: ignore
+    assert sender.load_config({"city": CITY, "plates": plates, "state_snapshot": True})
+    sender.set_mqtt_clients({"default": single, "garage": single})
+    assert sender.publish_forecast(forecast)
+    sender.dispose()
+    assert sorted(single.published) == sorted(clients["default"].published + clients["garage"].published)
+
+
+def test_plate_on_missing_broker_fails(forecast):
+    from send_weather import MeteoFrance2OpenHasp
+
+    client = RecordingClient()
+    sender = MeteoFrance2OpenHasp(client)  # type: ignore
+    plates = [
+        {"name": "plate01", "extra_tempnow": None, "extra_iconnow": None, **LAYOUTS["default"]},
+        {"name": "plate02", "extra_tempnow": None, "extra_iconnow": None, **LAYOUTS["default"], "broker": "garage"},
+    ]
+    assert sender.load_config({"city": CITY, "plates": plates})
+    result = sender.publish_forecast(forecast)
+    sender.dispose()
+    assert result.failed == ["plate02"]
+    assert {topic.split("/")[1] for topic, _ in client.published} == {"plate01"}
@@ -0,0 +1,165 @@
+# Golden command-stream tests, with performance budgets.
+#
+# The recorded API responses are turned into a forecast by get_forecast(), and rendered to each plate
+# layout below. The command stream of each layout is compared to its golden file in tests/golden, one
+# "topic payload" per line (the format of plate_simulator.py --stream). The streams must also stay
+# within the budgets of tests/budgets.yaml: number of messages, payload bytes, and render time. The
+# render time depends on the machine, and is only checked with --timing.
+#
+# After an intended change of the output, rewrite the golden files with:
+#     python3 -m pytest tests --update-golden
+# and review the diff of tests/golden before committing it.
+
+import copy
+import json
+import os
+import statistics
+import time
+
+import pytest
+import yaml
+
+from conftest import CITY, GOLDEN_DIR, RECORDED_AT, TESTS_DIR, RecordingClient
+
+# the plate layouts, per name
+LAYOUTS = {
+    "default": {"start_page": 2, "nr_days_detail": 4},
+    "replicated": {"start_page": 2, "nr_days_detail": 4, "extra_tempnow": "p11b7", "extra_iconnow": "p11b6"},
+    "short": {"start_page": 2, "nr_days_detail": 1},
+    "trend": {"start_page": 2, "nr_days_detail": 4, "trend_hours": 6},
+    "timezone": {"start_page": 2, "nr_days_detail": 4, "timezone": "America/New_York"},
+    "widgets": {"start_page": 2, "nr_days_detail": 4, "vigilance_banner": "p11b8", "extra_wind": "p11b9"},
+}
+
+# the values of the extra datasets, for the widgets
+DATASET_VALUES = {
+    "vigilance": {"level": 3, "phenomenons": ["orages", "pluie-inondation"]},
+    "observation": {"wind_speed": 18, "wind_direction": "SO"},
+}
+
+# the observed temperatures, for the trend graph: every 5 minutes over the last 6 hours
+TREND_SAMPLES = [(RECORDED_AT - i * 300, round(9 + 4.5 * (72 - i) / 72, 1)) for i in range(72, 0, -1)]
+
+# number of renders of which the median is compared to the time budget
+TIMING_RUNS = 15
+
+# scales the time budgets, for slow machines
+TIME_FACTOR = float(os.environ.get("BUDGET_TIME_FACTOR", "1"))
+
+
+def load_budgets() -> dict:
+    with open(os.path.join(TESTS_DIR, "budgets.yaml"), encoding="utf-8") as file:
+        return yaml.safe_load(file)
+
+
+@pytest.fixture
+def forecast(recorded_api) -> dict:
+    """ the forecast of the recorded API responses """
+    from send_weather import MeteoFrance2OpenHasp
+
+    sender = MeteoFrance2OpenHasp(None)
+    # the forecast covers the detail pages of the longest layout
+    nr_days_detail = max(layout["nr_days_detail"] for layout in LAYOUTS.values())
+    assert sender.load_config({"city": CITY, "plates": [{"name": "plate01", "start_page": 2, "nr_days_detail": nr_days_detail}]})
+    r = sender.get_forecast(CITY)
+    assert r["ok"], "get_forecast() failed on the recorded responses"
+    return r
+
+
+def render(r: dict, layout: str) -> tuple[list[tuple[str, str]], float]:
+    """ render a forecast to a plate, as a fresh sender would
+
+    Returns:
+        tuple[list[tuple[str, str]], float]: the command stream, (topic, payload), and the seconds to render and publish it
+    """
+    from send_weather import MeteoFrance2OpenHasp
+
+    client = RecordingClient()
+    sender = MeteoFrance2OpenHasp(client)  # type: ignore
+    plate = {"name": "plate01", "extra_tempnow": None, "extra_iconnow": None, **LAYOUTS[layout]}
+    config = {"city": CITY, "plates": [plate]}
+    if layout == "widgets":
+        config["datasets"] = {name: 10 for name in DATASET_VALUES}
+        r = dict(r, datasets=DATASET_VALUES)
+    assert sender.load_config(config)
+    start = time.perf_counter()
+    # the observed temperatures end at the time of the forecast
+    trend_samples = [(ts - RECORDED_AT + r["time"], t) for ts, t in TREND_SAMPLES] if layout == "trend" else None
+    result = sender.publish_forecast(r, None, trend_samples)
+    duration = time.perf_counter() - start
+    sender.dispose()
+    assert result, "publishing failed"
+    return client.published, duration
+
+
+def compare_golden(name: str, text: str, update: bool):
+    file = os.path.join(GOLDEN_DIR, name)
+    if update:
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        with open(file, "w", encoding="utf-8", newline="\n") as f:
+            f.write(text)
+        return
+    assert os.path.exists(file), f"No golden file {name}: create it with --update-golden"
+    with open(file, encoding="utf-8") as f:
+        expected = f.read()
+    if text != expected:
+        # the first lines that differ, as the full streams are long
+        diff = [f"line {i + 1}:\n  expected: {e}\n  got:      {g}" for i, (e, g) in enumerate(zip(expected.splitlines(), text.splitlines())) if e != g]
+        pytest.fail(
+            f"{name} differs from the golden file ({len(expected.splitlines())} lines expected, {len(text.splitlines())} got). "
+            + "\n".join(diff[:10])
+        )
+
+
+def test_forecast_golden(forecast, recorded_api, update_golden):
+    assert recorded_api == ["places", "forecast", "v3/rain", "v2/forecast"]
+    compare_golden("forecast.json", json.dumps(forecast, ensure_ascii=False, indent=1) + "\n", update_golden)
+
+
+@pytest.mark.parametrize("layout", sorted(LAYOUTS))
+def test_command_stream_golden(forecast, layout, update_golden):
+    stream, _ = render(forecast, layout)
+    compare_golden(f"{layout}.txt", "".join(f"{topic} {payload}\n" for topic, payload in stream), update_golden)
+
+
+@pytest.mark.parametrize("layout", sorted(LAYOUTS))
+def test_command_stream_fits_pages(forecast, layout):
+    """ every command targets an object and property of files/pages_section.jsonl, apart from the configured extra elements """
+    import plate_simulator
+
+    extra = {el for key, el in LAYOUTS[layout].items() if key != "timezone" and isinstance(el, str)}
+    stream, _ = render(forecast, layout)
+    report = plate_simulator.simulate(stream).report()
+    assert set(report["unknown_objects"]) <= extra
+    assert not report["unknown_properties"]
+
+
+def test_trend_columns_on_line(forecast):
+    """ with the past temperatures, the hourly icons that are shown sit on the line, also with an hour without temperature """
+    r = copy.deepcopy(forecast)
+    r["hourly"][3]["temp"] = None
+    stream = dict(render(r, "trend")[0])
+    line = dict(tuple(p) for p in json.loads(stream["hasp/plate01/command/p2b41.points"]))
+    shown = [i for i in range(8) if stream[f"hasp/plate01/command/p2b{61 + i * 3}.hidden"] == "False"]
+    assert len(shown) >= 2
+    for i in shown:
+        x = int(stream[f"hasp/plate01/command/p2b{61 + i * 3}.x"]) + 25
+        if i != 2:
+            assert line[x] == int(stream[f"hasp/plate01/command/p2b{61 + i * 3}.y"]) + 25
+
+
+@pytest.mark.parametrize("layout", sorted(LAYOUTS))
+def test_budgets(forecast, layout):
+    budget = load_budgets()[layout]
+    stream, _ = render(forecast, layout)
+    nr_bytes = sum(len(topic) + len(payload.encode("utf-8")) for topic, payload in stream)
+    assert len(stream) <= budget["messages"], f"{len(stream)} messages, budget {budget['messages']}"
+    assert nr_bytes <= budget["bytes"], f"{nr_bytes} bytes, budget {budget['bytes']}"
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("layout", sorted(LAYOUTS))
+def test_render_time(forecast, layout):
+    budget = load_budgets()[layout]
+    render_ms = statistics.median(render(forecast, layout)[1] for _ in range(TIMING_RUNS)) * 1000
+    assert render_ms <= budget["render_ms"] * TIME_FACTOR, f"render in {render_ms:.2f} ms, budget {budget['render_ms'] * TIME_FACTOR:.2f} ms"
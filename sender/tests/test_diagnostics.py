@@ -0,0 +1,25 @@
+# The diagnostics: the MQTT messages still pending are counted over the clients of all brokers.
+
+from conftest import RecordingClient
+
+
+class PahoLikeClient:
+    """ the queues of a paho client, that the diagnostics look at """
+
+    def __init__(self, out_messages: int, in_messages: int, out_packet: int):
+        self._out_messages = dict.fromkeys(range(out_messages))
+        self._in_messages = dict.fromkeys(range(in_messages))
+        self._out_packet = [None] * out_packet
+
+
+def test_mqtt_pending_over_brokers():
+    import diagnostics
+
+    assert diagnostics._mqtt_pending([PahoLikeClient(2, 0, 1), PahoLikeClient(0, 1, 3)]) == 7  # pylint: disable=protected-access
+    # clients without those queues are left out, and unknown when none has them
+    assert diagnostics._mqtt_pending([PahoLikeClient(1, 0, 0), RecordingClient()]) == 1  # pylint: disable=protected-access
+    assert diagnostics._mqtt_pending([RecordingClient()]) is None  # pylint: disable=protected-access
+    assert diagnostics._mqtt_pending([]) is None  # pylint: disable=protected-access
+
+    report = diagnostics.Diagnostics().report([PahoLikeClient(2, 0, 0), PahoLikeClient(3, 0, 0)])
+    assert report.splitlines()[0].endswith("MQTT messages pending 5")
@@ -0,0 +1,40 @@
+# The fleet load test harness, on a small fleet: every message reaches its plate, and returning plates repaint.
+
+import os
+import sys
+
+import pytest
+
+from conftest import SENDER_DIR
+
+sys.path.insert(0, os.path.join(SENDER_DIR, "benchmarks"))
+
+
+def test_topic_matches():
+    import fleet
+
+    assert fleet.topic_matches("hasp/plate01/command/#", "hasp/plate01/command/p2b3.text")
+    assert fleet.topic_matches("hasp/+/LWT", "hasp/plate01/LWT")
+    assert not fleet.topic_matches("hasp/plate01/command/#", "hasp/plate02/command/p2b3.text")
+    assert not fleet.topic_matches("hasp/+/LWT", "hasp/plate01/LWT/x")
+
+
+# the bridge installs its own signal handlers
+@pytest.mark.usefixtures("restore_signals")
+def test_fleet_run():
+    import fleet
+
+    args = fleet.parse_args(["--plates", "6", "--cycles", "4", "--brokers", "2", "--latency", "1", "--jitter", "1",
+                             "--reboot-rate", "0.3", "--drop-rate", "0.3", "--state-snapshot"])
+    report = fleet.run(args)
+
+    assert report["cycles"] == 4
+    plates = report["plates"]
+    assert len(plates) == 6
+    assert all(p["cycles"] >= 1 and p["p50_ms"] <= p["p99_ms"] for p in plates.values())
+    assert all(p["unknown_objects"] == 0 for p in plates.values())
+    # with state_snapshot, the plates that came back got their state
+    assert sum(p["reboots"] + p["drops"] for p in plates.values()) > 0
+    assert sum(p["repaints"] for p in plates.values()) > 0
+    assert report["messages_published"] == report["messages_delivered"] + report["messages_dropped"]
+    assert set(report["brokers"]) == {"fleet-1", "fleet-2"}
@@ -0,0 +1,79 @@
+# The forecast history: compaction per location, and the stored forecast sent at startup.
+
+import time
+
+import pytest
+
+from conftest import CITY, RecordingClient
+from test_command_stream import LAYOUTS, forecast  # noqa: F401, the fixture
+
+DAY = 86400
+
+
+def test_compaction_per_location(tmp_path):
+    import history
+
+    store = history.ForecastHistory(str(tmp_path / "history.db"), retention_days=30, compact_after_days=2)
+    t0 = 1775293200  # at the start of an hour
+    # two fetches in the same hour for Paris, one for Lyon at the time of the first Paris fetch
+    for location, fetched in [("Paris", t0), ("Lyon", t0), ("Paris", t0 + 600)]:
+        store.append(location, {"ok": True, "time": fetched, "now": {"temp": 10, "icon": "p1j"}})
+    for location in ["Paris", "Lyon"]:
+        store.append(location, {"ok": True, "time": t0 + 3 * DAY, "now": {"temp": 12, "icon": "p1j"}})
+
+    assert [fetched for fetched, _, _ in store.forecast_evolution("Paris", history.KIND_NOW, t0)] == []
+    assert [fetched for fetched, _, _ in store.forecast_evolution("Paris", history.KIND_NOW, t0 + 600)] == [t0 + 600]
+    assert [fetched for fetched, _, _ in store.forecast_evolution("Lyon", history.KIND_NOW, t0)] == [t0]
+    store.close()
+
+
+@pytest.mark.usefixtures("restore_signals")
+@pytest.mark.parametrize("once, scan_interval, restored", [(False, 10, True), (True, 10, False), (False, 0, False)])
+def test_no_restore_for_a_single_cycle(tmp_path, monkeypatch, once, scan_interval, restored):
+    import bridge
+    import config_utils
+    from test_reload import write_config
+
+    config_file = tmp_path / "config.yaml"
+    (tmp_path / "secrets.yaml").write_text("{}\n", encoding="utf-8")
+    write_config(config_file, [{"name": "plate01"}], {"scan_interval": scan_interval, "history": {"file": str(tmp_path / "history.db")}})
+    config = config_utils.ConfigLoader(str(config_file), str(tmp_path / "secrets.yaml"))
+    config.load_config()
+    b = bridge.Bridge(config, once=once)
+    calls = []
+    monkeypatch.setattr(b._sender, "publish_last_snapshot", lambda: calls.append("restore"))  # pylint: disable=protected-access
+    # a single scan, also in a loop
+    monkeypatch.setattr(b._sender, "publish_weather", lambda: calls.append("fetch") or b.handle_signal(0, None))  # pylint: disable=protected-access
+    monkeypatch.setattr(b, "_await_with_interrupt", lambda *args: None)
+    b.run()
+    assert calls == (["restore", "fetch"] if restored else ["fetch"])
+
+
+def test_stored_rain_nowcast_expires(tmp_path, forecast, monkeypatch):
+    import rain
+    from send_weather import MeteoFrance2OpenHasp, NR_RAINSECTIONS
+
+    plate = {"name": "plate01", "extra_tempnow": None, "extra_iconnow": None, **LAYOUTS["default"]}
+    config = {"city": CITY, "plates": [plate], "history": {"file": str(tmp_path / "history.db"), "restore_max_age": 180}}
+    sender = MeteoFrance2OpenHasp(None)
+    assert sender.load_config(config)
+    sender._history.append(CITY, forecast)  # pylint: disable=protected-access
+    sender.dispose()
+    assert any(forecast["rain"])
+
+    def restored(now: int) -> dict:
+        monkeypatch.setattr(time, "time", lambda: now)
+        sender = MeteoFrance2OpenHasp(RecordingClient())  # type: ignore
+        assert sender.load_config(config)
+        assert sender.publish_last_snapshot()
+        r = sender._last_forecast  # pylint: disable=protected-access
+        sender.dispose()
+        return r
+
+    # 20 minutes later, what is left of the nowcast
+    now = forecast["time"] + 1200
+    r = restored(now)
+    assert r["rain"] == rain.resample([tuple(e) for e in forecast["rain_entries"]], now, NR_RAINSECTIONS, 600)
+    # past the nowcast horizon, no rain at all
+    r = restored(forecast["time"] + 7200)
+    assert r["rain"] == [None] * NR_RAINSECTIONS and r["rain_entries"] == []
@@ -0,0 +1,51 @@
+# The priority classes: once the publish deadline has passed, the classes that are left wait for the next
+# scan, and a class is never deferred two scans in a row, also with sends outside of the scans in between.
+
+import time
+
+from conftest import CITY, RecordingClient
+from test_command_stream import LAYOUTS, forecast  # noqa: F401, the fixture
+
+
+class SlowClient(RecordingClient):
+    """ a client that takes some time per message, so that any deadline passes """
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        time.sleep(0.001)
+        return super().publish(topic, payload, qos, retain)
+
+
+def test_deferred_at_most_one_scan(forecast):
+    from send_weather import MeteoFrance2OpenHasp, PRIO_DETAIL, PRIO_MAIN, PRIO_OVERVIEW
+
+    def pages() -> set[str]:
+        """ the pages sent to, like p2 """
+        return {topic.split("/")[3].split("b")[0] for topic, _ in client.published}
+
+    client = SlowClient()
+    sender = MeteoFrance2OpenHasp(client)  # type: ignore
+    plate = {"name": "plate01", "extra_tempnow": None, "extra_iconnow": None, **LAYOUTS["default"]}
+    # as short a deadline as possible: 0 disables it
+    assert sender.load_config({"city": CITY, "plates": [plate], "publish_deadline": 0.000001})
+
+    # only the current conditions in the first scan
+    sender.publish_forecast(forecast)
+    assert "p3" not in pages() and "p4" not in pages()
+    assert sender._deferred == {PRIO_MAIN, PRIO_OVERVIEW, PRIO_DETAIL}  # pylint: disable=protected-access
+
+    # a send outside of the scans, as after a configuration reload, does not change that
+    assert sender.publish_cached(["plate01"])
+    assert sender.publish_forecast(forecast, ["plate01"], scan=False)
+    assert sender._deferred == {PRIO_MAIN, PRIO_OVERVIEW, PRIO_DETAIL}  # pylint: disable=protected-access
+
+    # so the next scan sends everything
+    client.published.clear()
+    assert sender.publish_forecast(forecast)
+    assert {"p2", "p3", "p4"} <= pages()
+    assert not sender._deferred  # pylint: disable=protected-access
+
+    # and the one after that may defer again
+    client.published.clear()
+    sender.publish_forecast(forecast)
+    assert "p3" not in pages()
+    sender.dispose()
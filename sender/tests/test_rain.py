@@ -0,0 +1,107 @@
+# The rain nowcast resampler, compared to the bucketing it replaced, and on the edge cases of the nowcast.
+
+import random
+
+import pytest
+
+import rain
+
+MAX_RAIN = 8.0
+NOW = 1_775_295_600  # a whole hour
+
+
+def legacy_bucketing(entries: list[tuple[int, int]], now: int) -> list:
+    """ the bucketing of get_forecast() before the rain module: 6 sections of 10 minutes, averaged in order of arrival
+
+    Args:
+        entries (list[tuple[int, int]]): (timestamp, rain intensity), sorted on timestamp
+        now (int): timestamp of the start of the first section
+    """
+    rainlist: list = [None] * 6
+    for i, (dt, rain_intensity) in enumerate(entries):
+        duration = int((entries[i + 1][0] - dt) / 60) if i < len(entries) - 1 else 10
+        difft = int(round((dt - now) / 60))
+        if difft <= -10:
+            continue
+        difft = max(difft, 0)
+        offset = int(difft / 10)
+        remainder = int(difft % 10)
+        if offset < len(rainlist):
+            mm = rain.intensity_to_mm(rain_intensity, MAX_RAIN)
+            rainlist[offset] = mm if rainlist[offset] is None else (mm + rainlist[offset]) / 2
+            if (remainder + duration >= 15) and offset < (len(rainlist) - 1):
+                offset += 1
+                rainlist[offset] = mm if rainlist[offset] is None else (mm + rainlist[offset]) / 2
+    return rainlist
+
+
+def default_layout(intensities: list[int], start: int = NOW) -> list[tuple[int, int]]:
+    """ the layout of the Meteo France nowcast: 6 entries of 5 minutes, then 3 of 10 minutes """
+    times = [start + m * 60 for m in (0, 5, 10, 15, 20, 25, 30, 40, 50)]
+    return list(zip(times, intensities))
+
+
+def resample(entries: list[tuple[int, int]], now: int = NOW, nr_buckets: int = 6) -> list:
+    return rain.resample([(t, rain.intensity_to_mm(i, MAX_RAIN)) for t, i in entries], now, nr_buckets, 600)
+
+
+# number of random nowcasts of the property tests
+NR_CASES = 500
+
+
+def test_same_as_legacy_on_default_layout():
+    """ with the nowcast aligned on now, the time weighted average is what the legacy bucketing gave """
+    rng = random.Random(1)
+    for _ in range(NR_CASES):
+        entries = default_layout([rng.randint(1, 4) for _ in range(9)])
+        assert resample(entries) == pytest.approx(legacy_bucketing(entries, NOW)), entries
+
+
+def test_within_overlapping_values_when_misaligned():
+    """ with the nowcast not aligned on now, each section stays within the values of the entries over it """
+    rng = random.Random(2)
+    for _ in range(NR_CASES):
+        entries = default_layout([rng.randint(1, 4) for _ in range(9)], NOW - rng.randint(1, 599))
+        ends = [t for t, _ in entries[1:]] + [entries[-1][0] + 600]
+        for b, value in enumerate(resample(entries)):
+            start, end = NOW + b * 600, NOW + (b + 1) * 600
+            overlapping = [rain.intensity_to_mm(i, MAX_RAIN) for (t, i), t1 in zip(entries, ends) if t < end and t1 > start]
+            if not overlapping:
+                assert value is None, entries
+            else:
+                assert min(overlapping) - 1e-9 <= value <= max(overlapping) + 1e-9, entries
+
+
+def test_empty_forecast():
+    assert rain.resample([], NOW, 6) == [None] * 6
+    assert rain.resample_many([[], []], NOW, 3) == [[None] * 3, [None] * 3]
+
+
+def test_gap():
+    """ an entry is valid until the next one: a gap is filled by the entry before it """
+    entries = [(NOW, 4), (NOW + 5 * 60, 2), (NOW + 30 * 60, 1)]
+    assert resample(entries) == pytest.approx([(8 * 5 + 8 / 3 * 5) / 10, 8 / 3, 8 / 3, 0, None, None])
+
+
+def test_misaligned_timestamps():
+    """ the entries are weighted by their overlap with each section """
+    entries = [(NOW - 3 * 60, 4), (NOW + 7 * 60, 1), (NOW + 17 * 60, 3)]
+    # 7 minutes of 8, then 3 of 0 | 7 of 0, then 3 of 16/3 | 7 of 16/3, then nothing
+    assert resample(entries, nr_buckets=4) == pytest.approx([8 * 7 / 10, 16 / 3 * 3 / 10, 16 / 3, None])
+
+
+def test_final_partial_bucket():
+    """ the last entry lasts default_duration: a section it only partly covers gets its value, the next ones None """
+    entries = [(NOW, 2), (NOW + 10 * 60, 3), (NOW + 25 * 60, 4)]
+    assert resample(entries, nr_buckets=5) == pytest.approx([8 / 3, 16 / 3, (16 / 3 * 5 + 8 * 5) / 10, 8, None])
+
+
+def test_entries_before_now_are_ignored():
+    entries = [(NOW - 30 * 60, 4), (NOW - 20 * 60, 4), (NOW, 1)]
+    assert resample(entries, nr_buckets=2) == pytest.approx([0, None])
+
+
+def test_resample_many_same_as_resample():
+    rng = random.Random(1)
+    locations = [[(t, rain.intensity_to_mm(i, MAX_RAIN)) for t, i in default_layout([rng.randint(1, 4) for _ in range(9)])] for _ in range(5)]
+    assert rain.resample_many(locations, NOW, 6) == [rain.resample(entries, NOW, 6) for entries in locations]
@@ -0,0 +1,46 @@
+# The responses recorded from the API by record_fixtures.py: each recording gives a complete forecast,
+# that renders to every plate layout within the message and byte budgets.
+#
+# The values change from one recording to the next, so only the structure is checked here: the
+# golden files are based on the hand-made responses of tests/fixtures, see test_command_stream.py.
+
+import os
+
+import pytest
+
+from conftest import RECORDED_DIR, load_fixture, recordings, replay
+from test_command_stream import LAYOUTS, load_budgets, render
+
+NO_RECORDING = pytest.param(None, marks=pytest.mark.skip(reason="no recording in tests/fixtures/recorded, see record_fixtures.py"))
+
+
+@pytest.mark.parametrize("recording", recordings() or [NO_RECORDING])
+def test_recording(recording, monkeypatch):
+    import plate_simulator
+    from send_weather import MeteoFrance2OpenHasp, NR_HOURS_ON_MAIN_PAGE, NR_RAINSECTIONS
+
+    fixtures_dir = os.path.join(RECORDED_DIR, recording)
+    meta = load_fixture("meta.json", fixtures_dir)
+    assert meta.get("source") == "recorded"
+    replay(monkeypatch, fixtures_dir)
+    nr_days_detail = max(layout["nr_days_detail"] for layout in LAYOUTS.values())
+    sender = MeteoFrance2OpenHasp(None)
+    assert sender.load_config({"city": meta["city"], "plates": [{"name": "plate01", "start_page": 2, "nr_days_detail": nr_days_detail}]})
+    r = sender.get_forecast(meta["city"])
+    assert r["ok"], "get_forecast() failed on the recorded responses"
+
+    assert len(r["rain"]) == NR_RAINSECTIONS
+    assert r["rain_entries"] and all(ts >= meta["recorded_at"] - 600 for ts, _ in r["rain_entries"])
+    assert len(r["hourly"]) == NR_HOURS_ON_MAIN_PAGE and all(wf["dt"] > meta["recorded_at"] for wf in r["hourly"].values())
+    assert len(r["days"]) >= nr_days_detail
+
+    budgets = load_budgets()
+    for layout in sorted(LAYOUTS):
+        stream, _ = render(r, layout)
+        extra = {el for key, el in LAYOUTS[layout].items() if key != "timezone" and isinstance(el, str)}
+        report = plate_simulator.simulate(stream).report()
+        assert set(report["unknown_objects"]) <= extra, layout
+        assert not report["unknown_properties"], layout
+        nr_bytes = sum(len(topic) + len(payload.encode("utf-8")) for topic, payload in stream)
+        assert len(stream) <= budgets[layout]["messages"], f"{layout}: {len(stream)} messages"
+        assert nr_bytes <= budgets[layout]["bytes"], f"{layout}: {nr_bytes} bytes"
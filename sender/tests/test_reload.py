@@ -0,0 +1,86 @@
+# Reloading the configuration: an invalid configuration is not applied, and the current one stays in use.
+
+from typing import Optional
+
+import pytest
+import yaml
+
+from conftest import CITY
+from test_command_stream import LAYOUTS
+
+
+def write_config(path, plates: list[dict], sender: Optional[dict] = None, **sections):
+    config = {
+        "mqtt": {"mock": True},
+        "sender": {
+            "city": CITY,
+            "scan_interval": 10,
+            "plates": [{"extra_tempnow": None, "extra_iconnow": None, **LAYOUTS["default"], **p} for p in plates],
+            **(sender or {}),
+        },
+        **sections,
+    }
+    with open(path, "w", encoding="utf-8") as file:
+        yaml.safe_dump(config, file)
+
+
+# the bridge installs its own signal handlers
+@pytest.mark.usefixtures("restore_signals")
+def test_invalid_reload_keeps_config(tmp_path):
+    import bridge
+    import config_utils
+
+    config_file = tmp_path / "config.yaml"
+    secrets_file = tmp_path / "secrets.yaml"
+    secrets_file.write_text("{}\n", encoding="utf-8")
+    write_config(config_file, [{"name": "plate01"}])
+    config = config_utils.ConfigLoader(str(config_file), str(secrets_file))
+    config.load_config()
+    b = bridge.Bridge(config)
+    current = config.config
+
+    # a plate name used twice
+    write_config(config_file, [{"name": "plate01"}, {"name": "plate01", "start_page": 5}])
+    assert not b._reload_config()  # pylint: disable=protected-access
+    assert config.config is current
+    # an invalid value
+    write_config(config_file, [{"name": "plate01", "nr_days_detail": "two"}])
+    assert not b._reload_config()  # pylint: disable=protected-access
+    assert config.config is current
+    # an invalid section outside of the sender
+    write_config(config_file, [{"name": "plate01"}], tracing={"file": str(tmp_path / "trace.json"), "sample_rate": None})
+    assert not b._reload_config()  # pylint: disable=protected-access
+    assert config.config is current
+    diagnostics = b._diagnostics  # pylint: disable=protected-access
+    write_config(config_file, [{"name": "plate01"}], diagnostics={"enabled": True, "interval": "often"})
+    assert not b._reload_config()  # pylint: disable=protected-access
+    assert config.config is current and b._diagnostics is diagnostics  # pylint: disable=protected-access
+
+    # a valid one is applied, and compared to the configuration in use
+    write_config(config_file, [{"name": "plate01"}, {"name": "plate02"}])
+    assert not b._reload_config()  # pylint: disable=protected-access
+    assert [p["name"] for p in config.get("sender.plates")] == ["plate01", "plate02"]
+
+
+def test_invalid_sender_config_changes_nothing(tmp_path):
+    from send_weather import MeteoFrance2OpenHasp
+
+    def config(city: str, plates: list[str], **sections) -> dict:
+        return {
+            "city": city,
+            "plates": [{"name": name, "extra_tempnow": None, "extra_iconnow": None, **LAYOUTS["default"]} for name in plates],
+            **sections,
+        }
+
+    sender = MeteoFrance2OpenHasp(None)
+    assert sender.load_config(config(CITY, ["plate01"]))
+    assert not sender.load_config(config("Lyon", ["p2"], history={"file": str(tmp_path / "history.db"), "retention_days": "abc"}))
+    assert sender._city == CITY and [p["name"] for p in sender._plates] == ["plate01"]  # pylint: disable=protected-access
+    for ttl in ("abc", -1, 0):
+        assert not sender.load_config(config("Lyon", ["p2"], fetch_cache={"file": str(tmp_path / "cache.db"), "ttl": ttl}))
+    assert not sender.load_config(config("Lyon", ["p2"], fetch_cache={"file": str(tmp_path / "cache.db"), "places_ttl": "1d"}))
+    assert sender._city == CITY and sender._fetch_cache is None  # pylint: disable=protected-access
+    # a store that can not be opened is left out, like the fetch cache
+    assert sender.load_config(config("Nice", ["p2"], history={"file": str(tmp_path / "missing" / "history.db")}))
+    assert sender._history is None  # pylint: disable=protected-access
+    sender.dispose()
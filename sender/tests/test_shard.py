@@ -0,0 +1,51 @@
+# The shards: the plates are spread over worker processes, that keep running over configuration reloads
+# unless their plates change.
+
+from conftest import CITY
+from test_command_stream import LAYOUTS, forecast  # noqa: F401, the fixture
+
+
+def plates(*names: str) -> list[dict]:
+    return [{"name": name, "extra_tempnow": None, "extra_iconnow": None, **LAYOUTS["default"]} for name in names]
+
+
+def test_partition():
+    import shard
+
+    names = [f"plate0{i}" for i in range(1, 6)]
+    assert [[p["name"] for p in s] for s in shard.partition(plates(*names), 2)] == [["plate01", "plate03", "plate05"], ["plate02", "plate04"]]
+    # never more shards than plates, and at least one
+    assert len(shard.partition(plates("plate01", "plate02"), 4)) == 2
+    assert len(shard.partition(plates("plate01"), 0)) == 1
+
+
+def test_pool_round_trip(forecast):
+    import shard
+
+    # MQTT mock mode: the shards render, and log instead of publishing
+    config = {"city": CITY, "plates": plates("plate01", "plate02", "plate03", "plate04")}
+    pool = shard.ShardPool(config, 2, None)
+    pool.start()
+    try:
+        assert pool.publish(forecast, []) == {}
+        health = pool.health()
+        assert [(h["shard"], h["plates"], h["alive"], h["last_cycle"], h["last_ok"]) for h in health] == [
+            (1, ["plate01", "plate03"], True, 1, True),
+            (2, ["plate02", "plate04"], True, 1, True),
+        ]
+        pids = [p.pid for p in pool._processes]  # pylint: disable=protected-access
+
+        # another setting: the shards keep running
+        pool.reconfigure(dict(config, publish_trace=10))
+        assert [p.pid for p in pool._processes] == pids  # pylint: disable=protected-access
+        # a plate added to the first shard: only that one is restarted
+        pool.reconfigure(dict(config, plates=plates("plate01", "plate02", "plate03", "plate04", "plate05")))
+        new_pids = [p.pid for p in pool._processes]  # pylint: disable=protected-access
+        assert new_pids[0] != pids[0] and new_pids[1] == pids[1]
+        assert pool.health()[0]["plates"] == ["plate01", "plate03", "plate05"]
+
+        pool.publish(forecast, [])
+        assert all(h["last_cycle"] == 2 and h["last_ok"] for h in pool.health())
+    finally:
+        pool.close()
+    assert not any(h["alive"] for h in pool.health())
@@ -0,0 +1,76 @@
+# The state of the plates, for state_snapshot: kept on state topics, and only sent to a plate when it comes online.
+
+import time
+
+from conftest import CITY, RecordingClient
+from test_command_stream import LAYOUTS, forecast  # noqa: F401, the fixture
+
+
+def plate(name: str) -> dict:
+    return {"name": name, "extra_tempnow": "p11b7", "extra_iconnow": None, **LAYOUTS["default"]}
+
+
+def test_state_sent_when_online(forecast):
+    from send_weather import MeteoFrance2OpenHasp
+
+    client = RecordingClient()
+    sender = MeteoFrance2OpenHasp(client)  # type: ignore
+    assert sender.load_config({"city": CITY, "plates": [plate("plate01")], "state_snapshot": True})
+    assert sender.publish_forecast(forecast)
+    topics = [topic for topic, _ in client.published]
+    assert "hasp/plate01/state/jsonl" in topics and "hasp/plate01/state/p2" in topics
+    # the plates that stay online do not get their whole state on every cycle
+    assert "hasp/plate01/command/jsonl" not in topics
+    state = dict(client.published)["hasp/plate01/state/jsonl"]
+
+    client.published.clear()
+    assert sender.publish_forecast(forecast)
+    assert not [topic for topic, _ in client.published if "/state/" in topic], "an unchanged state is published again"
+
+    sender.plate_online("hasp/plate01/LWT", "offline")
+    sender.plate_online("hasp/plate02/LWT", "online")
+    assert not [topic for topic, _ in client.published if topic.endswith("/jsonl")]
+    sender.plate_online("hasp/plate01/LWT", "online")
+    assert client.published[-1] == ("hasp/plate01/command/jsonl", state)
+    sender.dispose()
+
+
+def test_state_cleared_for_removed_plates(forecast):
+    from send_weather import MeteoFrance2OpenHasp
+
+    client = RecordingClient()
+    sender = MeteoFrance2OpenHasp(client)  # type: ignore
+    assert sender.load_config({"city": CITY, "plates": [plate("plate01"), plate("plate02")], "state_snapshot": True})
+    assert sender.publish_forecast(forecast)
+    client.published.clear()
+
+    assert sender.load_config({"city": CITY, "plates": [plate("plate01")], "state_snapshot": True})
+    cleared = {topic for topic, payload in client.published if payload == ""}
+    assert {"hasp/plate02/state/jsonl", "hasp/plate02/state/p2", "hasp/plate02/state/p6", "hasp/plate02/state/p11"} <= cleared
+    assert all(topic.startswith("hasp/plate02/state/") for topic, _ in client.published)
+
+    client.published.clear()
+    assert sender.load_config({"city": CITY, "plates": [plate("plate01")], "state_snapshot": False})
+    assert {topic for topic, payload in client.published if payload == ""} >= {"hasp/plate01/state/jsonl"}
+    sender.plate_online("hasp/plate01/LWT", "online")
+    assert not [topic for topic, _ in client.published if topic.endswith("/command/jsonl")]
+    sender.dispose()
+
+
+def test_no_state_from_the_coordinator_with_shards(forecast):
+    """ with shards, the coordinator only sends the datasets: its state would replace the one of the shards """
+    from send_weather import MeteoFrance2OpenHasp
+
+    client = RecordingClient()
+    sender = MeteoFrance2OpenHasp(client)  # type: ignore
+    config = {"city": CITY, "plates": [dict(plate("plate01"), vigilance_banner="p11b8")], "state_snapshot": True, "datasets": {"vigilance": 10}}
+    assert sender.load_config(config)
+    sender.set_shards(object())  # type: ignore
+    vigilance = sender._datasets[0]  # pylint: disable=protected-access
+    vigilance.value = {"level": 3, "phenomenons": ["orages"]}
+    vigilance._fetched_at = time.monotonic()  # pylint: disable=protected-access
+    assert sender.refresh_datasets()
+    assert [topic for topic, _ in client.published if topic.startswith("hasp/plate01/command/p11b8")]
+    assert not [topic for topic, _ in client.published if "/state/" in topic]
+    sender.set_shards(None)
+    sender.dispose()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# Offline plate simulator: applies the command stream of the sender to the objects of files/pages_section.jsonl.
+#
+# The pages are loaded into an in-memory object model, and every command (pXbY.prop) is applied to it,
+# as a plate would. The report lists the commands that target an object or a property that does not
+# exist, the writes that do not change anything, and per page the number of effective changes.
+# Optionally, the pages are drawn to PNG files with the icons in img/ (needs Pillow).
+#
+# By default, the command stream comes from the sender itself, rendering a recorded forecast
+# (benchmarks/forecast.json) to one plate. A stream recorded elsewhere can be replayed instead:
+# one command per line, as "topic payload".
+#
+# Usage, from the sender folder:
+#     python3 tools/plate_simulator.py [--forecast FILE | --stream FILE] [--cycles 2] [--json] [--png DIR]
+# The exit code is 1 when there are commands to unknown objects or properties.
+
+import argparse
+import json
+import os
+import re
+import sys
+from collections import Counter, defaultdict
+from typing import Any, Iterable, Optional
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+SENDER_DIR = os.path.dirname(TOOLS_DIR)
+PACKAGE_DIR = os.path.join(SENDER_DIR, "meteofrance2openhasp")
+REPO_DIR = os.path.dirname(SENDER_DIR)
+PAGES_FILE = os.path.join(REPO_DIR, "files", "pages_section.jsonl")
+IMG_DIR = os.path.join(REPO_DIR, "img")
+FORECAST_FILE = os.path.join(SENDER_DIR, "benchmarks", "forecast.json")
+
+SCREEN_SIZE = (480, 320)
+
+# the properties of the openHASP objects that are used in the pages or by the sender
+COMMON_PROPERTIES = {
+    "x", "y", "w", "h", "hidden", "opacity", "enabled", "click", "swipe", "action", "comment",
+    "radius", "border_width", "border_color", "border_opa",
+    "bg_color", "bg_opa", "bg_grad_color", "bg_grad_dir", "bg_main_stop", "bg_grad_stop",
+    "text_color", "text_font",
+}
+OBJECT_PROPERTIES = {
+    "obj": set(),
+    "label": {"text", "align", "long", "template"},
+    "img": {"src", "zoom", "angle", "auto_size"},
+    "line": {"points", "line_width", "line_color", "line_opa", "line_rounded", "y_invert"},
+}
+
+TOPIC_RE = re.compile(r"^hasp/(?P<plate>[^/]+)/command/p(?P<page>\d+)b(?P<id>\d+)\.(?P<prop>\w+)$")
+
+
+def normalize(prop: str, value: Any) -> Any:
+    """ bring a property value from the pages file or from a command to a comparable form """
+    if isinstance(value, str):
+        text = value.strip()
+        if prop == "hidden" or prop == "line_rounded":
+            return text.lower() in ("1", "true", "on", "yes")
+        if prop == "points":
+            try:
+                return json.loads(text)
+            except ValueError:
+                return text
+        if prop != "text" and re.fullmatch(r"-?\d+", text):
+            return int(text)
+        return value
+    if isinstance(value, bool) or prop in ("hidden", "line_rounded"):
+        return bool(value)
+    return value
+
+
+class PlateSimulator:
+
+    def __init__(self, pages_file: str = PAGES_FILE):
+        """ load the pages into the object model
+
+        Args:
+            pages_file (str, optional): the pages, in openHASP jsonl. Defaults to files/pages_section.jsonl.
+        """
+        # per (page, id), the object type and its properties
+        self.objects: dict[tuple[int, int], dict[str, Any]] = {}
+        with open(pages_file, encoding="utf-8") as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                key = (int(item["page"]), int(item.get("id", 0)))
+                obj_type = item.get("obj", "page" if key[1] == 0 else "obj")
+                props = {k: normalize(k, v) for k, v in item.items() if k not in ("page", "id", "obj")}
+                self.objects[key] = {"obj": obj_type, "props": props}
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.nr_commands = 0
+        self.unknown_objects: Counter = Counter()
+        self.unknown_properties: Counter = Counter()
+        self.redundant: Counter = Counter()
+        self.changes_per_page: Counter = Counter()
+        self.commands_per_page: Counter = Counter()
+        self._written: set = set()
+        self.overwritten: Counter = Counter()
+
+    def start_cycle(self):
+        """ start a new cycle: overwrites are counted within a cycle """
+        self._written = set()
+
+    def apply(self, topic: str, payload: str) -> bool:
+        """ apply a command
+
+        Args:
+            topic (str): MQTT topic, hasp/<plate>/command/pXbY.prop
+            payload (str): the value
+
+        Returns:
+            bool: True when it changed the object
+        """
+        m = TOPIC_RE.match(topic)
+        if not m:
+            self.unknown_objects[topic] += 1
+            return False
+        self.nr_commands += 1
+        page, obj_id, prop = int(m.group("page")), int(m.group("id")), m.group("prop")
+        name = f"p{page}b{obj_id}"
+        self.commands_per_page[page] += 1
+        obj = self.objects.get((page, obj_id))
+        if obj is None:
+            self.unknown_objects[name] += 1
+            return False
+        if prop not in COMMON_PROPERTIES and prop not in OBJECT_PROPERTIES.get(obj["obj"], set()):
+            self.unknown_properties[f"{name}.{prop} ({obj['obj']})"] += 1
+            return False
+        if (page, obj_id, prop) in self._written:
+            self.overwritten[f"{name}.{prop}"] += 1
+        self._written.add((page, obj_id, prop))
+        value = normalize(prop, payload)
+        if obj["props"].get(prop) == value:
+            self.redundant[f"{name}.{prop}"] += 1
+            return False
+        obj["props"][prop] = value
+        self.changes_per_page[page] += 1
+        return True
+
+    def report(self) -> dict[str, Any]:
+        """ the counters, as a dict """
+        return {
+            "commands": self.nr_commands,
+            "effective_changes": sum(self.changes_per_page.values()),
+            "redundant_writes": sum(self.redundant.values()),
+            "overwrites_in_cycle": sum(self.overwritten.values()),
+            "unknown_objects": dict(self.unknown_objects),
+            "unknown_properties": dict(self.unknown_properties),
+            "pages": {
+                str(page): {"commands": self.commands_per_page[page], "changes": self.changes_per_page[page]}
+                for page in sorted(self.commands_per_page)
+            },
+        }
+
+    def render_png(self, page: int, file: str, img_dir: str = IMG_DIR):
+        """ draw a page to a PNG file. Approximate: no fonts, no alignment, no opacity.
+
+        Args:
+            page (int): page number
+            file (str): the PNG file to write
+            img_dir (str, optional): the directory with the icon PNGs. Defaults to img/.
+        """
+        from PIL import Image, ImageDraw  # pylint: disable=import-outside-toplevel
+
+        background = self.objects.get((page, 0), {"props": {}})["props"].get("bg_color", "white")
+        image = Image.new("RGB", SCREEN_SIZE, background)
+        draw = ImageDraw.Draw(image)
+        for (p, obj_id), obj in sorted(self.objects.items()):
+            props = obj["props"]
+            if p != page or obj_id == 0 or props.get("hidden"):
+                continue
+            x, y, w, h = (int(props.get(k, 0)) for k in ("x", "y", "w", "h"))
+            if obj["obj"] in ("obj", "label") and props.get("bg_opa", 0) and w > 0 and h > 0:
+                draw.rectangle([x, y, x + w - 1, y + h - 1], fill=props.get("bg_color", "white"))
+            if obj["obj"] == "label":
+                draw.text((x, y), str(props.get("text", "")), fill=props.get("text_color", "black"))
+            elif obj["obj"] == "img":
+                src = os.path.splitext(os.path.basename(str(props.get("src", ""))))[0]
+                icon = os.path.join(img_dir, f"{src}.png")
+                if os.path.exists(icon):
+                    with Image.open(icon) as im:
+                        im = im.convert("RGBA")
+                        image.paste(im, (x, y), im)
+            elif obj["obj"] == "line" and isinstance(props.get("points"), list) and len(props["points"]) > 1:
+                draw.line([tuple(pt) for pt in props["points"]], fill=props.get("line_color", "black"), width=int(props.get("line_width", 1)))
+        image.save(file)
+
+    @property
+    def pages(self) -> list[int]:
+        return sorted({page for page, _ in self.objects})
+
+
+def sender_stream(forecast_file: str = FORECAST_FILE, plate: Optional[dict] = None) -> list[tuple[str, str]]:
+    """ the command stream of the sender for a recorded forecast
+
+    Args:
+        forecast_file (str, optional): the recorded forecast, as get_forecast() returns it. Defaults to benchmarks/forecast.json.
+        plate (dict, optional): the plate configuration. Defaults to None: plate01, start page 2, 4 detail pages.
+
+    Returns:
+        list[tuple[str, str]]: (topic, payload)
+    """
+    if PACKAGE_DIR not in sys.path:
+        sys.path.insert(0, PACKAGE_DIR)
+    import history  # pylint: disable=import-outside-toplevel
+    from send_weather import MeteoFrance2OpenHasp  # pylint: disable=import-outside-toplevel
+
+    commands: list[tuple[str, str]] = []
+
+    class MessageInfo:
+        def wait_for_publish(self, timeout=None):
+            pass
+
+    class Client:
+        def publish(self, topic, payload=None, qos=0, retain=False):
+            commands.append((topic, payload))
+            return MessageInfo()
+
+    if plate is None:
+        plate = {"name": "plate01", "start_page": 2, "nr_days_detail": 4, "extra_tempnow": None, "extra_iconnow": None}
+    with open(forecast_file, encoding="utf-8") as file:
+        d = history.restore_keys(json.load(file))
+    sender = MeteoFrance2OpenHasp(Client())  # type: ignore
+    sender.load_config({"city": "Paris", "plates": [plate]})
+    sender.publish_forecast(d)
+    return commands
+
+
+def read_stream(file: str) -> list[tuple[str, str]]:
+    """ read a recorded command stream: one "topic payload" per line """
+    commands = []
+    with open(file, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line:
+                topic, _, payload = line.partition(" ")
+                commands.append((topic, payload))
+    return commands
+
+
+def simulate(commands: Iterable[tuple[str, str]], cycles: int = 1, pages_file: str = PAGES_FILE) -> PlateSimulator:
+    """ apply a command stream, one or more times, to fresh pages
+
+    Args:
+        commands (Iterable[tuple[str, str]]): (topic, payload)
+        cycles (int, optional): number of times the stream is applied. Defaults to 1.
+        pages_file (str, optional): the pages. Defaults to files/pages_section.jsonl.
+
+    Returns:
+        PlateSimulator: the simulator, with the counters of the last cycle
+    """
+    commands = list(commands)
+    sim = PlateSimulator(pages_file)
+    for _ in range(cycles):
+        sim.reset_counters()
+        for topic, payload in commands:
+            sim.apply(topic, payload)
+    return sim
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline openHASP plate simulator for meteofrance2openhasp.")
+    parser.add_argument("--forecast", default=FORECAST_FILE, help="Recorded forecast to render. Default: benchmarks/forecast.json")
+    parser.add_argument("--stream", default=None, help="Recorded command stream to replay instead, one \"topic payload\" per line")
+    parser.add_argument("--pages", default=PAGES_FILE, help="The pages. Default: files/pages_section.jsonl")
+    parser.add_argument("--cycles", type=int, default=1, help="Apply the stream this many times, and report on the last one. Default: 1")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--png", default=None, help="Directory where to draw each page to a PNG file (needs Pillow)")
+    args = parser.parse_args()
+
+    commands = read_stream(args.stream) if args.stream else sender_stream(args.forecast)
+    sim = simulate(commands, max(args.cycles, 1), args.pages)
+    report = sim.report()
+
+    if args.json:
+        print(json.dumps(report, indent=1))
+    else:
+        print(f"{report['commands']} commands, {report['effective_changes']} effective changes, "
+              f"{report['redundant_writes']} redundant writes, {report['overwrites_in_cycle']} overwrites")
+        for page, counts in report["pages"].items():
+            print(f"  page {page}: {counts['commands']:4d} commands, {counts['changes']:4d} changes")
+        for name, count in report["unknown_objects"].items():
+            print(f"  unknown object: {name} ({count}x)")
+        for name, count in report["unknown_properties"].items():
+            print(f"  unknown property: {name} ({count}x)")
+
+    if args.png:
+        os.makedirs(args.png, exist_ok=True)
+        for page in sim.pages:
+            sim.render_png(page, os.path.join(args.png, f"page{page}.png"))
+
+    return 1 if report["unknown_objects"] or report["unknown_properties"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())